@@ -1,14 +1,25 @@
 from flask import Flask
 from config import Config
 from flask_sqlalchemy import SQLAlchemy
+from app.logs import setup_logging
+from app.metrics import init_app as init_metrics
+from app.sprites import build_sprites_command
+from app.store import create_store
+from app.views import ViewCache
 
 app = Flask(__name__)
 app.config.from_object(Config)
+setup_logging(app.config)
 db = SQLAlchemy(app)
+store = create_store(app)
+view_cache = ViewCache(store, app.config['VIEW_CACHE_SIZE'])
+app.cli.add_command(build_sprites_command)
 
 from app.ui import bp as ui_bp
 from app.api import bp as api_bp
 
+# the hooks of a blueprint are only taken when it is registered
+init_metrics(app, api_bp)
 app.register_blueprint(ui_bp, url_prefix='/')
 app.register_blueprint(api_bp, url_prefix='/api')
 
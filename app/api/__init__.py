@@ -3,3 +3,6 @@ from flask import Blueprint
 bp = Blueprint('api', __name__)
 
 from app.api import routes
+from app.encoding import compress_response
+
+bp.after_request(compress_response)
@@ -1,29 +1,102 @@
+import logging
+import zlib
 from app import app
 from uuid import uuid4
 from app.api import bp
-from flask import Flask, render_template, json, request, session, abort, Response, flash, redirect, url_for
+from flask import Flask, render_template, json, jsonify, request, session, abort, Response, flash, redirect, url_for
 from markupsafe import escape
-from app import db
-from app.models import Lobby, Player, Card
+from app import db, metrics, store, view_cache
+from app.encoding import MSGPACK, accepted_encoding, accepted_mimetype, mark_encoded, should_compress
+from app.sprites import SPRITES_URL, sprite_map
+from app.store import OPEN, PHASES
+from fodinha import MAX_NAME_SIZE, MAX_PLAYERS, MIN_PLAYERS
+
+logger = logging.getLogger(__name__)
+
+# lobbies per page of /lobby/list, and the most a client can ask for
+LOBBY_PAGE_SIZE = 50
+MAX_LOBBY_PAGE_SIZE = 200
+
+def lobby_etag(lobby_id, *parts):
+    """Return the ETag of a view of the lobby in its current version
+
+    The store reads the version without loading the whole lobby, parts
+    tell apart the views of a same version (e.g. the cards of each player).
+    """
+    try:
+        version = store.version(lobby_id)
+    except KeyError:
+        logger.warning('lobby %s does not exist', lobby_id)
+        abort(404)
+    return '-'.join(str(part) for part in (store.epoch, lobby_id, version) + parts)
+
+def conditional(etag, view):
+    """Answer 304 if the client already has this ETag, else the JSON of view()"""
+    # weak: the ETag of a compressed answer is weak, see app.encoding
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(view())
+    response.set_etag(etag)
+    return response
+
+def cached_view(lobby_id, name, player_id=None):
+    """Answer a pre-encoded view of the lobby (see app.views), 304 if the client already has it
+
+    The view is in JSON or MessagePack and compressed as the client
+    accepts (see app.encoding), each variant is encoded once per version.
+    """
+    try:
+        views = view_cache.get(lobby_id)
+    except KeyError:
+        logger.warning('lobby %s does not exist', lobby_id)
+        abort(404)
+    mimetype = accepted_mimetype()
+    parts = (store.epoch, lobby_id, views.version, name)
+    if player_id is not None:
+        parts += (player_id,)
+    if mimetype == MSGPACK:
+        parts += ('msgpack',)
+    etag = '-'.join(str(part) for part in parts)
+
+    body = views.variant(name, player_id, mimetype, None)
+    encoding = accepted_encoding()
+    if encoding is not None and not should_compress(body):
+        encoding = None
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=encoding is not None)
+    else:
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        if encoding is not None:
+            response.set_data(views.variant(name, player_id, mimetype, encoding))
+            mark_encoded(response, encoding)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
 
 @bp.route("/lobby/<req_lobby_id>/delete", methods=["POST"])
-def del_lobby():
+def del_lobby(req_lobby_id):
     """Deletes the lobby the player is registered in, if and only if he's the creator"""
     try:
         lobby_id = int(escape(req_lobby_id))
     except ValueError:
-        print('[E: del_lobby] Value Error, can\'t convert lobby id {}'.format(req_lobby_id))
+        logger.warning('Value Error, can\'t convert lobby id %s', req_lobby_id)
         abort(400)
 
     if session['lobby_id'] != lobby_id:
-        print('[E: del_lobby] trying to delete lobby {} while being in lobby {}'.format(lobby_id, session['lobby_id']))
+        logger.warning('trying to delete lobby %s while being in lobby %s', lobby_id, session['lobby_id'])
         abort(403)
 
     if not session['is_creator']:
-        print('[E: del_lobby] trying to delete lobby {} while not being its creator'.format(lobby_id))
+        logger.warning('trying to delete lobby %s while not being its creator', lobby_id)
         abort(403)
 
-    lobbies.pop(lobby_id)
+    try:
+        store.delete(lobby_id)
+    except KeyError:
+        logger.warning('lobby %s does not exist', lobby_id)
+        abort(404)
 
     return Response(status=200)
 
@@ -37,86 +110,273 @@ def register_player(req_lobby_id):
 
     name = escape(request.form.get('name'))
     if name is None:
-        print('[E: register_player] No data is posted')
+        logger.warning('No data is posted')
+        abort(400)
+    if len(name.encode('utf-8')) > MAX_NAME_SIZE:
+        logger.warning('name longer than %s bytes: %s', MAX_NAME_SIZE, name)
         abort(400)
 
     try:
         lobby_id = int(escape(req_lobby_id))
     except ValueError:
-        print('[E: register_player] Value Error, can\'t convert lobby id {}'.format(req_lobby_id))
+        logger.warning('Value Error, can\'t convert lobby id %s', req_lobby_id)
         abort(400)
 
     try:
-        player_id = lobbies[lobby_id].register_player(name)
+        with store.edit(lobby_id) as lobby:
+            player_id = lobby.register_player(name)
+            if player_id == lobby.number_of_players - 1:
+                logger.info('all players have joined lobby %s, starting game', lobby_id,
+                            extra={'lobby_id': lobby_id})
+                lobby.start_game()
+    except KeyError:
+        logger.warning('lobby %s does not exist', lobby_id)
+        abort(404)
     except RuntimeError:
-        print('[E: register_player] Runtime Error, can\'t register player to lobby {}'.format(lobby_id))
+        logger.warning('Runtime Error, can\'t register player to lobby %s', lobby_id)
         abort(403)
+    except ValueError as error:
+        # name too long
+        logger.warning('%s', error)
+        abort(400)
 
     session['name'] = name
     session['lobby_id'] = lobby_id
     session['player_id'] = player_id
     session['is_creator'] = False
-    print('[I] added player {} of ID {} to lobby n°{}'.format(name, player_id, lobby_id))
+    logger.info('added player %s of ID %s to lobby n°%s', name, player_id, lobby_id,
+                extra={'lobby_id': lobby_id, 'player_id': player_id})
 
-    if player_id == lobbies[lobby_id].number_of_players - 1:
-        print('[I] all players have joined lobby {}, starting game'.format(lobby_id))
-        lobbies[lobby_id].start_game()
-    elif player_id == 0:
+    if player_id == 0:
         session['is_creator'] = True
 
     return Response(status=200)
 
 @bp.route('/lobby/status', methods=["GET"])
 def get_status():
-    """Returns the status of the current game"""
+    """Returns the status of the current game
+
+    With ?since=<seq>, only returns the events logged after the sequence
+    number seq (see Lobby.events_since) instead of the full status.
+    """
+    if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
+        logger.warning('corrupted session')
+        abort(500)
+
+    lobby_id = session['lobby_id']
+    since = request.args.get('since', type=int)
+    if since is not None:
+        def events():
+            try:
+                with store.read(lobby_id) as lobby:
+                    return lobby.events_since(since)
+            except KeyError:
+                logger.warning('lobby %s does not exist', lobby_id)
+                abort(404)
+        return conditional(lobby_etag(lobby_id, 'since', since), events)
+    return cached_view(lobby_id, 'status')
+
+
+@bp.route('/lobby/wait', methods=["GET"])
+def wait_status():
+    """Long-poll: returns the status once its version is above the given one
+
+    Answers 304 if nothing changed before LONGPOLL_TIMEOUT, the client
+    then simply calls again with the same version.
+    """
+    if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
+        logger.warning('corrupted session')
+        abort(500)
+
+    version = request.args.get('version', default=-1, type=int)
+    try:
+        changed = store.wait(session['lobby_id'], version, app.config['LONGPOLL_TIMEOUT'])
+    except KeyError:
+        logger.warning('lobby %s does not exist', session['lobby_id'])
+        abort(404)
+
+    if not changed:
+        return Response(status=304)
+    return cached_view(session['lobby_id'], 'status')
+
+@bp.route('/lobby/guess', methods=["POST"])
+def guess():
+    """Make the guess of the player for the current gameturn"""
+    if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
+        logger.warning('corrupted session')
+        abort(500)
+
+    try:
+        given_guess = int(request.form.get('guess'))
+    except (TypeError, ValueError):
+        logger.warning('can\'t convert guess %s', request.form.get('guess'))
+        abort(400)
+    if given_guess < 0:
+        logger.warning('negative guess %s', given_guess)
+        abort(400)
+
+    try:
+        with store.edit(session['lobby_id']) as lobby:
+            lobby.guess(session['player_id'], given_guess)
+        metrics.count_action(session['lobby_id'], 'guess')
+    except KeyError:
+        logger.warning('lobby %s does not exist', session['lobby_id'])
+        abort(404)
+    except RuntimeError as error:
+        logger.warning('%s', error)
+        abort(403)
+    except ValueError as error:
+        # forbidden guess in the 'pé' position
+        logger.warning('%s', error)
+        abort(400)
+
+    return Response(status=200)
+
+@bp.route('/lobby/play', methods=["POST"])
+def play():
+    """Play one of the cards of the player, given its index in his hand"""
     if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
-        print('[E: list_players] corrupted session')
+        logger.warning('corrupted session')
         abort(500)
 
-    return lobbies[session['lobby_id']].status()
+    try:
+        card_index = int(request.form.get('card_index'))
+    except (TypeError, ValueError):
+        logger.warning('can\'t convert card index %s', request.form.get('card_index'))
+        abort(400)
+    if card_index < 0:
+        logger.warning('negative card index %s', card_index)
+        abort(400)
+
+    try:
+        with store.edit(session['lobby_id']) as lobby:
+            lobby.play(session['player_id'], card_index)
+        metrics.count_action(session['lobby_id'], 'play')
+    except KeyError:
+        logger.warning('lobby %s does not exist', session['lobby_id'])
+        abort(404)
+    except RuntimeError as error:
+        logger.warning('%s', error)
+        abort(403)
+    except ValueError as error:
+        # incorrect card index
+        logger.warning('%s', error)
+        abort(400)
 
+    return Response(status=200)
 
 @bp.route('/players/list', methods=["GET"])
 def list_players():
     """Get list of players"""
     if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
-        print('[E: list_players] corrupted session')
+        logger.warning('corrupted session')
         abort(500)
 
-    return lobbies[session['lobby_id']].get_players()
+    lobby_id = session['lobby_id']
+    return cached_view(lobby_id, 'players')
 
 @bp.route('/lobby/list', methods=["GET"])
 def list_lobbies():
-    return {'lobbies': lobbies}
+    """List the lobbies a page at a time, oldest first
+
+    Optional query parameters:
+    offset, limit: the page, limit is at most MAX_LOBBY_PAGE_SIZE
+    phase: only the lobbies 'open' (waiting for players), 'running' or 'finished'
+    open=1: only the lobbies with free seats, same as phase=open
+    players: only the lobbies for this number of players
+    prefix: only the lobbies with a player whose name starts with it (any case)
+    """
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = min(int(request.args.get('limit', LOBBY_PAGE_SIZE)), MAX_LOBBY_PAGE_SIZE)
+        number_of_players = request.args.get('players')
+        if number_of_players is not None:
+            number_of_players = int(number_of_players)
+    except ValueError:
+        logger.warning('can\'t convert the paging parameters %s', request.args.to_dict())
+        abort(400)
+    if offset < 0 or limit < 0:
+        abort(400)
+    # the last player to join starts the game: a lobby has free seats until it runs
+    phase = OPEN if request.args.get('open') in ('1', 'true') else request.args.get('phase')
+    if phase is not None and phase not in PHASES:
+        logger.warning('unknown phase %s', phase)
+        abort(400)
+    prefix = request.args.get('prefix', '').lower()
+
+    def view():
+        lobbies, total = store.page(phase, offset, limit, number_of_players, prefix)
+        return {'lobbies': lobbies,
+                'total': total,
+                'offset': offset,
+                'limit': limit}
+
+    # the summaries only change with the generation of the store
+    etag = '-'.join(str(part) for part in (store.epoch, 'lobbies', store.generation(), offset, limit,
+                                           phase, number_of_players, zlib.crc32(prefix.encode())))
+    return conditional(etag, view)
 
 @bp.route('/players/cards', methods=["GET"])
 def get_cards():
     """Get cards of a player"""
     if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
-        print('[E: list_players] corrupted session')
+        logger.warning('corrupted session')
+        abort(500)
+
+    lobby_id, player_id = session['lobby_id'], session['player_id']
+    return cached_view(lobby_id, 'cards', player_id)
+
+@bp.route('/players/hint', methods=["GET"])
+def get_hint():
+    """Get the suggested guess of a player and the tricks its hand wins on average (see fodinha.tables)"""
+    if session['name'] == None or session['lobby_id'] == None or session['player_id'] == None:
+        logger.warning('corrupted session')
         abort(500)
 
-    return lobbies[session['lobby_id']].get_cards(session['player_id'])
+    lobby_id, player_id = session['lobby_id'], session['player_id']
+
+    def view():
+        try:
+            with store.read(lobby_id) as lobby:
+                return {'guess': lobby.suggest_guess(player_id),
+                        'expected_tricks': lobby.expected_tricks(player_id)}
+        except KeyError:
+            logger.warning('lobby %s does not exist', lobby_id)
+            abort(404)
+        except RuntimeError:
+            # no gameturn dealt yet
+            abort(404)
+        except FileNotFoundError:
+            logger.error('no expected tricks table, run python -m fodinha.tables')
+            abort(404)
+
+    return conditional(lobby_etag(lobby_id, 'hint', player_id), view)
+
+@bp.route('/cards/atlas', methods=["GET"])
+def card_atlas():
+    """Get the sprite atlas of the cards: its URL and where each card is in it (see app.sprites)"""
+    if sprite_map is None:
+        abort(404)
+    return conditional(sprite_map['image'],
+                       lambda: dict(sprite_map, url=SPRITES_URL + sprite_map['image']))
 
 @bp.route("/lobby/add", methods=["POST"])
 def add_lobby():
-    if len(lobbies) > 3:
-        # for now only allowing three simultaneous lobbies
-        flash('Já foram criados 3 jogos')
-        return redirect(url_for('ui.index'))
-
-    lobby_id = len(lobbies)
     req_nb_players = request.form.get('nb_players')
     try:
         nb_players = int(escape(req_nb_players))
     except ValueError:
-        print('[E] can\'t convert to int: {}'.format(req_nb_players))
+        logger.warning('can\'t convert to int: %s', req_nb_players)
+        abort(400)
+    if not MIN_PLAYERS <= nb_players <= MAX_PLAYERS:
+        logger.warning('lobby of %s players refused', nb_players)
         abort(400)
 
-    lobbies.append(Lobby(lobby_id, nb_players))
-    print('[I] new lobby created: {} players, of ID {}'.format(nb_players, lobby_id))
+    lobby_id = store.create(nb_players)
+    logger.info('new lobby created: %s players, of ID %s', nb_players, lobby_id,
+                extra={'lobby_id': lobby_id, 'number_of_players': nb_players})
 
-    return redirect(url_for('ui.lobby'))
+    return redirect(url_for('ui.index'))
 
 @bp.route("/lobby/join", methods=["POST"])
 def join_lobby():
@@ -0,0 +1,482 @@
+"""ASGI server mode: uvicorn asgi:application
+
+The Flask app is served unchanged through asgiref's WsgiToAsgi, its views
+run in a thread pool. The endpoints that keep a player waiting, or that
+every player hits at each action, are served on the event loop instead,
+so that an idle player costs a coroutine and not a thread:
+
+* GET /api/lobby/wait?version=   long-poll, same answers as the Flask view
+* GET /api/lobby/events?version= server-sent events: a 'status' event for
+  every new version of the lobby, the event ID is the version
+* POST /api/lobby/guess, /api/lobby/play: same form and answers as the
+  Flask views. The edits of a lobby are serialized with its asyncio.Lock,
+  and run in the default executor so that a slow store never blocks the loop.
+* WebSocket /api/lobby/socket: guesses and plays in, the state of the
+  table out after every change, see game_socket
+
+The session is the Flask session cookie, read with the serializer of the
+app. The loop learns about the edits (made by a coroutine or by a Flask
+view in a thread) through the listener of the store, so run a single
+process with an in-process store (memory, journal or sqlalchemy).
+The native views are counted in the metrics of app.metrics like the Flask ones.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+
+from app import app, metrics, store, view_cache
+
+logger = logging.getLogger(__name__)
+
+flask_application = WsgiToAsgi(app)
+
+
+class LobbyChanges:
+    """Wake up the coroutines waiting for a change of a lobby"""
+
+    def __init__(self):
+        self.loop = None
+        # lobby_id -> event set at the next change, then replaced
+        self._events = {}
+
+    def start(self, loop):
+        """Listen to the store, from the event loop"""
+        if self.loop is None:
+            self.loop = loop
+            store.add_listener(self.changed)
+
+    def changed(self, lobby_id):
+        # called from the thread of the edit
+        self.loop.call_soon_threadsafe(self._wake_up, lobby_id)
+
+    def _wake_up(self, lobby_id):
+        event = self._events.pop(lobby_id, None)
+        if event is not None:
+            event.set()
+        channels.changed(lobby_id)
+
+    async def wait(self, lobby_id, version, timeout):
+        """Wait until the version of the lobby is above the given one
+
+        Return True if it is, False if the timeout expired first.
+        KeyError if the lobby does not exist (anymore).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while store.version(lobby_id) <= version:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            event = self._events.get(lobby_id)
+            if event is None:
+                event = self._events[lobby_id] = asyncio.Event()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+changes = LobbyChanges()
+
+# one lock per lobby, forgotten when no coroutine uses it anymore
+lobby_locks = weakref.WeakValueDictionary()
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def get_session(scope):
+    """Return the Flask session of the request, empty if missing or not signed"""
+    cookie = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(app.session_cookie_name)
+    if morsel is None:
+        return {}
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return serializer.loads(morsel.value, max_age=app.permanent_session_lifetime.total_seconds())
+    except BadSignature:
+        return {}
+
+
+def player_session(scope):
+    """Return the session of a registered player, 500 like the Flask views if it isn't"""
+    session = get_session(scope)
+    if session.get('name') is None or session.get('lobby_id') is None or session.get('player_id') is None:
+        logger.warning('corrupted session')
+        raise HTTPError(500)
+    return session
+
+
+def query_int(scope, name, default):
+    """Return an integer query parameter, 400 if it is not one"""
+    values = parse_qs(scope['query_string'].decode('latin-1')).get(name)
+    if not values:
+        return default
+    try:
+        return int(values[0])
+    except ValueError:
+        logger.warning('can\'t convert %s %s', name, values[0])
+        raise HTTPError(400)
+
+
+async def read_form(receive):
+    """Return the urlencoded form posted in the request body"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return {name: values[0] for name, values in parse_qs(body.decode('utf-8')).items()}
+
+
+async def respond(send, status, body=b'', content_type='application/json', headers=()):
+    await send({'type': 'http.response.start',
+                'status': status,
+                'headers': [(b'content-type', content_type.encode()),
+                            (b'content-length', str(len(body)).encode())] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def get_views(lobby_id):
+    """Return the encoded views of the lobby (see app.views), 404 if it does not exist (anymore)"""
+    try:
+        return view_cache.get(lobby_id)
+    except KeyError:
+        logger.warning('lobby %s does not exist', lobby_id)
+        raise HTTPError(404)
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def edit(lobby_id, action):
+    """Run action(lobby) inside store.edit, one coroutine per lobby at a time
+
+    The errors of the engine become the statuses of the Flask views.
+    """
+    lock = lobby_locks.get(lobby_id)
+    if lock is None:
+        lock = lobby_locks[lobby_id] = asyncio.Lock()
+
+    def run():
+        with store.edit(lobby_id) as lobby:
+            action(lobby)
+
+    async with lock:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, run)
+        except KeyError:
+            logger.warning('lobby %s does not exist', lobby_id)
+            raise HTTPError(404)
+        except RuntimeError as error:
+            logger.warning('%s', error)
+            raise HTTPError(403)
+        except ValueError as error:
+            # forbidden guess in the 'pé' position, or incorrect card index
+            logger.warning('%s', error)
+            raise HTTPError(400)
+
+
+async def wait_status(scope, receive, send):
+    """Long-poll: the status once its version is above the given one, 304 after LONGPOLL_TIMEOUT"""
+    session = player_session(scope)
+    version = query_int(scope, 'version', -1)
+    try:
+        changed = await changes.wait(session['lobby_id'], version, app.config['LONGPOLL_TIMEOUT'])
+    except KeyError:
+        logger.warning('lobby %s does not exist', session['lobby_id'])
+        raise HTTPError(404)
+    if not changed:
+        await respond(send, 304)
+        return
+    await respond(send, 200, get_views(session['lobby_id']).status)
+
+
+async def status_events(scope, receive, send):
+    """Server-sent events: the status at each new version, until the client leaves"""
+    session = player_session(scope)
+    lobby_id = session['lobby_id']
+    version = query_int(scope, 'version', -1)
+    for name, value in scope['headers']:
+        # a reconnecting EventSource resumes after the last event it got
+        if name == b'last-event-id' and value.isdigit():
+            version = int(value)
+
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    await send({'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'),
+                            (b'cache-control', b'no-cache')]})
+    try:
+        while not disconnected.done():
+            try:
+                changed = await changes.wait(lobby_id, version, app.config['LONGPOLL_TIMEOUT'])
+                views = changed and get_views(lobby_id)
+            except (KeyError, HTTPError):
+                chunk = b'event: deleted\ndata: {}\n\n'
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                break
+            if changed:
+                version = views.version
+                chunk = b'id: %d\nevent: status\ndata: %s\n\n' % (version, views.status)
+            else:
+                # keeps proxies from closing an idle connection
+                chunk = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        disconnected.cancel()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def guess(scope, receive, send):
+    """Make the guess of the player for the current gameturn"""
+    session = player_session(scope)
+    form = await read_form(receive)
+    try:
+        given_guess = int(form.get('guess'))
+    except (TypeError, ValueError):
+        logger.warning('can\'t convert guess %s', form.get('guess'))
+        raise HTTPError(400)
+    if given_guess < 0:
+        logger.warning('negative guess %s', given_guess)
+        raise HTTPError(400)
+    await edit(session['lobby_id'], lambda lobby: lobby.guess(session['player_id'], given_guess))
+    metrics.count_action(session['lobby_id'], 'guess')
+    await respond(send, 200, content_type='text/html; charset=utf-8')
+
+
+async def play(scope, receive, send):
+    """Play one of the cards of the player, given its index in his hand"""
+    session = player_session(scope)
+    form = await read_form(receive)
+    try:
+        card_index = int(form.get('card_index'))
+    except (TypeError, ValueError):
+        logger.warning('can\'t convert card index %s', form.get('card_index'))
+        raise HTTPError(400)
+    if card_index < 0:
+        logger.warning('negative card index %s', card_index)
+        raise HTTPError(400)
+    await edit(session['lobby_id'], lambda lobby: lobby.play(session['player_id'], card_index))
+    metrics.count_action(session['lobby_id'], 'play')
+    await respond(send, 200, content_type='text/html; charset=utf-8')
+
+
+def state_messages(views, seats):
+    """Return {seat: state message} for the given seats, None being the spectators
+
+    The public view is encoded once per version (see app.views), the
+    messages of the seats only add their cards to it.
+    """
+    public = views.public.decode()
+    messages = {}
+    for seat in seats:
+        if seat is None:
+            messages[seat] = '{"type": "state", "public": %s}' % public
+        else:
+            messages[seat] = '{"type": "state", "public": %s, "cards": %s}' % (public, views.hands[seat].decode())
+    return messages
+
+
+class Channels:
+    """Push the state of the lobbies to their WebSocket connections
+
+    A change of a lobby schedules one broadcast to all its connections,
+    the changes made before it runs are sent by the same broadcast: one
+    store read and one encoding of the public view per batch of changes.
+    """
+
+    def __init__(self):
+        # lobby_id -> {ASGI send of a connection: its seat, None for a spectator}
+        self._connections = {}
+        self._pending = set()
+
+    def join(self, lobby_id, send, seat):
+        self._connections.setdefault(lobby_id, {})[send] = seat
+
+    def leave(self, lobby_id, send):
+        connections = self._connections.get(lobby_id, {})
+        connections.pop(send, None)
+        if not connections:
+            self._connections.pop(lobby_id, None)
+
+    def changed(self, lobby_id):
+        """Schedule a broadcast, from the event loop"""
+        if lobby_id in self._connections and lobby_id not in self._pending:
+            self._pending.add(lobby_id)
+            asyncio.ensure_future(self.broadcast(lobby_id))
+
+    async def broadcast(self, lobby_id):
+        # lets the other changes of this loop iteration join the batch
+        await asyncio.sleep(0)
+        self._pending.discard(lobby_id)
+        connections = list(self._connections.get(lobby_id, {}).items())
+        if not connections:
+            return
+        try:
+            messages = state_messages(view_cache.get(lobby_id), {seat for _, seat in connections})
+        except KeyError:
+            await asyncio.gather(*(self.close(send) for send, _ in connections), return_exceptions=True)
+            return
+        # a slow connection does not delay the others
+        await asyncio.gather(*(send({'type': 'websocket.send', 'text': messages[seat]})
+                               for send, seat in connections), return_exceptions=True)
+
+    async def close(self, send):
+        await send({'type': 'websocket.send', 'text': '{"type": "deleted"}'})
+        await send({'type': 'websocket.close', 'code': 1000})
+
+
+channels = Channels()
+
+
+async def game_socket(scope, receive, send):
+    """WebSocket channel of a player, or of a spectator with ?lobby_id=
+
+    The client sends {"action": "guess", "guess": n} or
+    {"action": "play", "card_index": i}, with the same rules as the POST
+    endpoints. The server sends:
+    * {"type": "state", "public": {...}, "cards": [...]} on connection and
+      after every change of the lobby. public is the status plus the
+      players and card_counts, cards the hand of the player (not sent to
+      spectators). Use public.version to drop an outdated state.
+    * {"type": "error", "action": ..., "status": 400|403|404} when an
+      action is refused, to its sender only
+    * {"type": "deleted"} when the lobby is deleted, then the server closes the socket
+    """
+    await receive()
+    session = get_session(scope)
+    if session.get('lobby_id') is not None and session.get('player_id') is not None:
+        lobby_id, seat = session['lobby_id'], session['player_id']
+    else:
+        try:
+            lobby_id, seat = query_int(scope, 'lobby_id', None), None
+        except HTTPError:
+            lobby_id = None
+    try:
+        views = view_cache.get(lobby_id)
+    except KeyError:
+        # closing before accepting refuses the handshake
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def send_text(text):
+        await send({'type': 'websocket.send', 'text': text})
+
+    channels.join(lobby_id, send, seat)
+    try:
+        await send_text(state_messages(views, [seat])[seat])
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            try:
+                action = json.loads(message.get('text') or '')
+                name = action['action']
+            except (ValueError, TypeError, KeyError):
+                await send_text(json.dumps({'type': 'error', 'action': None, 'status': 400}))
+                continue
+            try:
+                if seat is None:
+                    raise HTTPError(403)
+                if name == 'guess':
+                    given_guess = int(action['guess'])
+                    await edit(lobby_id, lambda lobby: lobby.guess(seat, given_guess))
+                    metrics.count_action(lobby_id, 'guess')
+                elif name == 'play':
+                    card_index = int(action['card_index'])
+                    await edit(lobby_id, lambda lobby: lobby.play(seat, card_index))
+                    metrics.count_action(lobby_id, 'play')
+                else:
+                    raise HTTPError(400)
+            except (KeyError, TypeError, ValueError):
+                await send_text(json.dumps({'type': 'error', 'action': name, 'status': 400}))
+            except HTTPError as error:
+                await send_text(json.dumps({'type': 'error', 'action': name, 'status': error.status}))
+    finally:
+        channels.leave(lobby_id, send)
+
+
+ROUTES = {
+        ('GET', '/api/lobby/wait'): wait_status,
+        ('GET', '/api/lobby/events'): status_events,
+        ('POST', '/api/lobby/guess'): guess,
+        ('POST', '/api/lobby/play'): play,
+        }
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            changes.start(asyncio.get_running_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    # servers without lifespan support
+    changes.start(asyncio.get_running_loop())
+
+    if scope['type'] == 'websocket':
+        if scope['path'] == '/api/lobby/socket':
+            await game_socket(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    view = ROUTES.get((scope.get('method'), scope['path']))
+    if view is None:
+        await flask_application(scope, receive, send)
+        return
+
+    if not app.config['METRICS']:
+        await run_view(view, scope, receive, send)
+        return
+
+    # the Flask views are measured by app.metrics, these ones here
+    start = time.perf_counter()
+    status = 500
+
+    async def send_status(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    try:
+        await run_view(view, scope, receive, send_status)
+    finally:
+        metrics.observe_request(scope['path'], scope['method'], status, time.perf_counter() - start)
+
+
+async def run_view(view, scope, receive, send):
+    """Run a native view, an HTTPError becomes its status"""
+    try:
+        await view(scope, receive, send)
+    except HTTPError as error:
+        await respond(send, error.status, content_type='text/html; charset=utf-8')
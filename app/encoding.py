@@ -0,0 +1,89 @@
+"""Content negotiation of the API answers: compression and MessagePack
+
+* Accept-Encoding: br (when the brotli module is installed) or gzip: the
+  JSON answers of at least COMPRESS_MIN_SIZE bytes are compressed
+* Accept: application/msgpack (when the msgpack module is installed): the
+  status, players and cards views are MessagePack instead of JSON
+
+A compressed answer gets a weak ETag, If-None-Match still matches it (the
+views compare with contains_weak). The views of app.views are converted
+and compressed once per lobby version, see LobbyViews.variant; the other
+answers are compressed by compress_response, after the request.
+"""
+import gzip
+import json
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+# brotli 5 compresses about as fast as gzip 6, and smaller
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def accepted_encoding():
+    """Return the compression the client prefers, 'br', 'gzip' or None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def accepted_mimetype():
+    """Return MSGPACK if the client prefers it to JSON, else JSON"""
+    if msgpack is not None and request.accept_mimetypes.best_match([JSON, MSGPACK]) == MSGPACK:
+        return MSGPACK
+    return JSON
+
+
+def compress(body, encoding):
+    """Return the body compressed with 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def to_msgpack(body):
+    """Return the MessagePack of a JSON body"""
+    return msgpack.packb(json.loads(body))
+
+
+def should_compress(body):
+    return len(body) >= current_app.config['COMPRESS_MIN_SIZE']
+
+
+def mark_encoded(response, encoding):
+    """Set the headers of a response whose body is compressed with encoding"""
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    """Compress a JSON answer if it is large enough and the client accepts it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in (JSON, MSGPACK)):
+        return response
+    # the answer depends on Accept-Encoding, even when it is not compressed
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    body = response.get_data()
+    if encoding is not None and should_compress(body):
+        response.set_data(compress(body, encoding))
+        mark_encoded(response, encoding)
+    return response
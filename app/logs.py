@@ -0,0 +1,112 @@
+"""Logging of the engine (fodinha) and of the API (app.api)
+
+Records are written as one line of key=value pairs: the usual time, level,
+logger and function, the message, then every field given with extra=:
+
+    logger.info('new lobby created', extra={'lobby_id': lobby_id})
+
+Writing to stderr may block under uWSGI, so the request threads only put
+the records in a queue, a listener thread of the same process does the I/O.
+
+Levels are set with LOG_LEVEL (root level) and LOG_LEVELS, a comma
+separated list of logger=LEVEL overriding it for some modules:
+
+    LOG_LEVELS='fodinha=DEBUG,app.api=WARNING'
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# attributes every LogRecord has, anything else was given with extra=
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Format a record as key=value pairs, extra fields included"""
+
+    def __init__(self):
+        super().__init__('time=%(asctime)s level=%(levelname)s logger=%(name)s func=%(funcName)s msg="%(message)s"')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ['{}={}'.format(key, value) for key, value in vars(record).items()
+                  if key not in STANDARD_ATTRIBUTES and not key.startswith('_')]
+        if fields:
+            line = ' '.join([line] + fields)
+        return line
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Queue the records, a listener thread hands them to the real handlers
+
+    uWSGI forks the workers after the app is loaded, and threads don't
+    survive a fork: the listener is started by the first record of each
+    process instead of at setup.
+    """
+
+    def __init__(self, *handlers):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # a queue inherited from the parent process may hold its records
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, *self.handlers,
+                                                            respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Flush the queued records and stop the listener"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                self._listener.stop()
+            self._pid = None
+
+    def prepare(self, record):
+        # QueueHandler formats the message here, on the request thread:
+        # the listener runs in this process, it can do it on its own
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+
+def parse_levels(levels):
+    """Return {logger name: level} from 'name=LEVEL,name=LEVEL'"""
+    parsed = {}
+    for item in levels.split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        if not level:
+            raise ValueError('LOG_LEVELS items must be name=LEVEL, got {}'.format(item))
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def setup_logging(config):
+    """Send the records of all the loggers through the background handler"""
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(KeyValueFormatter())
+    handler = BackgroundHandler(stream)
+    atexit.register(handler.stop)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'].upper())
+    for name, level in parse_levels(config['LOG_LEVELS']).items():
+        logging.getLogger(name).setLevel(level)
+    return handler
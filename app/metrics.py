@@ -0,0 +1,267 @@
+"""Request metrics and sampling profiler of the API
+
+GET /metrics answers in the Prometheus text format:
+* fodinha_requests_total{method, route, status}: API requests
+* fodinha_request_duration_seconds{route}: their latency, histogram
+* fodinha_lobby_actions_total{lobby_id, action}: guesses and plays per
+  lobby, the series of the METRICS_MAX_LOBBIES most recently active
+  lobbies are kept
+* fodinha_engine_duration_seconds{function}: time spent in
+  Lobby.prepare_gameturn, update_current_wins and status, histogram
+
+The metrics are counted per process: with several uWSGI workers, each
+scrape sees the worker that answered it. Nothing here needs a client
+library. It is off unless METRICS=1: the /metrics route is not
+authenticated and shows the IDs of the active lobbies, when it is on
+keep it private at the proxy, for the scraper only.
+
+Profiler: with PROFILE_EVERY=N, one API request out of N runs under
+cProfile and its stats are dumped to PROFILE_DIR/<time>-<pid>-<n>-<endpoint>.prof
+(read them with python -m pstats, or snakeviz). The file
+PROFILE_DIR/profile-every, when it exists, overrides N while the app
+runs, every process reads it again after PROFILE_CHECK_INTERVAL seconds:
+
+    echo 100 > profiles/profile-every    # start profiling
+    echo 0 > profiles/profile-every      # stop
+"""
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+from flask import Response, g, request
+
+from fodinha import Lobby
+from fodinha.compact import CompactLobby
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ENGINE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2)
+ENGINE_FUNCTIONS = ('prepare_gameturn', 'update_current_wins', 'status')
+
+PROFILE_TOGGLE_FILE = 'profile-every'
+# seconds between two reads of the toggle file
+PROFILE_CHECK_INTERVAL = 5
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = ['{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)]
+    pairs += ['{}="{}"'.format(name, value) for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """A counter per combination of label values
+
+    max_series: series kept at most, the least recently incremented are
+    dropped (None: no limit)
+    """
+
+    def __init__(self, name, documentation, labels, max_series=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.max_series = max_series
+        # label values -> count, least recently incremented first
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inc(self, *values):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + 1
+            if self.max_series is not None:
+                self._values.move_to_end(values)
+                if len(self._values) > self.max_series:
+                    self._values.popitem(last=False)
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        lines += ['{}{} {}'.format(self.name, format_labels(self.labels, label_values), value)
+                  for label_values, value in values]
+        return lines
+
+
+class Histogram:
+    """Observations counted in cumulative buckets, per combination of label values"""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (not cumulative) + the +Inf one, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount, *values):
+        with self._lock:
+            series = self._values.get(values)
+            if series is None:
+                series = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            bucket = 0
+            while bucket < len(self.buckets) and amount > self.buckets[bucket]:
+                bucket += 1
+            series[0][bucket] += 1
+            series[1] += amount
+
+    def time(self, *values):
+        """Decorate a function to observe its duration"""
+        def decorator(function):
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *values)
+            return timed
+        return decorator
+
+    def render(self):
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(self.labels, label_values, [('le', bound)]), cumulative))
+            labels = format_labels(self.labels, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+requests_total = Counter('fodinha_requests_total', 'API requests', ('method', 'route', 'status'))
+request_duration = Histogram('fodinha_request_duration_seconds', 'Latency of the API requests',
+                             ('route',), REQUEST_BUCKETS)
+lobby_actions = Counter('fodinha_lobby_actions_total', 'Guesses and plays per lobby', ('lobby_id', 'action'))
+engine_duration = Histogram('fodinha_engine_duration_seconds', 'Time spent in the engine',
+                            ('function',), ENGINE_BUCKETS)
+METRICS = (requests_total, request_duration, lobby_actions, engine_duration)
+
+
+def render():
+    """Return all the metrics in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def count_action(lobby_id, action):
+    """Count a guess or a play made in a lobby"""
+    lobby_actions.inc(lobby_id, action)
+
+
+def time_engine():
+    """Wrap the engine functions of Lobby and CompactLobby with engine_duration timers"""
+    for cls in (Lobby, CompactLobby):
+        for name in ENGINE_FUNCTIONS:
+            # only the classes defining the function: CompactLobby inherits
+            # prepare_gameturn, it must not be timed twice
+            if name in vars(cls):
+                setattr(cls, name, engine_duration.time(name)(vars(cls)[name]))
+
+
+def observe_request(route, method, status, duration):
+    """Account for a request, also used by the ASGI views"""
+    requests_total.inc(method, route, status)
+    request_duration.observe(duration, route)
+
+
+class Profiler:
+    """Run one request out of every (see the module docstring) under cProfile"""
+
+    def __init__(self, every, directory):
+        self.every = every
+        self.directory = directory
+        self._requests = count(1)
+        # the toggle file: its value and when it was read
+        self._override = None
+        self._checked = None
+
+    def current_every(self):
+        """Return every, overridden by the toggle file, read at most every PROFILE_CHECK_INTERVAL"""
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= PROFILE_CHECK_INTERVAL:
+            self._checked = now
+            try:
+                with open(os.path.join(self.directory, PROFILE_TOGGLE_FILE)) as f:
+                    self._override = int(f.read().strip() or 0)
+            except FileNotFoundError:
+                self._override = None
+            except ValueError:
+                logger.warning('%s is not a number of requests', PROFILE_TOGGLE_FILE)
+                self._override = None
+        return self.every if self._override is None else self._override
+
+    def start(self):
+        """Return a started cProfile.Profile if this request is sampled, else None"""
+        every = self.current_every()
+        number = next(self._requests)
+        if every <= 0 or number % every:
+            return None
+        profile = cProfile.Profile()
+        profile.number = number
+        try:
+            profile.enable()
+        except ValueError:
+            # another request of the process is being profiled (Python 3.12+)
+            return None
+        return profile
+
+    def stop(self, profile, endpoint):
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-{}-{}-{}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(), profile.number, endpoint))
+        profile.dump_stats(path)
+        logger.info('request profiled', extra={'path': path})
+
+
+def init_app(app, bp):
+    """Time and count the requests of the blueprint, add /metrics and the profiler"""
+    config = app.config
+    profiler = Profiler(config['PROFILE_EVERY'], config['PROFILE_DIR'])
+    metrics = config['METRICS']
+    lobby_actions.max_series = config['METRICS_MAX_LOBBIES']
+
+    @bp.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        g.profile = profiler.start()
+
+    @bp.after_request
+    def keep_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @bp.teardown_request
+    def end_request(error):
+        # after every after_request, compression included
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler.stop(profile, request.endpoint or 'unmatched')
+        if metrics and 'request_start' in g:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            status = g.pop('response_status', 500)
+            observe_request(route, request.method, status, time.perf_counter() - g.pop('request_start'))
+
+    if metrics:
+        time_engine()
+        app.add_url_rule('/metrics', 'metrics', lambda: Response(render(), content_type=CONTENT_TYPE))
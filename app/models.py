@@ -16,6 +16,8 @@ class Card(db.Model):
     real_value = db.Column(db.Integer, nullable=False)
     color = db.Column(db.Integer, nullable=False)
     image_name = db.Column(db.String(50), nullable=False)
+    # index in its owner's hand, or in the played cards of the turn
+    position = db.Column(db.Integer)
 
     # foreign keys
     # many to one
@@ -33,6 +35,8 @@ class Player(db.Model):
     current_wins = db.Column(db.Integer)
     is_playing = db.Column(db.Boolean)
     is_dealer = db.Column(db.Boolean)
+    # player ID in the game, i.e. index in Lobby.players
+    seat = db.Column(db.Integer, nullable=False)
 
     # foreign keys
     # many to one
@@ -52,6 +56,11 @@ class Lobby(db.Model):
     number_of_turns = db.Column(db.Integer)
     turn_type = db.Column(db.Integer)
     current_win_value = db.Column(db.Integer, default=1)
+    number_of_players = db.Column(db.Integer, nullable=False)
+    # see fodinha.Lobby: version, current_turn_size and events (as JSON)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    turn_size = db.Column(db.Integer)
+    events = db.Column(db.Text)
 
     # foreign keys
     # one to many
@@ -0,0 +1,370 @@
+"""Write-behind persistence of the running games into app.models
+
+PersistentLobbyStore keeps the lobbies in memory like MemoryLobbyStore, so
+guess() and play() never wait for the database. Edited lobbies are marked
+dirty, a background thread copies them every PERSIST_INTERVAL seconds and
+writes all of them in one transaction. After a restart, a lobby is read
+back from the database the first time it is asked for.
+
+The lobby is mapped onto the models this way:
+* Lobby row: the attributes of the current gameturn, version and events
+* Player rows: one per seat, with its guess and wins for the gameturn,
+  is_dealer and is_playing give current_dealer_id and current_player_id
+* Card rows: the beforemanilla, the hands (owner, position in the hand)
+  and the played cards (played_cards, position in the turn)
+
+The deck is not saved, it is only used while dealing.
+Lobby IDs are allocated by the process, so this store is for a single
+process (flask run, or uWSGI with 'processes = 1' and several threads).
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from app import db
+from app import models
+from app.sprites import card_image_name
+from app.store import FINISHED, OPEN, RUNNING, MemoryLobbyStore, page_of
+from fodinha import Card, Color, Lobby, Player, TurnType
+
+logger = logging.getLogger(__name__)
+
+def guessing_seats(lobby):
+    """Return the seats of current_guesses, in order: alive seats from the dealer"""
+    if lobby.current_dealer_id < 0 or lobby.alive_count == 0:
+        return []
+    seat = lobby.current_dealer_id
+    if not lobby.players[seat].is_alive():
+        seat = lobby.next_alive_seat[seat]
+    seats = []
+    for _ in range(lobby.alive_count):
+        seats.append(seat)
+        seat = lobby.next_alive_seat[seat]
+    return seats
+
+
+def card_state(card):
+    return card.value, int(card.color)
+
+
+def snapshot(lobby):
+    """Copy the state of a lobby, so that it can be written without its lock"""
+    guesses = dict(zip(guessing_seats(lobby), lobby.current_guesses))
+    return {
+            'lobby_id': lobby.lobby_id,
+            'number_of_players': lobby.number_of_players,
+            'version': lobby.version,
+            'gameturn': lobby.gameturn_number,
+            'turn': lobby.current_turn_number,
+            'number_of_turns': lobby.current_number_of_turns,
+            'turn_type': lobby.current_turn_type and lobby.current_turn_type.value,
+            'win_value': lobby.current_win_value,
+            'turn_size': lobby.current_turn_size,
+            'events': json.dumps(lobby.events),
+            'beforemanilla': lobby.current_beforemanilla and card_state(lobby.current_beforemanilla),
+            'played_cards': [card_state(card) + (card.owner_id,) for card in lobby.current_played_cards],
+            'players': [{
+                'seat': player.player_id,
+                'name': player.name,
+                'lives': player.number_of_lives,
+                'guess': guesses.get(player.player_id),
+                'wins': lobby.current_wins[player.player_id] if lobby.current_wins else None,
+                'is_dealer': player.player_id == lobby.current_dealer_id,
+                'is_playing': player.player_id == lobby.current_player_id,
+                'cards': [card_state(card) for card in player.cards],
+                } for player in lobby.players],
+            }
+
+
+def saved_summaries(excluded_ids):
+    """Return {lobby_id: lobby_summary} of the saved lobbies, from the lobby and player columns only"""
+    summaries = {}
+    rows = db.session.query(models.Lobby.id, models.Lobby.number_of_players,
+                            models.Lobby.gameturn, models.Lobby.turn_type)
+    for lobby_id, number_of_players, gameturn, turn_type in rows:
+        if lobby_id in excluded_ids:
+            continue
+        if not gameturn:
+            phase = OPEN
+        elif turn_type == TurnType.GAME_OVER.value:
+            phase = FINISHED
+        else:
+            phase = RUNNING
+        summaries[lobby_id] = {'lobby_id': lobby_id, 'number_of_players': number_of_players,
+                               'names': [], 'phase': phase}
+    players = db.session.query(models.Player.lobby_id, models.Player.name).order_by(models.Player.seat)
+    for lobby_id, name in players:
+        if lobby_id in summaries:
+            summaries[lobby_id]['names'].append(name)
+    return summaries
+
+
+def new_card(value, color, position=None, owner=None):
+    return models.Card(value=value, real_value=Card(value, Color(color)).real_value, color=color,
+                       image_name=card_image_name(value, color), position=position, owner=owner)
+
+
+def remove(lobby_id):
+    """Delete the rows of a lobby, except the lobby row itself"""
+    row = models.Lobby.query.get(lobby_id)
+    if row is None:
+        return None
+    player_ids = [player.id for player in row.players]
+    card_ids = [card.id for card in row.played_cards]
+    if row.beforemanilla is not None:
+        card_ids.append(row.beforemanilla)
+    row.beforemanilla = None
+    row.played_cards = []
+    db.session.flush()
+    if player_ids:
+        models.Card.query.filter(models.Card.owner_id.in_(player_ids)).delete(synchronize_session=False)
+        models.Player.query.filter(models.Player.id.in_(player_ids)).delete(synchronize_session=False)
+    if card_ids:
+        models.Card.query.filter(models.Card.id.in_(card_ids)).delete(synchronize_session=False)
+    db.session.expire(row)
+    return row
+
+
+def write(state):
+    """Replace the rows of a lobby by the given snapshot, in the current session"""
+    row = remove(state['lobby_id'])
+    if row is None:
+        row = models.Lobby(id=state['lobby_id'])
+        db.session.add(row)
+    row.number_of_players = state['number_of_players']
+    row.version = state['version']
+    row.gameturn = state['gameturn']
+    row.turn = state['turn']
+    row.number_of_turns = state['number_of_turns']
+    row.turn_type = state['turn_type']
+    row.current_win_value = state['win_value']
+    row.turn_size = state['turn_size']
+    row.events = state['events']
+    if state['beforemanilla'] is not None:
+        row.before_manilla = new_card(*state['beforemanilla'])
+
+    players = []
+    for player in state['players']:
+        player_row = models.Player(seat=player['seat'], name=player['name'],
+                                   number_of_lives=player['lives'], current_guess=player['guess'],
+                                   current_wins=player['wins'], is_dealer=player['is_dealer'],
+                                   is_playing=player['is_playing'], lobby=row)
+        for position, (value, color) in enumerate(player['cards']):
+            new_card(value, color, position, player_row)
+        players.append(player_row)
+    row.played_cards = [new_card(value, color, position, players[owner_id])
+                        for position, (value, color, owner_id) in enumerate(state['played_cards'])]
+
+
+def load(row):
+    """Return the fodinha.Lobby saved in a Lobby row"""
+    lobby = Lobby(row.id, row.number_of_players)
+    lobby.version = row.version
+    lobby.events = json.loads(row.events) if row.events else []
+    lobby.gameturn_number = row.gameturn
+    lobby.current_turn_number = row.turn
+    lobby.current_number_of_turns = row.number_of_turns
+    lobby.current_turn_type = row.turn_type and TurnType(row.turn_type)
+    lobby.current_win_value = row.current_win_value
+    lobby.current_turn_size = row.turn_size
+    if row.before_manilla is not None:
+        lobby.current_beforemanilla = Card(row.before_manilla.value, Color(row.before_manilla.color))
+
+    played_card_ids = set()
+    for card_row in sorted(row.played_cards, key=lambda card_row: card_row.position):
+        card = Card(card_row.value, Color(card_row.color))
+        card.owner_id = card_row.owner.seat
+        lobby.current_played_cards.append(card)
+        played_card_ids.add(card_row.id)
+
+    for player_row in sorted(row.players, key=lambda player_row: player_row.seat):
+        player = Player(player_row.seat, player_row.name)
+        player.number_of_lives = player_row.number_of_lives
+        hand = [card_row for card_row in player_row.cards if card_row.id not in played_card_ids]
+        for card_row in sorted(hand, key=lambda card_row: card_row.position):
+            player.draw_card(Card(card_row.value, Color(card_row.color)))
+        lobby.players.append(player)
+        if player_row.is_dealer:
+            lobby.current_dealer_id = player.player_id
+        if player_row.is_playing:
+            lobby.current_player_id = player.player_id
+    lobby.alive_count = sum(1 for player in lobby.players if player.is_alive())
+
+    if lobby.gameturn_number:
+        lobby.current_wins = [player_row.current_wins or 0
+                              for player_row in sorted(row.players, key=lambda player_row: player_row.seat)]
+        # the seat rings are rebuilt from the hands
+        lobby.update_alive_seats()
+        lobby.link_holding_seats()
+        lobby.holding_count = sum(1 for player in lobby.players if player.has_cards())
+        guesses = {player_row.seat: player_row.current_guess for player_row in row.players}
+        lobby.current_guesses = [guesses[seat] for seat in guessing_seats(lobby)
+                                 if guesses[seat] is not None]
+    return lobby
+
+
+class PersistentLobbyStore(MemoryLobbyStore):
+    """Keep the lobbies in memory, save them in the database in the background"""
+
+    def __init__(self, app, interval):
+        super().__init__()
+        self.app = app
+        self.interval = interval
+        # lobby IDs survive restarts
+        self.epoch = '0'
+        self._dirty = set()
+        self._deleted = set()
+        self._dirty_lock = threading.Lock()
+        # the flush thread is started by the first change of each process
+        # (uWSGI forks the workers after loading the app)
+        self._pid = None
+        self._stop = threading.Event()
+        # one flush at a time, the background one or the one at exit
+        self._flush_lock = threading.Lock()
+
+        with app.app_context():
+            db.create_all()
+            last_id = db.session.query(db.func.max(models.Lobby.id)).scalar()
+        self._next_id = (last_id or 0) + 1
+        self._ids_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def mark_dirty(self, lobby_id):
+        """Schedule the lobby to be written at the next flush"""
+        with self._dirty_lock:
+            self._dirty.add(lobby_id)
+            self._start()
+
+    def _start(self):
+        """Start the flush thread of this process if needed (dirty lock held)"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='lobby-write-behind', daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write the dirty lobbies and remove the deleted ones, in one transaction"""
+        with self._flush_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+                deleted, self._deleted = self._deleted, set()
+            if not dirty and not deleted:
+                return
+
+            # the lock of a lobby is only held while copying it
+            states = []
+            for lobby_id in sorted(dirty):
+                with self.lock(lobby_id).read():
+                    lobby = self._lobbies.get(lobby_id)
+                    if lobby is not None:
+                        states.append(snapshot(lobby))
+
+            with self.app.app_context():
+                try:
+                    for state in states:
+                        write(state)
+                    for lobby_id in deleted:
+                        row = remove(lobby_id)
+                        if row is not None:
+                            db.session.delete(row)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('flush failed, will retry', extra={'lobbies': len(states),
+                                                                        'deleted': len(deleted)})
+                    with self._dirty_lock:
+                        self._dirty |= dirty
+                        self._deleted |= deleted
+                    return
+            logger.debug('flushed lobbies', extra={'lobbies': len(states), 'deleted': len(deleted)})
+
+    def _fetch(self, lobby_id):
+        """Return the lobby, read it from the database if needed (lock held)"""
+        lobby = self._lobbies.get(lobby_id)
+        if lobby is not None:
+            return lobby
+        with self._dirty_lock:
+            if lobby_id in self._deleted:
+                raise KeyError(lobby_id)
+        with self.app.app_context():
+            row = models.Lobby.query.get(lobby_id)
+            if row is None:
+                raise KeyError(lobby_id)
+            lobby = self._lobbies[lobby_id] = load(row)
+        self.index(lobby_id, lobby)
+        logger.info('lobby %s read back from the database', lobby_id, extra={'lobby_id': lobby_id})
+        return lobby
+
+    def create(self, number_of_players):
+        self.maybe_evict()
+        with self._ids_lock:
+            lobby_id = self._next_id
+            self._next_id += 1
+        lobby = self._lobbies[lobby_id] = Lobby(lobby_id, number_of_players)
+        self.index(lobby_id, lobby)
+        self.mark_dirty(lobby_id)
+        return lobby_id
+
+    def get(self, lobby_id):
+        lobby = self._lobbies.get(lobby_id)
+        if lobby is not None:
+            return lobby
+        try:
+            with self.lock(lobby_id):
+                return self._fetch(lobby_id)
+        except KeyError:
+            self.forget_lock(lobby_id)
+            raise
+
+    @contextmanager
+    def edit(self, lobby_id):
+        self.get(lobby_id)
+        try:
+            with super().edit(lobby_id) as lobby:
+                yield lobby
+        finally:
+            # saved even if the block failed halfway, as it stays in memory
+            self.mark_dirty(lobby_id)
+
+    def delete(self, lobby_id):
+        self.get(lobby_id)
+        super().delete(lobby_id)
+        with self._dirty_lock:
+            self._deleted.add(lobby_id)
+            self._dirty.discard(lobby_id)
+            self._start()
+
+    def list(self):
+        with self.app.app_context():
+            saved_ids = [lobby_id for (lobby_id,) in db.session.query(models.Lobby.id)]
+        lobbies = []
+        for lobby_id in sorted(set(saved_ids) | set(self._lobbies)):
+            try:
+                lobbies.append(self.get(lobby_id))
+            except KeyError:
+                # deleted in the meantime
+                pass
+        return lobbies
+
+    def page(self, phase=None, offset=0, limit=None, number_of_players=None, prefix=''):
+        # the lobbies not read back yet are not in the memory indexes,
+        # their summaries come from their rows, without reading them back
+        with self._index_lock:
+            summaries = dict(self._summaries)
+        with self._dirty_lock:
+            excluded_ids = set(summaries) | self._deleted
+        with self.app.app_context():
+            summaries.update(saved_summaries(excluded_ids))
+        summaries = [summaries[lobby_id] for lobby_id in sorted(summaries)
+                     if phase is None or summaries[lobby_id]['phase'] == phase]
+        return page_of(summaries, offset, limit, number_of_players, prefix)
+
+    def wait(self, lobby_id, version, timeout, interval=None):
+        self.get(lobby_id)
+        return super().wait(lobby_id, version, timeout, interval)
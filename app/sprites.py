@@ -0,0 +1,124 @@
+"""Card sprite atlas: the 52 images of static/cards in one WebP file
+
+A table shows a full hand plus the played cards, one request per PNG and
+about 4MB for the whole deck (the face cards are the heaviest). The build
+step packs them, scaled down, in a grid of 13 values x 4 colors:
+
+    flask build-sprites --width 200
+
+It writes to static/sprites, and both files are committed:
+* cards-<hash>.webp, hash being the start of the sha256 of its content:
+  a new atlas gets a new URL, so the old one can be cached forever
+* cards.json, the map of the atlas:
+  {"image": "cards-<hash>.webp", "width": ..., "height": ...,
+   "cards": {card code (see Card.__str__): [x, y, width, height]}}
+
+The server only reads cards.json, Pillow is only needed to build. The
+atlas is served by /sprites/<file> with a one year Cache-Control, and
+/api/cards/atlas gives the map with the URL of the atlas. card_image_url()
+gives each card as its place in the atlas, or as its PNG if no atlas was
+built.
+"""
+import hashlib
+import io
+import json
+import os
+
+import click
+
+from fodinha import Card, Color
+
+CARDS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'cards')
+SPRITES_DIR = os.path.join(os.path.dirname(__file__), 'static', 'sprites')
+MAP_PATH = os.path.join(SPRITES_DIR, 'cards.json')
+
+SPRITES_URL = '/sprites/'
+# content-hashed files never change, caches may keep them for a year
+SPRITES_MAX_AGE = 365 * 24 * 3600
+
+IMAGE_VALUES = {1: 'ace', 11: 'jack', 12: 'queen', 13: 'king'}
+
+
+def card_image_name(value, color):
+    """Return the file name of a card in static/cards, e.g. queen_of_hearts.png"""
+    return '{}_of_{}.png'.format(IMAGE_VALUES.get(value, value), Color(color).name.lower())
+
+
+def build_atlas(width, quality):
+    """Write the atlas and its map to SPRITES_DIR, return the map"""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise click.ClickException('building the sprites needs Pillow: pip install Pillow')
+
+    cards = [Card(value, color) for color in Color for value in range(1, 14)]
+    images = [Image.open(os.path.join(CARDS_DIR, card_image_name(card.value, card.color)))
+              for card in cards]
+    # all the card images have the same size
+    height = round(images[0].height * width / images[0].width)
+    atlas = Image.new('RGBA', (13 * width, len(Color) * height))
+    positions = {}
+    for i, (card, image) in enumerate(zip(cards, images)):
+        x, y = i % 13 * width, i // 13 * height
+        atlas.paste(image.convert('RGBA').resize((width, height), Image.LANCZOS), (x, y))
+        positions[str(card)] = [x, y, width, height]
+
+    data = io.BytesIO()
+    atlas.save(data, 'WEBP', quality=quality, method=6)
+    data = data.getvalue()
+    name = 'cards-{}.webp'.format(hashlib.sha256(data).hexdigest()[:12])
+
+    os.makedirs(SPRITES_DIR, exist_ok=True)
+    for old_name in os.listdir(SPRITES_DIR):
+        if old_name.startswith('cards-') and old_name.endswith('.webp') and old_name != name:
+            os.remove(os.path.join(SPRITES_DIR, old_name))
+    with open(os.path.join(SPRITES_DIR, name), 'wb') as f:
+        f.write(data)
+    sprite_map = {'image': name, 'width': atlas.width, 'height': atlas.height, 'cards': positions}
+    with open(MAP_PATH, 'w') as f:
+        json.dump(sprite_map, f, sort_keys=True)
+        f.write('\n')
+    return sprite_map
+
+
+def load_map():
+    """Return the map of the built atlas, None if there is none"""
+    if not os.path.exists(MAP_PATH):
+        return None
+    with open(MAP_PATH) as f:
+        return json.load(f)
+
+
+sprite_map = load_map()
+
+
+def card_image_url(code):
+    """Return the image of a card code: {'url': ...}, plus x, y, w, h with an atlas
+
+    With an atlas, the URL is the one of the atlas and x, y, w, h where the
+    card is in it, in pixels: the card is shown as the CSS background of a
+    w x h box, at background-position -x -y. Browsers ignore the #xywh=
+    media fragments in images, so they can't do it from the URL alone.
+    Without an atlas, the URL of the PNG of the card.
+    """
+    if sprite_map is not None:
+        x, y, w, h = sprite_map['cards'][code]
+        return {'url': SPRITES_URL + sprite_map['image'], 'x': x, 'y': y, 'w': w, 'h': h}
+    value, color = code.split(';')
+    return {'url': '/static/cards/' + card_image_name(int(value), int(color))}
+
+
+# card code -> image, for the 52 cards
+card_images = {str(card): card_image_url(str(card))
+               for card in (Card(value, color) for color in Color for value in range(1, 14))}
+
+
+@click.command('build-sprites')
+@click.option('--width', default=200, help='width of a card in the atlas, in pixels')
+@click.option('--quality', default=90, help='WebP quality, 0 to 100')
+def build_sprites_command(width, quality):
+    """Pack the card images into the sprite atlas"""
+    built = build_atlas(width, quality)
+    size = os.path.getsize(os.path.join(SPRITES_DIR, built['image']))
+    click.echo('{} ({}x{}, {} bytes) and cards.json written to {}'.format(
+        built['image'], built['width'], built['height'], size, SPRITES_DIR))
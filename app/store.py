@@ -0,0 +1,717 @@
+"""Lobby stores: where the running games live between two requests
+
+uWSGI runs several worker processes and each one has its own memory, so
+a game kept in a module-level list is only seen by the worker that created
+it. The stores below hide where the fodinha.Lobby instances really live:
+* MemoryLobbyStore keeps them in the current process (flask run, dev)
+* SQLiteLobbyStore keeps them in a WAL-mode SQLite file shared by all workers
+* PersistentLobbyStore (app.persistence) keeps them in memory and saves
+  them in the background into the SQLAlchemy models
+* JournalLobbyStore keeps them in memory and logs every action in an
+  append-only file (fodinha.journal), replayed at restart
+
+A lobby is always read inside read() and modified inside edit():
+
+    with store.read(lobby_id) as lobby:
+        status = lobby.status()
+
+    with store.edit(lobby_id) as lobby:
+        lobby.guess(player_id, guess)
+
+edit() holds the lock of this lobby only, other tables are not blocked.
+The engine mutates a lobby over several attributes (a play can close the
+trick, the gameturn and deal again), so a lobby being edited must not be
+read either: read() holds the same lock in shared mode, the players of a
+table read in parallel and only wait for the edits.
+wait() blocks until the version of a lobby (see Lobby.version) passes the
+one a client has already seen, this is what the long-poll endpoint uses.
+
+Every store indexes its lobbies by phase (OPEN, RUNNING, FINISHED) and
+deletes the lobbies nobody touched for ttl seconds. page() is what the
+lobby browser shows: a page of the summaries of the lobbies of a phase.
+The summaries only change with the generation: a lobby is created,
+joined, started, finished or deleted, not at every guess or play.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count
+
+from fodinha import Lobby, TurnType, journal
+
+logger = logging.getLogger(__name__)
+
+# lobby phases: waiting for players, playing, game over
+OPEN = 'open'
+RUNNING = 'running'
+FINISHED = 'finished'
+PHASES = (OPEN, RUNNING, FINISHED)
+
+# at most one idle lobby eviction per this many seconds
+EVICTION_INTERVAL = 60
+
+
+def lobby_phase(lobby):
+    """Return the phase of a lobby"""
+    if lobby.gameturn_number == 0:
+        return OPEN
+    elif lobby.current_turn_type == TurnType.GAME_OVER:
+        return FINISHED
+    return RUNNING
+
+
+def lobby_summary(lobby):
+    """Return what the lobby browser shows of a lobby"""
+    return {'lobby_id': lobby.lobby_id,
+            'number_of_players': lobby.number_of_players,
+            'names': [p.name for p in lobby.players],
+            'phase': lobby_phase(lobby)}
+
+
+def summary_key(lobby):
+    """Return what a lobby summary depends on, the generation changes with it"""
+    return lobby_phase(lobby), len(lobby.players)
+
+
+def page_of(summaries, offset=0, limit=None, number_of_players=None, prefix=''):
+    """Return (page, total) of the summaries matching the filters of page()"""
+    matching = [summary for summary in summaries
+                if (number_of_players is None or summary['number_of_players'] == number_of_players)
+                and (not prefix or any(name.lower().startswith(prefix) for name in summary['names']))]
+    end = None if limit is None else offset + limit
+    return matching[offset:end], len(matching)
+
+
+class RWLock:
+    """Lock shared by the readers and exclusive for a writer, not reentrant
+
+    `with lock:` takes it for writing, like a threading.Lock. Once a writer
+    waits the new readers wait behind it, so the polls of a busy table
+    never starve its edits.
+    """
+
+    def __init__(self):
+        self._changed = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._changed:
+            self._changed.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._readers -= 1
+                if not self._readers:
+                    self._changed.notify_all()
+
+    def __enter__(self):
+        with self._changed:
+            self._waiting_writers += 1
+            try:
+                self._changed.wait_for(lambda: not self._writing and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+
+    def __exit__(self, *exc_info):
+        with self._changed:
+            self._writing = False
+            self._changed.notify_all()
+
+
+class LobbyStore:
+    """Base class of the lobby stores, unknown lobby IDs raise KeyError"""
+
+    # changes when lobby IDs may be reused (i.e. all lobbies were lost),
+    # it is part of the ETags so that clients never mix up two lobbies
+    epoch = '0'
+
+    # seconds without edit after which a lobby is deleted, None: never
+    ttl = None
+
+    def __init__(self):
+        # one lock per lobby, created on first use
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._next_eviction = 0
+        # called with the lobby ID after each edit or delete, see add_listener
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(lobby_id) after every edit or delete of a lobby in this process
+
+        It is called from the thread of the edit, with no lock held.
+        """
+        self._listeners.append(callback)
+
+    def notify(self, lobby_id):
+        for callback in self._listeners:
+            callback(lobby_id)
+
+    def lock(self, lobby_id):
+        """Return the in-process RWLock of the given lobby"""
+        with self._locks_guard:
+            lock = self._locks.get(lobby_id)
+            if lock is None:
+                lock = self._locks[lobby_id] = RWLock()
+            return lock
+
+    def forget_lock(self, lobby_id):
+        """Drop the lock of a deleted lobby"""
+        with self._locks_guard:
+            self._locks.pop(lobby_id, None)
+
+    def create(self, number_of_players):
+        """Create a new lobby and return its ID"""
+        raise NotImplementedError
+
+    def get(self, lobby_id):
+        """Return the lobby, it must not be modified"""
+        raise NotImplementedError
+
+    def edit(self, lobby_id):
+        """Context manager yielding the lobby, saved when leaving the block"""
+        raise NotImplementedError
+
+    @contextmanager
+    def read(self, lobby_id):
+        """Context manager yielding the lobby, not edited until leaving the block"""
+        # fetched first, a store loading it takes the lock for writing
+        lobby = self.get(lobby_id)
+        with self.lock(lobby_id).read():
+            yield lobby
+
+    def delete(self, lobby_id):
+        """Delete the lobby"""
+        raise NotImplementedError
+
+    def list(self):
+        """Return all the lobbies"""
+        raise NotImplementedError
+
+    def page(self, phase=None, offset=0, limit=None, number_of_players=None, prefix=''):
+        """Return (summaries, total): a page of the summaries (see lobby_summary) of the matching lobbies
+
+        phase: OPEN, RUNNING, FINISHED or None for all of them,
+        number_of_players: None for any, prefix: only the lobbies with a
+        player whose name starts with it (lowercase, any case matches).
+        The lobbies are in creation order, total is how many match.
+        """
+        summaries = [lobby_summary(lobby) for lobby in self.list() if phase is None or lobby_phase(lobby) == phase]
+        return page_of(summaries, offset, limit, number_of_players, prefix)
+
+    def idle_ids(self, deadline):
+        """Return the IDs of the lobbies not edited since deadline (a time.time())"""
+        raise NotImplementedError
+
+    def generation(self):
+        """Return a number changing whenever a lobby summary changes"""
+        raise NotImplementedError
+
+    def evict_idle(self):
+        """Delete the lobbies idle for more than ttl seconds, return how many"""
+        evicted = 0
+        for lobby_id in self.idle_ids(time.time() - self.ttl):
+            try:
+                self.delete(lobby_id)
+            except KeyError:
+                # deleted in the meantime
+                continue
+            evicted += 1
+        return evicted
+
+    def maybe_evict(self):
+        """Evict the idle lobbies if it was not done recently, called on create"""
+        now = time.monotonic()
+        if self.ttl is None or now < self._next_eviction:
+            return
+        self._next_eviction = now + EVICTION_INTERVAL
+        self.evict_idle()
+
+    def version(self, lobby_id):
+        """Return the current version of the lobby"""
+        return self.get(lobby_id).version
+
+    def wait(self, lobby_id, version, timeout, interval=0.2):
+        """Wait until the lobby version is above the given one
+
+        Return True if it is, False if the timeout expired first.
+        This polls the version, stores able to do better override it.
+        """
+        deadline = time.monotonic() + timeout
+        while self.version(lobby_id) <= version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+        return True
+
+
+class MemoryLobbyStore(LobbyStore):
+    """Keep the lobbies in the memory of the current process"""
+
+    def __init__(self):
+        super().__init__()
+        self._lobbies = {}
+        self._ids = count()
+        # lobby IDs start over at each restart of the process
+        self.epoch = uuid.uuid4().hex[:8]
+        # notified at the end of every edit, wakes up the waiting clients
+        self._changed = threading.Condition()
+        # phase -> {lobby_id: None}, dicts used as ordered sets
+        self._phases = {phase: {} for phase in PHASES}
+        # lobby_id -> summary_key, the generation is incremented with each change of one
+        self._summary_keys = {}
+        # lobby_id -> lobby_summary, built again when its summary_key changes
+        self._summaries = {}
+        self._generation = 0
+        # lobby_id -> time of the last edit, least recently edited first
+        self._touched = OrderedDict()
+        self._index_lock = threading.Lock()
+
+    def index(self, lobby_id, lobby):
+        """Update the indexes after an edit of the lobby"""
+        key = summary_key(lobby)
+        with self._index_lock:
+            previous_key = self._summary_keys.get(lobby_id)
+            if key != previous_key:
+                if previous_key is not None:
+                    del self._phases[previous_key[0]][lobby_id]
+                self._phases[key[0]][lobby_id] = None
+                self._summary_keys[lobby_id] = key
+                self._summaries[lobby_id] = lobby_summary(lobby)
+                self._generation += 1
+            self._touched[lobby_id] = time.time()
+            self._touched.move_to_end(lobby_id)
+
+    def unindex(self, lobby_id):
+        """Remove a deleted lobby from the indexes"""
+        with self._index_lock:
+            key = self._summary_keys.pop(lobby_id, None)
+            if key is not None:
+                del self._phases[key[0]][lobby_id]
+                del self._summaries[lobby_id]
+                self._generation += 1
+            self._touched.pop(lobby_id, None)
+
+    def create(self, number_of_players):
+        self.maybe_evict()
+        lobby_id = next(self._ids)
+        lobby = self._lobbies[lobby_id] = Lobby(lobby_id, number_of_players)
+        self.index(lobby_id, lobby)
+        return lobby_id
+
+    def get(self, lobby_id):
+        return self._lobbies[lobby_id]
+
+    @contextmanager
+    def edit(self, lobby_id):
+        with self.lock(lobby_id):
+            lobby = self._lobbies[lobby_id]
+            try:
+                yield lobby
+            finally:
+                self.index(lobby_id, lobby)
+                with self._changed:
+                    self._changed.notify_all()
+        self.notify(lobby_id)
+
+    def delete(self, lobby_id):
+        with self.lock(lobby_id):
+            del self._lobbies[lobby_id]
+            self.unindex(lobby_id)
+        self.forget_lock(lobby_id)
+        with self._changed:
+            self._changed.notify_all()
+        self.notify(lobby_id)
+
+    def list(self):
+        return list(self._lobbies.values())
+
+    def page(self, phase=None, offset=0, limit=None, number_of_players=None, prefix=''):
+        with self._index_lock:
+            # lobby IDs grow with the creation time
+            ids = sorted(self._summaries if phase is None else self._phases[phase])
+            summaries = [self._summaries[lobby_id] for lobby_id in ids]
+        return page_of(summaries, offset, limit, number_of_players, prefix)
+
+    def generation(self):
+        return self._generation
+
+    def idle_ids(self, deadline):
+        with self._index_lock:
+            idle = []
+            for lobby_id, touched in self._touched.items():
+                if touched >= deadline:
+                    break
+                idle.append(lobby_id)
+            return idle
+
+    def wait(self, lobby_id, version, timeout, interval=None):
+        def changed():
+            # a deleted (or evicted) lobby wakes up its waiting clients too
+            lobby = self._lobbies.get(lobby_id)
+            return lobby is None or lobby.version > version
+        with self._changed:
+            if not self._changed.wait_for(changed, timeout):
+                return False
+        # KeyError if the lobby is gone
+        return self.version(lobby_id) > version
+
+
+class SQLiteLobbyStore(LobbyStore):
+    """Keep the lobbies in a SQLite file, shared by all the worker processes
+
+    Each lobby is one row holding its snapshot and its version, so that
+    wait() polls a single integer instead of loading the whole lobby.
+    The database is in WAL mode: readers never wait for a writer. Writers
+    take the lobby lock of their process then a 'BEGIN IMMEDIATE'
+    transaction, which serializes them with the writers of the other
+    processes. The phase and the time of the last edit are indexed columns,
+    the names of the players a JSON column: page() never loads a state.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        # sqlite connections can't be shared between threads, nor survive a fork
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lobbies (
+                lobby_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                number_of_players INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                state BLOB NOT NULL,
+                phase TEXT,
+                updated_at REAL,
+                names TEXT NOT NULL DEFAULT '[]'
+            )""")
+        self._add_missing_columns(conn)
+        conn.execute('CREATE INDEX IF NOT EXISTS lobbies_phase ON lobbies (phase, lobby_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS lobbies_updated_at ON lobbies (updated_at)')
+        # a single row, the generation shared by all the processes
+        conn.execute('CREATE TABLE IF NOT EXISTS registry (generation INTEGER NOT NULL)')
+        conn.execute('INSERT INTO registry SELECT 0 WHERE NOT EXISTS (SELECT * FROM registry)')
+
+    def _add_missing_columns(self, conn):
+        """Upgrade a lobbies table created by an older version of this store"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(lobbies)')}
+        if 'version' not in columns:
+            conn.execute('ALTER TABLE lobbies ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        if 'phase' not in columns:
+            conn.execute('ALTER TABLE lobbies ADD COLUMN phase TEXT')
+            conn.execute('ALTER TABLE lobbies ADD COLUMN updated_at REAL')
+            rows = conn.execute('SELECT lobby_id, state FROM lobbies').fetchall()
+            for lobby_id, state in rows:
+                lobby = self.loads(state)
+                conn.execute('UPDATE lobbies SET version = ?, phase = ?, updated_at = ? WHERE lobby_id = ?',
+                             (lobby.version, lobby_phase(lobby), time.time(), lobby_id))
+        if 'names' not in columns:
+            conn.execute("ALTER TABLE lobbies ADD COLUMN names TEXT NOT NULL DEFAULT '[]'")
+            rows = conn.execute('SELECT lobby_id, state FROM lobbies').fetchall()
+            for lobby_id, state in rows:
+                conn.execute('UPDATE lobbies SET names = ? WHERE lobby_id = ?',
+                             (self.dump_names(self.loads(state)), lobby_id))
+
+    def _connection(self):
+        """Return the connection of the current thread, open it if needed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # autocommit mode, transactions are handled explicitly in edit()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def dumps(lobby):
+        return lobby.snapshot()
+
+    @staticmethod
+    def loads(state):
+        # rows written before snapshots are pickles
+        return journal.load_lobby(state)
+
+    @staticmethod
+    def dump_names(lobby):
+        return json.dumps([player.name for player in lobby.players])
+
+    def create(self, number_of_players):
+        self.maybe_evict()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # the row ID is the lobby ID, so insert first and set the state after
+            cursor = conn.execute(
+                'INSERT INTO lobbies (number_of_players, state, phase, updated_at) VALUES (?, ?, ?, ?)',
+                (number_of_players, b'', OPEN, time.time()))
+            lobby_id = cursor.lastrowid
+            conn.execute('UPDATE lobbies SET state = ? WHERE lobby_id = ?',
+                         (self.dumps(Lobby(lobby_id, number_of_players)), lobby_id))
+            conn.execute('UPDATE registry SET generation = generation + 1')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return lobby_id
+
+    def get(self, lobby_id):
+        row = self._connection().execute(
+            'SELECT state FROM lobbies WHERE lobby_id = ?', (lobby_id,)).fetchone()
+        if row is None:
+            raise KeyError(lobby_id)
+        return self.loads(row[0])
+
+    @contextmanager
+    def read(self, lobby_id):
+        # get() returns a private copy, nobody else edits it
+        yield self.get(lobby_id)
+
+    @contextmanager
+    def edit(self, lobby_id):
+        with self.lock(lobby_id):
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT state FROM lobbies WHERE lobby_id = ?', (lobby_id,)).fetchone()
+                if row is None:
+                    raise KeyError(lobby_id)
+                lobby = self.loads(row[0])
+                key = summary_key(lobby)
+                yield lobby
+                if summary_key(lobby) != key:
+                    conn.execute('UPDATE registry SET generation = generation + 1')
+                    # the names only change when a player joins
+                    conn.execute('UPDATE lobbies SET names = ? WHERE lobby_id = ?',
+                                 (self.dump_names(lobby), lobby_id))
+                conn.execute('UPDATE lobbies SET state = ?, version = ?, phase = ?, updated_at = ? '
+                             'WHERE lobby_id = ?',
+                             (self.dumps(lobby), lobby.version, lobby_phase(lobby), time.time(), lobby_id))
+            except BaseException:
+                # abort() in the block lands here too: nothing is saved
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        self.notify(lobby_id)
+
+    def delete(self, lobby_id):
+        with self.lock(lobby_id):
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = conn.execute('DELETE FROM lobbies WHERE lobby_id = ?', (lobby_id,))
+                if cursor.rowcount == 0:
+                    raise KeyError(lobby_id)
+                conn.execute('UPDATE registry SET generation = generation + 1')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        self.forget_lock(lobby_id)
+        self.notify(lobby_id)
+
+    def list(self):
+        rows = self._connection().execute(
+            'SELECT state FROM lobbies ORDER BY lobby_id').fetchall()
+        return [self.loads(row[0]) for row in rows]
+
+    def page(self, phase=None, offset=0, limit=None, number_of_players=None, prefix=''):
+        conn = self._connection()
+        conditions, parameters = [], ()
+        if phase is not None:
+            conditions.append('phase = ?')
+            parameters += (phase,)
+        if number_of_players is not None:
+            conditions.append('number_of_players = ?')
+            parameters += (number_of_players,)
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        query = 'SELECT lobby_id, number_of_players, names, phase FROM lobbies {} ORDER BY lobby_id'.format(where)
+        if prefix:
+            # filtered on the names of every matching row
+            rows = conn.execute(query, parameters).fetchall()
+            return page_of([self.row_summary(row) for row in rows], offset, limit, prefix=prefix)
+        # LIMIT -1: no limit
+        rows = conn.execute(query + ' LIMIT ? OFFSET ?',
+                            parameters + (-1 if limit is None else limit, offset)).fetchall()
+        (total,) = conn.execute('SELECT COUNT(*) FROM lobbies {}'.format(where), parameters).fetchone()
+        return [self.row_summary(row) for row in rows], total
+
+    @staticmethod
+    def row_summary(row):
+        """Return the lobby_summary of a (lobby_id, number_of_players, names, phase) row"""
+        lobby_id, number_of_players, names, phase = row
+        return {'lobby_id': lobby_id, 'number_of_players': number_of_players,
+                'names': json.loads(names), 'phase': phase}
+
+    def generation(self):
+        return self._connection().execute('SELECT generation FROM registry').fetchone()[0]
+
+    def idle_ids(self, deadline):
+        rows = self._connection().execute(
+            'SELECT lobby_id FROM lobbies WHERE updated_at < ?', (deadline,)).fetchall()
+        return [row[0] for row in rows]
+
+    def version(self, lobby_id):
+        row = self._connection().execute(
+            'SELECT version FROM lobbies WHERE lobby_id = ?', (lobby_id,)).fetchone()
+        if row is None:
+            raise KeyError(lobby_id)
+        return row[0]
+
+
+class JournalLobbyStore(MemoryLobbyStore):
+    """Keep the lobbies in memory, log every action in a fodinha.journal file
+
+    An edit returns once its records are on disk: the fsync is shared by
+    all the edits committed together, whatever their lobby (unless sync
+    is False, then a crash loses the last actions). Every snapshot_interval
+    seconds the lobbies are saved next to the journal, a restart loads them
+    and replays only the tail of the journal. Single process only, like
+    the memory store.
+    """
+
+    def __init__(self, path, snapshot_interval, sync=True):
+        super().__init__()
+        # lobby IDs are never reused
+        self.epoch = '0'
+        self.snapshot_path = '{}.snapshot'.format(path)
+        self.snapshot_interval = snapshot_interval
+        self.sync = sync
+        self._lobbies, last_id, size = journal.recover(path, self.snapshot_path)
+        # the idle time of the recovered lobbies starts over
+        for lobby_id, lobby in self._lobbies.items():
+            self.index(lobby_id, lobby)
+        self._last_id = last_id
+        self._ids = count(last_id + 1)
+        self.journal = journal.JournalWriter(path, size)
+        self._snapshot_pid = None
+        self._snapshot_guard = threading.Lock()
+        atexit.register(self.journal.close)
+
+    def _commit(self, records):
+        """Append records (lobby lock held), return the offset to wait for"""
+        with self._snapshot_guard:
+            if self._snapshot_pid != os.getpid():
+                self._snapshot_pid = os.getpid()
+                threading.Thread(target=self._run_snapshots, name='journal-snapshots', daemon=True).start()
+        return self.journal.append(records)
+
+    def _wait_commit(self, offset):
+        if self.sync:
+            self.journal.sync(offset)
+
+    def _run_snapshots(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.snapshot()
+            except Exception:
+                # the journal keeps everything, the next pass tries again
+                logger.exception('journal snapshot failed')
+
+    def snapshot(self):
+        """Save all the lobbies with the journal offset they include"""
+        # taken first: every record before it is included in the copies
+        offset = self.journal.appended
+        last_id = self._last_id
+        lobbies = {}
+        for lobby_id in list(self._lobbies):
+            with self.lock(lobby_id).read():
+                lobby = self._lobbies.get(lobby_id)
+                if lobby is not None:
+                    lobbies[lobby_id] = lobby.snapshot()
+        # the snapshot must not point past the end of the journal on disk
+        self.journal.sync(offset)
+        journal.write_snapshot(self.snapshot_path, offset, last_id, lobbies)
+
+    def create(self, number_of_players):
+        self.maybe_evict()
+        lobby_id = next(self._ids)
+        with self.lock(lobby_id):
+            # the IDs of deleted lobbies are never reused
+            self._last_id = max(self._last_id, lobby_id)
+            lobby = self._lobbies[lobby_id] = Lobby(lobby_id, number_of_players)
+            self.index(lobby_id, lobby)
+            offset = self._commit([journal.encode(lobby_id, 0, journal.CREATE, arg=number_of_players)])
+        self._wait_commit(offset)
+        return lobby_id
+
+    @contextmanager
+    def edit(self, lobby_id):
+        with self.lock(lobby_id):
+            lobby = self._lobbies[lobby_id]
+            seen = len(lobby.events)
+            # the lobby before the edit, to undo it if it can't be journaled:
+            # only a name can be refused by journal.encode, the guesses and
+            # the cards of a started game are checked by the engine first
+            before = lobby.snapshot(events=False) if len(lobby.players) < lobby.number_of_players else None
+            try:
+                yield lobby
+            finally:
+                # what was done before an error is done, it is logged too
+                try:
+                    records = journal.records_for(lobby, lobby.events[seen:])
+                except ValueError:
+                    # a restart would not see the edit, the lobby must not either
+                    if before is None:
+                        logger.exception('edit not journaled', extra={'lobby_id': lobby_id})
+                        raise
+                    logger.exception('edit not journaled, undone', extra={'lobby_id': lobby_id})
+                    restored = type(lobby).restore(before)
+                    restored.events = lobby.events[:seen]
+                    self._lobbies[lobby_id] = restored
+                    raise
+                offset = self._commit(records)
+                self.index(lobby_id, lobby)
+                with self._changed:
+                    self._changed.notify_all()
+        # other lobbies can be edited while waiting for the disk
+        self._wait_commit(offset)
+        self.notify(lobby_id)
+
+    def delete(self, lobby_id):
+        with self.lock(lobby_id):
+            lobby = self._lobbies.pop(lobby_id)
+            self.unindex(lobby_id)
+            offset = self._commit([journal.encode(lobby_id, lobby.version, journal.DELETE)])
+        self.forget_lock(lobby_id)
+        with self._changed:
+            self._changed.notify_all()
+        self._wait_commit(offset)
+        self.notify(lobby_id)
+
+
+def create_store(app):
+    """Return the lobby store selected by the LOBBY_STORE setting"""
+    config = app.config
+    if config['LOBBY_STORE'] == 'memory':
+        store = MemoryLobbyStore()
+    elif config['LOBBY_STORE'] == 'sqlite':
+        store = SQLiteLobbyStore(config['LOBBY_STORE_PATH'])
+    elif config['LOBBY_STORE'] == 'journal':
+        store = JournalLobbyStore(config['JOURNAL_PATH'], config['JOURNAL_SNAPSHOT_INTERVAL'],
+                                  config['JOURNAL_SYNC'])
+    elif config['LOBBY_STORE'] == 'sqlalchemy':
+        # the models need the db of the app, imported once it exists
+        from app.persistence import PersistentLobbyStore
+        store = PersistentLobbyStore(app, config['PERSIST_INTERVAL'])
+    else:
+        raise ValueError('Unknown LOBBY_STORE: {}'.format(config['LOBBY_STORE']))
+    store.ttl = config['LOBBY_TTL'] or None
+    return store
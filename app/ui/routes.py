@@ -1,8 +1,16 @@
 from app import app
+from app.sprites import SPRITES_DIR, SPRITES_MAX_AGE
 from app.ui import bp
-from flask import render_template
+from flask import render_template, send_from_directory
 
 @bp.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
+@bp.route('/sprites/<name>.webp', methods=['GET'])
+def sprite(name):
+    """Serve a sprite atlas, its name changes with its content so it is cached for a year"""
+    response = send_from_directory(SPRITES_DIR, name + '.webp', cache_timeout=SPRITES_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
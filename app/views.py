@@ -0,0 +1,110 @@
+"""Pre-encoded JSON views of the lobbies
+
+Between two actions, every player of a table polls the same status, the
+same players and their own cards, and each poll used to run status() and
+the str() of every card again before encoding it. ViewCache keeps the
+encoded bytes of the current version of each lobby instead:
+
+    views = view_cache.get(lobby_id)
+    views.status, views.players, views.cards[player_id]
+
+The views of a version are built all at once by the first request after
+an action, the following ones only compare the version of the lobby with
+the cached one. An edit in this process drops the views of its lobby
+(store listener); edits made by other processes are caught by the version
+check.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from app.encoding import MSGPACK, compress, to_msgpack
+from app.sprites import card_images
+
+
+def encode(view):
+    """Return the JSON of a view, with sorted keys and no spaces like flask.jsonify"""
+    return json.dumps(view, sort_keys=True, separators=(',', ':')).encode()
+
+
+class LobbyViews:
+    """The encoded views of one version of a lobby
+
+    status, players: the JSON of Lobby.status() and Lobby.get_players()
+    public: the status plus the players and card_counts, what everyone at
+    the table sees (WebSocket channel)
+    hands[seat]: the JSON list of the cards of a player
+    cards[seat]: the JSON of Lobby.get_cards(seat) plus the image of each
+    card, its URL and place in the atlas (see app.sprites)
+    """
+
+    __slots__ = ('version', 'status', 'players', 'public', 'hands', 'cards', '_variants')
+
+    def __init__(self, lobby):
+        self.version = lobby.version
+        status = lobby.status()
+        players = lobby.get_players()
+        self.status = encode(status)
+        self.players = encode(players)
+        self.public = encode(dict(status, players=players,
+                                  card_counts=[len(player.cards) for player in lobby.players]))
+        hands = [lobby.get_cards(seat)['cards'] for seat in range(len(lobby.players))]
+        self.hands = [encode(hand) for hand in hands]
+        self.cards = [encode({'cards': hand, 'images': [card_images[code] for code in hand]})
+                      for hand in hands]
+        # (name, player_id, mimetype, encoding) -> body, see variant
+        self._variants = {}
+
+    def variant(self, name, player_id, mimetype, encoding):
+        """Return a view in JSON or MSGPACK, compressed with encoding (None: not compressed)
+
+        name is status, players or cards, player_id the seat for cards.
+        Every variant is built once, by the first client asking for it.
+        """
+        key = (name, player_id, mimetype, encoding)
+        body = self._variants.get(key)
+        if body is None:
+            body = getattr(self, name)
+            if player_id is not None:
+                body = body[player_id]
+            if mimetype == MSGPACK:
+                body = to_msgpack(body)
+            if encoding is not None:
+                body = compress(body, encoding)
+            self._variants[key] = body
+        return body
+
+
+class ViewCache:
+    """LobbyViews of the current version of the lobbies, the size least recently used are kept"""
+
+    def __init__(self, store, size=1024):
+        self.store = store
+        self.size = size
+        # lobby_id -> LobbyViews, least recently used first
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+        store.add_listener(self.forget)
+
+    def get(self, lobby_id):
+        """Return the LobbyViews of the lobby, KeyError if it does not exist"""
+        version = self.store.version(lobby_id)
+        with self._lock:
+            views = self._views.get(lobby_id)
+            if views is not None and views.version == version:
+                self._views.move_to_end(lobby_id)
+                return views
+        # built outside of the lock, two requests may build the same version
+        with self.store.read(lobby_id) as lobby:
+            views = LobbyViews(lobby)
+        with self._lock:
+            self._views[lobby_id] = views
+            self._views.move_to_end(lobby_id)
+            while len(self._views) > self.size:
+                self._views.popitem(last=False)
+        return views
+
+    def forget(self, lobby_id):
+        """Drop the views of an edited or deleted lobby"""
+        with self._lock:
+            self._views.pop(lobby_id, None)
@@ -6,4 +6,38 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') \
             or 'sqlite:///' + os.path.join(basedir,'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-
+    # where the running games live: 'sqlite' (shared by all uWSGI workers),
+    # 'memory' (single process only, e.g. flask run) or 'sqlalchemy'
+    # (single process, kept in memory and saved in the background into the
+    # SQLALCHEMY_DATABASE_URI database every PERSIST_INTERVAL seconds) or
+    # 'journal' (single process, every action logged in JOURNAL_PATH)
+    LOBBY_STORE = os.environ.get('LOBBY_STORE') or 'sqlite'
+    LOBBY_STORE_PATH = os.environ.get('LOBBY_STORE_PATH') \
+            or os.path.join(basedir, 'lobbies.db')
+    # how long GET /api/lobby/wait holds a request before answering 304
+    LONGPOLL_TIMEOUT = int(os.environ.get('LONGPOLL_TIMEOUT') or 25)
+    PERSIST_INTERVAL = float(os.environ.get('PERSIST_INTERVAL') or 2)
+    # lobbies nobody played in for this many seconds are deleted, 0: never
+    LOBBY_TTL = float(os.environ.get('LOBBY_TTL') or 6 * 3600)
+    JOURNAL_PATH = os.environ.get('JOURNAL_PATH') \
+            or os.path.join(basedir, 'fodinha.journal')
+    # seconds between two snapshots of the lobbies, see fodinha.journal
+    JOURNAL_SNAPSHOT_INTERVAL = float(os.environ.get('JOURNAL_SNAPSHOT_INTERVAL') or 60)
+    # JOURNAL_SYNC=0: answer before the actions are on disk
+    JOURNAL_SYNC = os.environ.get('JOURNAL_SYNC') != '0'
+    # root log level, and per logger overrides e.g. 'fodinha=DEBUG,app.api=INFO'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_LEVELS = os.environ.get('LOG_LEVELS') or ''
+    # lobbies whose encoded views are kept in memory, see app.views
+    VIEW_CACHE_SIZE = int(os.environ.get('VIEW_CACHE_SIZE') or 1024)
+    # smaller API answers are sent uncompressed, see app.encoding
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 512)
+    # GET /metrics and the request and engine timers, see app.metrics;
+    # off unless METRICS=1: /metrics is not authenticated
+    METRICS = os.environ.get('METRICS') == '1'
+    # lobbies whose action counters are kept, the least recently active are dropped
+    METRICS_MAX_LOBBIES = int(os.environ.get('METRICS_MAX_LOBBIES') or 1000)
+    # profile one API request out of PROFILE_EVERY with cProfile, 0: never;
+    # PROFILE_DIR/profile-every overrides it while the app runs
+    PROFILE_EVERY = int(os.environ.get('PROFILE_EVERY') or 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(basedir, 'profiles')
@@ -0,0 +1,956 @@
+import enum
+import logging
+import pickle
+import random
+import struct
+
+from fodinha import tables
+
+logger = logging.getLogger(__name__)
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(state):
+    """Return the next state and the next 64 bits output of a splitmix64 generator
+
+    The per-lobby generator of the shuffle seeds: its whole state is one
+    integer, cheap to save in a snapshot (see Lobby.snapshot).
+    """
+    state = (state + 0x9E3779B97F4A7C15) & MASK64
+    z = state
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return state, z ^ (z >> 31)
+
+
+# snapshot layout, see Lobby.snapshot: this header then the length-prefixed
+# guesses, wins, played cards, seat arrays, deck, replay seeds, players, events
+SNAPSHOT_MAGIC = b'FDL1'
+SNAPSHOT_HEADER = struct.Struct('<4sIIBHQqbbbbbBBbBB')
+SHORT = struct.Struct('<H')
+LONG = struct.Struct('<I')
+# None in a seat array
+NO_SEAT = 255
+
+# longest player name, in utf-8 bytes: it must fit in a journal record
+MAX_NAME_SIZE = 44
+# players of a lobby: 52 cards deal at least 5 each, and a seat is a byte of the snapshots
+MIN_PLAYERS = 2
+MAX_PLAYERS = 10
+
+class Color(enum.IntEnum):
+    """Represent a card color
+
+    Manilla: colors are ranked from weakest to strongest
+    """
+    DIAMONDS = 1
+    SPADES = 2
+    HEARTS = 3
+    CLUBS = 4
+
+
+# colors of each value in a new deck, both engines deal the same cards from a seed
+DECK_COLORS = (Color.HEARTS, Color.SPADES, Color.DIAMONDS, Color.CLUBS)
+
+
+class TurnType(enum.Enum):
+    """Represent a type of turn, either 'guess' or 'play'"""
+    GUESS = enum.auto()
+    PLAY = enum.auto()
+    FINAL_GUESS = enum.auto()
+    FINAL_PLAY = enum.auto()
+    GAME_OVER = enum.auto()
+
+
+class Card:
+    """Represent a card: a value, color, owner_id
+
+    Values:
+    As = 1
+    Jack = 11
+    Queen = 12
+    King = 13
+
+    In Fodinha (ignoring the manilla) the strongest card is 2
+    then it goes As, K, J, Q (careful, J stronger than Q), etc
+    The real_value attribute reflects this:
+    3 => 1
+    4 => 2
+    ...
+    10 => 8
+    J (=11) => 10
+    Q (=12) => 9
+    K (=13) => 11
+    A (=1) => 12
+    2 => 13
+    """
+
+    def __init__(self, v, c):
+        # sanity checks
+        if v not in range(1, 14):
+            raise ValueError('Given value not in the [1;13] interval:', v)
+        if not isinstance(c, Color):
+            raise TypeError('Given color is not of type Color:', c)
+
+        self.value = v
+        self.color = c
+        self.owner_id = None
+
+        # set the real_value attribute, useful for comparing values
+        if v > 2 and v <= 10:
+            self.real_value = v - 2
+        elif v == 11:
+            self.real_value = 10
+        elif v == 12:
+            self.real_value = 9
+        elif v == 13:
+            self.real_value = 11
+        else:
+            self.real_value = v + 11
+
+    def __str__(self):
+        """Return 'value;color', e.g. '12;3' for the queen of hearts"""
+        # int(): str() of an IntEnum member is 'Color.HEARTS' before Python 3.11
+        return '{};{}'.format(self.value, int(self.color))
+
+
+class Player:
+    """Represent a player and his current cards"""
+
+    def __init__(self, player_id, name):
+        # attributes forever
+        self.name = name
+        self.player_id = player_id
+        # TODO for now 5 cards per player at the beginning
+        self.number_of_lives = 5
+
+        # attributes for current gameturn
+        self.cards = []
+
+    def draw_card(self, card):
+        """Adds a card to the current hand"""
+        card.owner_id = self.player_id
+        self.cards.append(card)
+
+    def play_card(self, card_index):
+        """Pops a chosen card from current hand and returns it"""
+        return self.cards.pop(card_index)
+
+    def is_alive(self):
+        return self.number_of_lives > 0
+
+    def is_dead(self):
+        return self.number_of_lives == 0
+
+    def lose_life(self, life_loss):
+        self.number_of_lives -= life_loss
+        if self.number_of_lives < 0:
+            self.number_of_lives = 0
+
+    def has_cards(self):
+        return len(self.cards) > 0
+
+    def throw_remaining_cards(self):
+        self.cards = []
+
+    def __str__(self):
+        """Return id, name, number of lives, current cards"""
+        return "; ".join([str(self.player_id), self.name, str(self.number_of_lives), str([str(card) for card in self.cards])])
+
+
+class Lobby:
+    """Represent a table and a running game.
+
+    Should be able to:
+    * launch a game -> fn __init__(number_of_players)
+    * return a complete game status -> fn status()
+    * register a player -> fn register(player)
+    * draw a card for a player -> fn draw(player)
+
+    Vocabulary: X turns per gameturn, Y gameturns per game, at least
+    one card is lost by at least one player per gameturn
+    """
+
+    # class used for the registered players
+    player_class = Player
+
+    # lobbies pickled before the generator existed draw a state at their next shuffle
+    rng_state = None
+
+    def __init__(self, lobby_id, number_of_players, seed=None):
+        """Create a new game instance
+
+        seed: seed of the shuffles, a game with the same seed and the same
+        actions deals the same cards. None for a random one.
+        """
+        if not MIN_PLAYERS <= number_of_players <= MAX_PLAYERS:
+            raise ValueError('A lobby has {} to {} players, not {}'.format(
+                MIN_PLAYERS, MAX_PLAYERS, number_of_players))
+        # attributes for keeping track of the current game
+        # in Fodinha the dealer starts
+        self.players = []
+        self.number_of_players = number_of_players
+        self.lobby_id = lobby_id
+
+        # these values are set in the prepare_gameturn f'n
+        # here, we set the default that will result in the dealer in position 0
+        self.current_dealer_id = -1
+        self.current_player_id = None
+
+        # 0: game not started, n: currently in nth gameturn
+        self.gameturn_number = 0
+
+        # attributes for keeping track of the current gameturn
+        self.current_beforemanilla = None
+        self.current_number_of_turns = None
+        self.current_turn_number = None
+        self.current_turn_type = None
+        self.current_win_value = 1
+        self.current_guesses = []
+        self.current_wins = []
+        self.current_played_cards = []
+        # number of cards of the current turn, set when its first card is played
+        self.current_turn_size = None
+
+        # seats bookkeeping, maintained along the game so that finding
+        # the next dealer or player doesn't need to look at every seat
+        # next_alive_seat[i]: first alive seat after seat i
+        # next_holding_seat[i], previous_holding_seat[i]: ring of the seats
+        # holding cards in the current gameturn, see unlink_holding_seat
+        self.alive_count = 0
+        self.holding_count = 0
+        self.next_alive_seat = []
+        self.next_holding_seat = []
+        self.previous_holding_seat = []
+
+        # full deck: will be created at beginning of each gameturn
+        self.deck = []
+        # each shuffle draws a seed, kept here and never sent to the clients
+        # (it gives every hand away); seeds put in replay_seeds are used
+        # first, to replay a game (see fodinha.journal)
+        self.shuffle_seed = None
+        self.replay_seeds = []
+        # state of the generator of the shuffle seeds, see splitmix64
+        self.rng_state = random.getrandbits(64) if seed is None else seed & MASK64
+        # when all players join, a gameturn must be prepared and the game can start
+
+        # incremented on every change of the game, clients compare it with
+        # the last version they have seen to know if something happened
+        self.version = 0
+
+        # append-only log of what happened in the game, see log_event
+        self.events = []
+
+    def generate_new_deck(self):
+        """Generate a new full deck"""
+        deck = []
+        for value in range(1, 14):
+            for color in DECK_COLORS:
+                deck.append(Card(value, color))
+
+        return deck
+
+    def following_seats(self, is_kept):
+        """For each seat, return the first seat after it for which is_kept(player) is true
+
+        Seats are walked backwards twice around the table, O(number of players).
+        """
+        following = [None] * self.number_of_players
+        next_kept = None
+        for i in range(2 * self.number_of_players - 1, -1, -1):
+            seat = i % self.number_of_players
+            if i < self.number_of_players:
+                following[seat] = next_kept
+            if is_kept(self.players[seat]):
+                next_kept = seat
+        return following
+
+    def update_alive_seats(self):
+        """Rebuild next_alive_seat, called when a player dies"""
+        self.next_alive_seat = self.following_seats(Player.is_alive)
+
+    def link_holding_seats(self):
+        """Build the ring of the seats holding cards, after the cards are drawn"""
+        self.next_holding_seat = self.following_seats(Player.has_cards)
+        self.previous_holding_seat = [None] * self.number_of_players
+        for seat, next_seat in enumerate(self.next_holding_seat):
+            if self.players[seat].has_cards():
+                self.previous_holding_seat[next_seat] = seat
+        self.holding_count = self.alive_count
+
+    def unlink_holding_seat(self, seat):
+        """Remove a seat whose hand is now empty from the ring
+
+        The removed seat keeps its next_holding_seat: following it (and the
+        ones after it if they were removed too) always ends on a seat
+        holding cards, as long as there is one.
+        """
+        previous_seat = self.previous_holding_seat[seat]
+        next_seat = self.next_holding_seat[seat]
+        self.next_holding_seat[previous_seat] = next_seat
+        self.previous_holding_seat[next_seat] = previous_seat
+        self.holding_count -= 1
+
+    def holding_seat_after(self, seat):
+        """Return the first seat holding cards after the given one"""
+        seat = self.next_holding_seat[seat]
+        while not self.players[seat].has_cards():
+            seat = self.next_holding_seat[seat]
+        return seat
+
+    def set_next_dealer_id(self):
+        """Set the dealer and player IDs for the current gameturn"""
+        # the next alive seat, a dealer of -1 results in the dealer in position 0
+        self.current_dealer_id = self.next_alive_seat[self.current_dealer_id % self.number_of_players]
+        # the dealer is always the next player
+        # (f'n is only called when preparing a gameturn)
+        self.current_player_id = self.current_dealer_id
+
+    def set_next_player_id(self):
+        """Set the player ID for the current turn"""
+        # the next player with cards (dead players have none)
+        self.current_player_id = self.holding_seat_after(self.current_player_id)
+
+    def get_alive_player_id(self, given_id):
+        """For a current_guesses position, return corresponding player ID"""
+        # we need the given_id to be the corresponding alive player
+        alive_player_id = 0
+
+        # for all players
+        for i in range(self.number_of_players):
+            if self.players[i].is_alive():
+                # check if this is the player we want
+                if alive_player_id == given_id:
+                    logger.debug('alive player %s is at position %s', i, given_id)
+                    return i
+                # update alive_player_id for all alive players
+                alive_player_id += 1
+
+    def count_alive_players(self):
+        """Returns the number of currently alive players"""
+        return self.alive_count
+
+    def count_having_cards_players(self):
+        """Returns the number of currently holding cards players"""
+        return self.holding_count
+
+
+    def register_player(self, name):
+        """Create a new player without assigning him cards"""
+        current_id = len(self.players)
+        # if all players already joined
+        if current_id == self.number_of_players:
+            raise RuntimeError('A player is trying to join a full lobby. His name: ', name)
+        elif len(name.encode('utf-8')) > MAX_NAME_SIZE:
+            raise ValueError('Name longer than {} bytes: {}'.format(MAX_NAME_SIZE, name))
+        # else append a new Player instance to the list of players
+        # the name argument is the chosen username
+        else:
+            assert current_id >= 0 and current_id < self.number_of_players
+            self.players.append(self.player_class(current_id, name))
+            self.alive_count += 1
+            self.version += 1
+            self.log_event('player_joined', player_id=current_id, name=name)
+            return current_id
+
+    def set_current_number_of_turns(self):
+        """Calculate the number of turns for this gameturn and set attributes"""
+        # in all cases this is the start of a new gameturn
+        self.current_turn_number = 0
+
+        # now we find how many turns this gameturn gon be
+        number_of_cards_per_player = [player.number_of_lives for player in self.players]
+        max_lives = max(number_of_cards_per_player)
+        if number_of_cards_per_player.count(max_lives) > 1:
+            self.current_number_of_turns = max_lives
+        else:
+            # if the player with most lives is alone, the second player 
+            # with most lives determines the number of turns
+            number_of_cards_per_player.remove(max_lives)
+            self.current_number_of_turns = max(number_of_cards_per_player)
+
+        # create the current_wins array
+        # if 3 players are still alive, length 3
+        # a given win index is for the given player
+        # (even though dead players shouldn't win)
+        self.current_wins = [0 for _ in range(self.number_of_players)]
+
+    def close_turn(self):
+        """Close a current turn"""
+        # first off update the attributes
+        self.current_turn_number += 1
+        self.version += 1
+
+        # find who won this turn and update the current_wins list
+        win_value = self.current_win_value
+        winner_id = self.update_current_wins()
+        self.log_event('turn_closed', winner_id=winner_id, win_value=win_value)
+
+        # empty the played_cards array
+        self.current_played_cards = []
+
+        # if this was the final turn, close the gameturn
+        # this is where the life loss happen
+        if self.current_turn_number == self.current_number_of_turns:
+            return self.close_gameturn()
+
+        # otherwise we continue on to a play turn
+        # it's again the dealer's turn to play
+        # only if he still has cards, otherwise next player
+        self.rewind_player_id()
+
+    def rewind_player_id(self):
+        """Set current_player_id from dealer ID, checking if he has cards"""
+        if self.holding_count == 0:
+            raise RuntimeError("No players left with cards, should have called close_gameturn")
+        self.current_player_id = self.current_dealer_id
+        # if the dealer has no cards, it's to the next player with cards
+        if not self.players[self.current_player_id].has_cards():
+            self.current_player_id = self.holding_seat_after(self.current_player_id)
+
+    def find_turn_winner(self):
+        """Return the owner ID of the card winning the turn, None if all cards canceled out"""
+        # set the value of the current manilla
+        if self.current_beforemanilla.real_value == 13:
+            manilla_value = 1
+        else:
+            manilla_value = self.current_beforemanilla.real_value + 1
+
+        # one pass over the played cards
+        # a manilla beats everything, between manillas highest color wins
+        # for the other cards we count how many times each real value is played
+        # and who played it (only useful if it is played once)
+        winning_manilla = None
+        counts = [0] * 14
+        owners = [None] * 14
+        for c in self.current_played_cards:
+            if c.real_value == manilla_value:
+                if winning_manilla is None or c.color > winning_manilla.color:
+                    winning_manilla = c
+            else:
+                counts[c.real_value] += 1
+                owners[c.real_value] = c.owner_id
+
+        if winning_manilla is not None:
+            return winning_manilla.owner_id
+
+        # no manilla: cards that appear more than one time cancel out,
+        # the highest remaining value wins
+        for real_value in range(13, 0, -1):
+            if counts[real_value] == 1:
+                return owners[real_value]
+        return None
+
+    def update_current_wins(self):
+        """Update the current_wins array at the end of a turn, return the winner ID"""
+        # this is the index in the current_wins array
+        winner_owner = self.find_turn_winner()
+
+        # if all cards canceled out
+        # whoever wins next round wins 2 points
+        # 3 if it happens again and so on
+        if winner_owner is None:
+            self.current_win_value += 1
+            return None
+
+        # the winner's win is taken into account
+        self.current_wins[winner_owner] += self.current_win_value
+        # if the win value is not at one, it has been applied hence reset it
+        self.current_win_value = 1
+        return winner_owner
+
+
+    def prepare_gameturn(self):
+        """Shuffle deck, draw all cards for beginning of gameturn"""
+        # shuffle deck at the beginning of gameturn
+        self.shuffle_deck()
+
+        # draw the current 'beforemanilla' card and set attributes
+        self.draw_beforemanilla()
+
+        # set attributes for the gameturn
+        self.gameturn_number += 1
+        self.set_current_number_of_turns()
+        self.set_next_dealer_id()
+
+        # be careful when handling the content of current_guesses
+        # a guess at position 1 could be for player in position 3
+        # if players 1 and 2 are dead
+        # it is created by appending an empty array
+        self.current_guesses = []
+
+        # draw the current number of cards per player
+        for player in self.players:
+            # if a player still has cards from previous gameturn
+            # discard them
+            player.throw_remaining_cards()
+            for _ in range(player.number_of_lives):
+                self.draw(player)
+        self.link_holding_seats()
+
+        # we then set the first turn type for this gameturn
+        # this is either guess or final_guess
+        if self.count_alive_players() == 2:
+            self.current_turn_type = TurnType.FINAL_GUESS
+        else:
+            self.current_turn_type = TurnType.GUESS
+
+        self.log_event('gameturn_dealt',
+                       gameturn_number=self.gameturn_number,
+                       dealer_id=self.current_dealer_id,
+                       beforemanilla=self.card_str(self.current_beforemanilla),
+                       number_of_turns=self.current_number_of_turns,
+                       turn_type=self.current_turn_type.value)
+
+    def close_gameturn(self):
+        """Close a gameturn, applies life losses"""
+        # calculate life loss between given guesses and actual wins
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('closing gameturn', extra={'lobby_id': self.lobby_id,
+                                                    'gameturn_number': self.gameturn_number})
+        # first, find the corresponding true id of the player
+        # current_dealer_id started, so his guesses/wins are the first
+        # etc for all alive players
+        alive_player_ids = []
+        current_player_id = self.current_dealer_id
+        for _ in range(self.alive_count):
+            alive_player_ids.append(current_player_id)
+            current_player_id = self.next_alive_seat[current_player_id]
+
+        # zip the true ids of the players with their corresponding wins and guesses
+        for i, g in zip(alive_player_ids, self.current_guesses):
+            w = self.current_wins[i]
+            life_loss = abs(g-w)
+            # if they didn't guess what they won they lose life
+            if life_loss != 0:
+                self.players[i].lose_life(life_loss)
+                self.log_event('lives_lost', player_id=i, life_loss=life_loss,
+                               lives=self.players[i].number_of_lives)
+                if self.players[i].is_dead():
+                    self.alive_count -= 1
+        if self.alive_count < len(alive_player_ids):
+            self.update_alive_seats()
+
+        # if this is the end of the game we stop here
+        # even if no final_guess/final_play necessary
+        if self.count_alive_players() <= 1 or self.current_turn_type == TurnType.FINAL_PLAY:
+            self.current_turn_type = TurnType.GAME_OVER
+            self.log_event('game_over')
+        # else we prepare the next gameturn
+        else:
+            self.prepare_gameturn()
+
+    def guess(self, player_id, given_guess):
+        """Assign a guess to a player, if it's his turn"""
+        # sanity checks
+        # is this a guess turn
+        if self.current_turn_type != TurnType.GUESS and self.current_turn_type != TurnType.FINAL_GUESS:
+            raise RuntimeError(\
+    'Supplied a play for a guess turn: player ID is ', player_id, ' turn type is ', self.current_turn_type)
+        # is this player the current player
+        elif player_id != self.current_player_id:
+            raise RuntimeError(\
+    "It is not this player's turn! Player ID: ", player_id, " current player ", self.current_player_id)
+        # is he alive
+        elif self.players[player_id].is_dead():
+            raise RuntimeError(\
+    "It is not this player's turn! Player ID: ", player_id, " current player ", self.current_player_id)
+        # a guess is a number of turns won in this gameturn
+        elif not 0 <= given_guess <= self.current_number_of_turns:
+            raise ValueError(\
+                "Guess out of range! Guess: {}, number of turns: {}"\
+                .format(given_guess, self.current_number_of_turns))
+        # if not, this is a valid guess
+
+        # now check if it's the final guess:
+        if len(self.current_guesses) == self.count_alive_players() - 1:
+            # you can't guess something that would not fuck anyone
+            # TODO be careful to catch TypeError in the flask app
+            guessed_total = sum(self.current_guesses) + given_guess
+            if guessed_total == self.current_number_of_turns:
+                raise ValueError(\
+    "Thi guess is forbidden in the 'pé' position. Player ID: ", player_id, " given guess: ", given_guess)
+            else:
+                # the guess will be added just below, here we set the turntype to play or final_play
+                if self.current_turn_type == TurnType.GUESS:
+                    self.current_turn_type = TurnType.PLAY
+                else:
+                    self.current_turn_type = TurnType.FINAL_PLAY
+
+        # we add the given guess and set next player
+        # this is for a normal guess or a valid last guess
+        self.current_guesses.append(given_guess)
+        self.version += 1
+        self.log_event('guess', player_id=player_id, guess=given_guess)
+        self.set_next_player_id()
+
+    def play(self, player_id, played_card_index):
+        """Play a player's card, if it's his turn"""
+        # is this a play turn
+        if self.current_turn_type != TurnType.PLAY and self.current_turn_type != TurnType.FINAL_PLAY:
+            raise RuntimeError(\
+                "Supplied a guess for a play turn: player ID is {}, turn type {}"\
+                .format(player_id, self.current_turn_type))
+        # is this player the current player
+        elif player_id != self.current_player_id:
+            raise RuntimeError(\
+                "It is not this player's turn! Player ID: {} current {})"\
+                .format(player_id, self.current_player_id))
+        # is he alive
+        elif self.players[player_id].is_dead():
+            raise RuntimeError(\
+                "This player is dead! Player ID: {} (current player {})"\
+                .format(player_id, self.current_player_id))
+        # does he have cards
+        elif not self.players[player_id].has_cards():
+            raise RuntimeError(\
+                "This player has no cards! Being his turn should never happen. Player ID: {} (current player {})"\
+                .format(player_id, self.current_player_id))
+        # a negative index would take a card from the end of the hand
+        elif played_card_index < 0:
+            raise ValueError(\
+                "Incorrect card index specified! Index: {}, Player ID: {}"\
+                .format(played_card_index, self.current_player_id))
+
+
+        # the first card of a turn: every player holding cards will play one
+        if not self.current_played_cards:
+            self.current_turn_size = self.holding_count
+
+        # get the played card or raise ValueError from the IndexError (catched in Flask)
+        try:
+            played_card = self.players[player_id].play_card(played_card_index)
+        except IndexError as error:
+            raise ValueError(\
+                "Incorrect card index specified! Index: {}, Player ID: {}"\
+                .format(played_card_index, self.current_player_id))\
+                from error
+        # else this is a valid play
+        # set the played card
+        # checked first so that a disabled debug log costs nothing more
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('card played', extra={'lobby_id': self.lobby_id, 'player_id': player_id,
+                                               'card': self.card_str(played_card)})
+        self.current_played_cards.append(played_card)
+        self.version += 1
+        self.log_event('card_played', player_id=player_id, card=self.card_str(played_card),
+                       index=played_card_index)
+        if not self.players[player_id].has_cards():
+            self.unlink_holding_seat(player_id)
+
+        # now check if this was the final play for this turn
+        # i.e. everyone holding cards at its beginning has played
+        if len(self.current_played_cards) == self.current_turn_size:
+            self.close_turn()
+        # else set the next player
+        else:
+            self.set_next_player_id()
+
+    def draw(self, player):
+        """Return a random card from the current shuffled deck"""
+        drawn_card = self.deck.pop()
+        player.draw_card(drawn_card)
+
+    def shuffle_deck(self):
+        """Generate a new full deck and shuffles it"""
+        self.deck = self.generate_new_deck()
+        if self.rng_state is None:
+            self.rng_state = random.getrandbits(64)
+        # the generator moves on even for a replayed seed: a lobby recovered
+        # from a snapshot and its journal stays in step with the original
+        self.rng_state, output = splitmix64(self.rng_state)
+        if self.replay_seeds:
+            self.shuffle_seed = self.replay_seeds.pop(0)
+        else:
+            self.shuffle_seed = output >> 32
+        random.Random(self.shuffle_seed).shuffle(self.deck)
+
+    def draw_beforemanilla(self):
+        """Set the current_beforemanilla card"""
+        self.current_beforemanilla = self.deck.pop()
+
+    def start_game(self):
+        """Start the game, set all necessary attributes"""
+
+        # is the game ready
+        if self.number_of_players != len(self.players):
+            raise RuntimeError('Not all players have joined. Current player count:', len(self.players))
+
+        # the game can start!
+        self.update_alive_seats()
+        self.prepare_gameturn()
+        self.version += 1
+
+    def get_players(self):
+        """Return names, lives of all players and current dealer ID"""
+        return {'names': [p.name for p in self.players],
+                'lives': [p.number_of_lives for p in self.players],
+                'dealer_id': self.current_dealer_id}
+
+    def card_str(self, card):
+        """Return the string form of a card (see Card class)"""
+        return str(card)
+
+    def log_event(self, event_type, **data):
+        """Append an event to the log of the game
+
+        Events are dicts with a sequence number (1 for the first event),
+        a type and the data of this type:
+        player_joined: player_id, name
+        gameturn_dealt: gameturn_number, dealer_id, beforemanilla, number_of_turns, turn_type
+
+        The log is sent to the players: nothing private goes in it, like
+        the hands or the seed of the shuffle.
+        guess: player_id, guess
+        card_played: player_id, card, index
+        turn_closed: winner_id (None if all cards canceled out), win_value
+        lives_lost: player_id, life_loss, lives
+        game_over
+        """
+        data['seq'] = len(self.events) + 1
+        data['type'] = event_type
+        self.events.append(data)
+
+    def events_since(self, seq):
+        """Return the events after the given sequence number
+
+        With the current player and turn type, this is all a client needs
+        to rebuild the status it got at sequence number seq. If seq is ahead
+        of the log (the lobby is not the one the client knew), the whole
+        log is returned and 'reset' is set.
+        """
+        reset = seq > len(self.events)
+        if reset or seq < 0:
+            seq = 0
+        # the logs of older versions have the seed in gameturn_dealt
+        events = [event if 'seed' not in event else {key: value for key, value in event.items() if key != 'seed'}
+                  for event in self.events[seq:]]
+        return {
+                'seq': len(self.events),
+                'events': events,
+                'reset': reset,
+                'current_player_id': self.current_player_id,
+                'current_turn_type': self.current_turn_type and self.current_turn_type.value,
+                'version': self.version,
+                }
+
+    def get_cards(self, player_id):
+        """Return the cards of the specified player"""
+        return {'cards': [str(c) for c in self.players[player_id].cards]}
+
+    def card_real_value_color(self, card):
+        """Return the (real_value, color) of a card"""
+        return card.real_value, int(card.color)
+
+    def expected_tricks(self, player_id):
+        """Return the tricks the hand of a player wins on average, from the tables of fodinha.tables"""
+        if self.current_beforemanilla is None:
+            raise RuntimeError('No gameturn was dealt yet')
+        cards = [self.card_real_value_color(card) for card in self.players[player_id].cards]
+        beforemanilla_value, _ = self.card_real_value_color(self.current_beforemanilla)
+        return tables.default_table().get(cards, beforemanilla_value, self.count_alive_players())
+
+    def suggest_guess(self, player_id):
+        """Return a guess for a player: its expected tricks rounded, never the forbidden 'pé' guess
+
+        A lookup in a precomputed table, cheap enough for the hints of the
+        UI and for quick bots.
+        """
+        expected = self.expected_tricks(player_id)
+        suggested = min(int(expected + 0.5), self.current_number_of_turns)
+        if len(self.current_guesses) == self.count_alive_players() - 1 and \
+                sum(self.current_guesses) + suggested == self.current_number_of_turns:
+            # the closest allowed guess
+            if suggested == 0 or (expected > suggested and suggested < self.current_number_of_turns):
+                suggested += 1
+            else:
+                suggested -= 1
+        return suggested
+
+
+    def status(self):
+        """Return detailed status of game
+
+        The returned JSON is in the following format:
+        {
+            gameturn_number: current_gameturn_number
+            current_beforemanilla: the drawn card that sets the manilla (the one above), None before the game
+            current_player_id: the player we are waiting on (either to play or guess)
+            current_dealer_id: dealer, this is the id first guessing or playing
+            current_number_of_turns: how many turns for the current gameturn
+            current_turn_number: which turn number is it
+            current_turn_type: either 'guess' (1) or 'play' (2), (3,4 if this is the final turn)
+            current_guesses: if applicable, [1, 0, 0, 1, 0...] the guesses of each player for current turn
+            current_wins: if applicable, [1, 0, 0, 1, 0...] the wins of each player for current turn
+            current_played_cards: if applicable, ['1;3', ...] (see Card class)
+            version: incremented on every change of the game
+        }
+        """
+        return {
+                'gameturn_number': self.gameturn_number,
+                'current_beforemanilla': self.current_beforemanilla and str(self.current_beforemanilla),
+                'current_player_id': self.current_player_id,
+                'current_dealer_id': self.current_dealer_id,
+                'current_number_of_turns': self.current_number_of_turns,
+                'current_turn_number': self.current_turn_number,
+                'current_turn_type': self.current_turn_type and self.current_turn_type.value,
+                'current_guesses': list(self.current_guesses),
+                'current_wins': list(self.current_wins),
+                'current_played_cards': [str(card) for card in self.current_played_cards],
+                'version': self.version,
+                }
+
+    def card_to_code(self, card):
+        """Return the code of a card, (value - 1) * 4 + color - 1 as in fodinha.compact"""
+        return (card.value - 1) * 4 + int(card.color) - 1
+
+    def codes_to_cards(self, codes, owner_id=None):
+        """Return the cards of a list of codes, owned by owner_id"""
+        cards = [Card(code // 4 + 1, Color(code % 4 + 1)) for code in codes]
+        for card in cards:
+            card.owner_id = owner_id
+        return cards
+
+    def played_to_codes(self, played_card):
+        """Return the (owner_id, code) of a played card"""
+        return played_card.owner_id, self.card_to_code(played_card)
+
+    def codes_to_played(self, owner_id, code):
+        """Return the played card of an owner and a code"""
+        return self.codes_to_cards((code,), owner_id)[0]
+
+    def snapshot(self, events=True):
+        """Return the whole state of the lobby as bytes, see restore
+
+        Cards are one byte codes, whatever the engine: a snapshot of a
+        Lobby restores as a CompactLobby and the other way round. The event
+        log is most of the size; without it (events=False) the restored
+        lobby has an empty log, for simulations that never read it.
+        ValueError if a field does not fit in the layout.
+        """
+        if not 0 <= self.lobby_id < 2 ** 32 or not 0 <= self.version < 2 ** 32:
+            raise ValueError('Can\'t snapshot lobby {} at version {}: IDs and versions are 32 bits'.format(
+                self.lobby_id, self.version))
+        if not all(0 <= number < 256 for number in self.current_guesses + self.current_wins):
+            raise ValueError('Can\'t snapshot lobby {}: guesses and wins are 0 to 255, not {} {}'.format(
+                self.lobby_id, self.current_guesses, self.current_wins))
+        for player in self.players:
+            if len(player.name.encode('utf-8')) > 65535:
+                raise ValueError('Can\'t snapshot lobby {}: name of {} bytes'.format(
+                    self.lobby_id, len(player.name.encode('utf-8'))))
+
+        def seats(array):
+            return bytes(NO_SEAT if seat is None else seat for seat in array)
+
+        def none_to(value):
+            return -1 if value is None else value
+
+        if self.current_beforemanilla is None:
+            beforemanilla = -1
+        else:
+            beforemanilla = self.card_to_code(self.current_beforemanilla)
+
+        header = SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, self.lobby_id, self.version, self.number_of_players, self.gameturn_number,
+                self.rng_state if self.rng_state is not None else random.getrandbits(64),
+                none_to(self.shuffle_seed), self.current_dealer_id, none_to(self.current_player_id),
+                beforemanilla,
+                none_to(self.current_number_of_turns), none_to(self.current_turn_number),
+                0 if self.current_turn_type is None else self.current_turn_type.value,
+                self.current_win_value, none_to(self.current_turn_size), self.alive_count, self.holding_count)
+        played = bytearray()
+        for played_card in self.current_played_cards:
+            played.extend(self.played_to_codes(played_card))
+        sections = [bytes(self.current_guesses), bytes(self.current_wins), played,
+                    seats(self.next_alive_seat), seats(self.next_holding_seat), seats(self.previous_holding_seat),
+                    bytes(self.card_to_code(card) for card in self.deck),
+                    b''.join(LONG.pack(seed) for seed in self.replay_seeds)]
+        data = bytearray(header)
+        for section in sections:
+            data += SHORT.pack(len(section))
+            data += section
+        # the players who joined, all of them once the game started
+        data.append(len(self.players))
+        for player in self.players:
+            name = player.name.encode('utf-8')
+            data += SHORT.pack(len(name))
+            data += name
+            data.append(player.number_of_lives)
+            data.append(len(player.cards))
+            data.extend(self.card_to_code(card) for card in player.cards)
+        # pickled: the log is dicts of a few types, pickle is the smallest and fastest
+        log = pickle.dumps(self.events, protocol=pickle.HIGHEST_PROTOCOL) if events else b''
+        data += LONG.pack(len(log))
+        data += log
+        return bytes(data)
+
+    @classmethod
+    def restore(cls, data):
+        """Return a new lobby of this class from the bytes of snapshot()"""
+        (magic, lobby_id, version, number_of_players, gameturn_number, rng_state, shuffle_seed,
+         dealer_id, player_id, beforemanilla, number_of_turns, turn_number, turn_type, win_value,
+         turn_size, alive_count, holding_count) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Not a lobby snapshot')
+        lobby = cls(lobby_id, number_of_players, seed=rng_state)
+        offset = SNAPSHOT_HEADER.size
+
+        def section():
+            nonlocal offset
+            (size,) = SHORT.unpack_from(data, offset)
+            offset += SHORT.size + size
+            return data[offset - size:offset]
+
+        def seats(array):
+            return [None if seat == NO_SEAT else seat for seat in array]
+
+        def from_none(value):
+            return None if value == -1 else value
+
+        lobby.version = version
+        lobby.gameturn_number = gameturn_number
+        lobby.shuffle_seed = from_none(shuffle_seed)
+        lobby.current_dealer_id = dealer_id
+        lobby.current_player_id = from_none(player_id)
+        if beforemanilla != -1:
+            lobby.current_beforemanilla = lobby.codes_to_cards((beforemanilla,))[0]
+        lobby.current_number_of_turns = from_none(number_of_turns)
+        lobby.current_turn_number = from_none(turn_number)
+        lobby.current_turn_type = TurnType(turn_type) if turn_type else None
+        lobby.current_win_value = win_value
+        lobby.current_turn_size = from_none(turn_size)
+        lobby.alive_count = alive_count
+        lobby.holding_count = holding_count
+
+        lobby.current_guesses = list(section())
+        lobby.current_wins = list(section())
+        played = section()
+        lobby.current_played_cards = [lobby.codes_to_played(played[i], played[i + 1])
+                                      for i in range(0, len(played), 2)]
+        lobby.next_alive_seat = seats(section())
+        lobby.next_holding_seat = seats(section())
+        lobby.previous_holding_seat = seats(section())
+        lobby.deck = lobby.codes_to_cards(section())
+        seeds = section()
+        lobby.replay_seeds = [LONG.unpack_from(seeds, i)[0] for i in range(0, len(seeds), LONG.size)]
+        number_of_joined = data[offset]
+        offset += 1
+        for seat in range(number_of_joined):
+            (size,) = SHORT.unpack_from(data, offset)
+            offset += SHORT.size + size
+            player = lobby.player_class(seat, bytes(data[offset - size:offset]).decode('utf-8'))
+            player.number_of_lives = data[offset]
+            size = data[offset + 1]
+            offset += 2 + size
+            player.cards = lobby.codes_to_cards(data[offset - size:offset], seat)
+            lobby.players.append(player)
+        (size,) = LONG.unpack_from(data, offset)
+        offset += LONG.size
+        if size:
+            lobby.events = pickle.loads(data[offset:offset + size])
+        return lobby
+
+    def clone(self, events=True):
+        """Return an independent copy of the lobby, faster than copy.deepcopy"""
+        return self.restore(self.snapshot(events))
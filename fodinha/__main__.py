@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+from pprint import pprint
+
+from fodinha import Lobby, TurnType
+
+# mock game for testing: python -m fodinha
+newgame = Lobby(1, 3)
+newgame.register_player('pitoco')
+newgame.register_player('dog')
+newgame.register_player('as formigas la fora')
+newgame.start_game()
+while True:
+    current_player = newgame.players[newgame.current_player_id]
+    pprint(newgame.status())
+    print("\nCurrent player:")
+    print(str(current_player))
+    if newgame.current_turn_type == TurnType.GUESS or newgame.current_turn_type == TurnType.FINAL_GUESS:
+        newgame.guess(current_player.player_id, int(input('Guess: ')))
+    elif newgame.current_turn_type == TurnType.PLAY or newgame.current_turn_type == TurnType.FINAL_PLAY:
+        newgame.play(current_player.player_id, int(input('Play: ')))
+    else:
+        print("Current turn type: {}".format(newgame.current_turn_type))
+        print()
+        print(newgame.status())
+        break
+
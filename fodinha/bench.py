@@ -0,0 +1,222 @@
+"""Benchmarks of the rules engine hot paths: python -m fodinha.bench
+
+Every case is timed for 2 to 10 players and for both engines (Lobby and
+CompactLobby), the result is the best time per call out of --repeat runs.
+
+To catch regressions, save a baseline and compare later runs against it:
+
+    python -m fodinha.bench --save bench.json
+    python -m fodinha.bench --compare bench.json --max-regression 0.25
+
+The comparison exits with status 1 if any case got slower than the
+baseline by more than the given ratio.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from fodinha import Card, Color, Lobby, TurnType
+from fodinha.compact import CompactLobby, card_code
+from fodinha.sim import allowed_guess
+
+ENGINES = {'objects': Lobby, 'compact': CompactLobby}
+PLAYER_COUNTS = range(2, 11)
+
+
+def new_game(engine, number_of_players, seed=0):
+    """Return a started game, waiting for the first guess"""
+    lobby = engine(0, number_of_players, seed=seed)
+    for i in range(number_of_players):
+        lobby.register_player('bench{}'.format(i))
+    lobby.start_game()
+    return lobby
+
+
+def make_guesses(lobby):
+    """Make all the guesses of the gameturn, everyone guesses 1 when possible"""
+    while lobby.current_turn_type == TurnType.GUESS or lobby.current_turn_type == TurnType.FINAL_GUESS:
+        lobby.guess(lobby.current_player_id, allowed_guess(lobby, 1))
+
+
+def make_trick(lobby, cards):
+    """Set the beforemanilla and the played cards of a lobby from (value, color) pairs
+
+    The first pair is the beforemanilla, the other ones are played in order
+    by players 0, 1, ...
+    """
+    beforemanilla = Card(*cards[0])
+    played_cards = []
+    for owner_id, (value, color) in enumerate(cards[1:]):
+        card = Card(value, color)
+        card.owner_id = owner_id
+        played_cards.append(card)
+
+    if isinstance(lobby, CompactLobby):
+        lobby.current_beforemanilla = card_code(beforemanilla)
+        lobby.current_played_cards = [card.owner_id << 6 | card_code(card) for card in played_cards]
+    else:
+        lobby.current_beforemanilla = beforemanilla
+        lobby.current_played_cards = played_cards
+
+
+def trick_cards(case, number_of_players, rng):
+    """Return the beforemanilla and played cards of a trick
+
+    mixed: random cards
+    manillas: the manilla (a 5 here) is played by everyone, colors decide
+    cancel: every value is played twice, nobody wins
+    """
+    if case == 'mixed':
+        deck = [(value, color) for value in range(1, 14) for color in Color]
+        return rng.sample(deck, number_of_players + 1)
+    elif case == 'manillas':
+        return [(4, Color.HEARTS)] + [(5, rng.choice(list(Color))) for _ in range(number_of_players)]
+    else:
+        values = [3 + i // 2 for i in range(number_of_players)]
+        if number_of_players % 2:
+            # the odd card out is a pair with the last one
+            values[-1] = values[-2]
+        # king as beforemanilla: the manilla is the as, never played here
+        return [(13, Color.HEARTS)] + [(value, Color.SPADES) for value in values]
+
+
+def best_of(function, repeat, number):
+    """Return the best time of a call to function, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_prepare_gameturn(engine, number_of_players, repeat, number):
+    lobby = new_game(engine, number_of_players)
+    return best_of(lobby.prepare_gameturn, repeat, number)
+
+
+def bench_shuffle_deck(engine, number_of_players, repeat, number):
+    # shuffle_deck generates a new deck then shuffles it
+    lobby = new_game(engine, number_of_players)
+    return best_of(lobby.shuffle_deck, repeat, number)
+
+
+def bench_update_current_wins(case):
+    def bench(engine, number_of_players, repeat, number):
+        rng = random.Random(number_of_players)
+        tricks = []
+        for _ in range(64):
+            trick = engine(0, number_of_players)
+            trick.current_wins = [0] * number_of_players
+            make_trick(trick, trick_cards(case, number_of_players, rng))
+            tricks.append(trick)
+
+        def update_all():
+            for trick in tricks:
+                trick.update_current_wins()
+        return best_of(update_all, repeat, max(1, number // len(tricks))) / len(tricks)
+    return bench
+
+
+def bench_play_gameturn(engine, number_of_players, repeat, number):
+    # play and close_turn over a whole gameturn, one sample per new game
+    best = None
+    for seed in range(repeat * max(1, number // 10)):
+        lobby = new_game(engine, number_of_players, seed)
+        make_guesses(lobby)
+        gameturn_number = lobby.gameturn_number
+        start = time.perf_counter()
+        # an engine error fails the benchmark, it is a regression too
+        while lobby.gameturn_number == gameturn_number and lobby.current_turn_type != TurnType.GAME_OVER:
+            lobby.play(lobby.current_player_id, 0)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_status(engine, number_of_players, repeat, number):
+    lobby = new_game(engine, number_of_players)
+    make_guesses(lobby)
+    lobby.play(lobby.current_player_id, 0)
+    return best_of(lobby.status, repeat, number)
+
+
+CASES = {
+        'prepare_gameturn': bench_prepare_gameturn,
+        'shuffle_deck': bench_shuffle_deck,
+        'update_current_wins[mixed]': bench_update_current_wins('mixed'),
+        'update_current_wins[manillas]': bench_update_current_wins('manillas'),
+        'update_current_wins[cancel]': bench_update_current_wins('cancel'),
+        'play_gameturn': bench_play_gameturn,
+        'status': bench_status,
+        }
+
+
+def run(cases, engines, player_counts, repeat, number):
+    """Run the benchmarks, return {'case/engine/players': seconds per call}"""
+    results = {}
+    for case in cases:
+        for engine_name in engines:
+            for number_of_players in player_counts:
+                elapsed = CASES[case](ENGINES[engine_name], number_of_players, repeat, number)
+                key = '{}/{}/{}'.format(case, engine_name, number_of_players)
+                results[key] = elapsed
+                if elapsed is None:
+                    print('{:45} no sample'.format(key))
+                else:
+                    print('{:45} {:10.2f} us'.format(key, elapsed * 1e6))
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """Print the cases slower than the baseline, return how many there are"""
+    regressions = 0
+    for key, elapsed in results.items():
+        reference = baseline.get(key)
+        if elapsed is None or reference is None:
+            continue
+        ratio = elapsed / reference - 1
+        if ratio > max_regression:
+            regressions += 1
+            print('REGRESSION {}: {:.2f} us -> {:.2f} us ({:+.0%})'.format(
+                key, reference * 1e6, elapsed * 1e6, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fodinha rules engine')
+    parser.add_argument('--case', action='append', choices=CASES,
+                        help='case to run, can be repeated (default: all)')
+    parser.add_argument('--engine', action='append', choices=ENGINES,
+                        help='engine to run, can be repeated (default: all)')
+    parser.add_argument('--players', type=int, action='append',
+                        help='number of players, can be repeated (default: 2 to 10)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one is kept')
+    parser.add_argument('--number', type=int, default=1000, help='calls per run')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with this JSON file')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed slowdown against the baseline, as a ratio')
+    args = parser.parse_args()
+
+    results = run(args.case or list(CASES), args.engine or list(ENGINES),
+                  args.players or PLAYER_COUNTS, args.repeat, args.number)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""Monte Carlo bot: python -m fodinha.sim --guess mcts --play mcts
+
+The bot only uses what its player sees: its own hand, the beforemanilla,
+the cards played since the deal, the guesses made so far and how many
+cards everyone holds. To decide, it samples the hands of the opponents
+among the cards it has not seen and plays the rest of the gameturn out
+on every sample:
+* guess: for each allowed guess, the expected life loss |guess - wins|
+* play: for each card of its hand, the expected life loss once it is played
+then picks the candidate losing the fewest lives. This is the flat, one
+level form of information set Monte Carlo: inside the rollouts every
+player follows a fixed policy (strongest card while it still needs wins,
+weakest card otherwise) instead of a search tree.
+
+The samples of a batch are played out together on NumPy arrays, where a
+card is replaced by its strength in the gameturn (see strengths). Batches
+are played until the time budget is spent, or until max_samples samples.
+
+    bot = MonteCarloBot(time_budget=0.05)
+    lobby.guess(player_id, bot.guess(lobby, player_id, rng))
+
+numpy is only needed by this module.
+"""
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from fodinha.compact import CARD_COLOR, REAL_VALUE, CompactLobby, card_code
+
+NUMBER_OF_CARDS = 52
+# strength of an empty slot of a hand
+EMPTY = -1
+# strength of the weakest manilla: 13 + its color
+MANILLA = 14
+# real value of the 2 and the as, the strongest cards after the manillas
+STRONG = 12
+
+# samples per decision of the simulation policies, instead of a time
+# budget so that a run stays reproducible
+SIM_SAMPLES = 256
+
+
+def code_of(text):
+    """Return the card code of the string form of a card, e.g. '12;3'"""
+    value, color = text.split(';')
+    return (int(value) - 1) * 4 + int(color) - 1
+
+
+def strengths(beforemanilla):
+    """Return the strengths of all the card codes for the given beforemanilla code
+
+    A card is as strong as its real value (1 to 13), a manilla is 13 + its
+    color (14 to 17), as in fodinha.sim.card_strength.
+    """
+    beforemanilla_value = REAL_VALUE[beforemanilla]
+    manilla_value = 1 if beforemanilla_value == 13 else beforemanilla_value + 1
+    return np.array([13 + CARD_COLOR[code] if REAL_VALUE[code] == manilla_value else REAL_VALUE[code]
+                     for code in range(NUMBER_OF_CARDS)], dtype=np.int8)
+
+
+class Observation:
+    """What a player knows of the current gameturn of a Lobby or CompactLobby"""
+
+    def __init__(self, lobby, player_id):
+        self.player_id = player_id
+        self.number_of_players = lobby.number_of_players
+        if isinstance(lobby, CompactLobby):
+            beforemanilla = lobby.current_beforemanilla
+            self.hand = list(lobby.players[player_id].cards)
+            self.trick = [(played_card >> 6, played_card & 63) for played_card in lobby.current_played_cards]
+        else:
+            beforemanilla = card_code(lobby.current_beforemanilla)
+            self.hand = [card_code(card) for card in lobby.players[player_id].cards]
+            self.trick = [(card.owner_id, card_code(card)) for card in lobby.current_played_cards]
+        self.strength = strengths(beforemanilla)
+        self.hand_sizes = [len(player.cards) for player in lobby.players]
+
+        seen = {beforemanilla}
+        seen.update(self.hand)
+        for event in reversed(lobby.events):
+            if event['type'] == 'gameturn_dealt':
+                break
+            if event['type'] == 'card_played':
+                seen.add(code_of(event['card']))
+        self.unseen = [code for code in range(NUMBER_OF_CARDS) if code not in seen]
+
+        self.tricks_left = lobby.current_number_of_turns - lobby.current_turn_number
+        self.wins = list(lobby.current_wins)
+        self.win_value = lobby.current_win_value
+
+        # the guesses are made by the alive players, from the dealer
+        self.guesses = {}
+        seat = lobby.current_dealer_id
+        for guess in lobby.current_guesses:
+            self.guesses[seat] = guess
+            seat = lobby.next_alive_seat[seat]
+        self.forbidden_guess = None
+        if len(lobby.current_guesses) == lobby.count_alive_players() - 1:
+            self.forbidden_guess = lobby.current_number_of_turns - sum(lobby.current_guesses)
+
+
+def deal(observation, batch_size, generator):
+    """Return the hands of batch_size samples, shape (batch, seats, slots)
+
+    The player's own hand is the same in every sample, the hands of the
+    opponents are a random permutation of the unseen cards.
+    """
+    hands = np.full((batch_size, observation.number_of_players, max(observation.hand_sizes)),
+                    EMPTY, dtype=np.int8)
+    own = observation.strength[observation.hand]
+    hands[:, observation.player_id, :len(own)] = own
+    unseen = observation.strength[observation.unseen]
+    shuffled = unseen[np.argsort(generator.random((batch_size, len(unseen))), axis=1)]
+    start = 0
+    for seat, size in enumerate(observation.hand_sizes):
+        if seat != observation.player_id and size:
+            hands[:, seat, :size] = shuffled[:, start:start + size]
+            start += size
+    return hands
+
+
+def guesses_for(observation, hands):
+    """Return the guesses of the samples, shape (batch, seats)
+
+    The guesses not made yet are the number of strong cards (manillas,
+    2 and as) of the sampled hand, like fodinha.sim.guess_strength.
+    """
+    guesses = np.minimum((hands >= STRONG).sum(axis=2), observation.tricks_left)
+    for seat, guess in observation.guesses.items():
+        guesses[:, seat] = guess
+    return guesses
+
+
+def rollout(observation, hands, guesses, first_cards=None):
+    """Play the rest of the gameturn on a batch of samples, return the wins, shape (batch, seats)
+
+    hands are modified. first_cards is the strength of the card the
+    player plays in the current trick in each sample, None to let the
+    policy choose it.
+    """
+    batch_size = hands.shape[0]
+    rows = np.arange(batch_size)
+    wins = np.tile(np.array(observation.wins, dtype=np.int16), (batch_size, 1))
+    win_value = np.full(batch_size, observation.win_value, dtype=np.int16)
+    for trick_number in range(observation.tricks_left):
+        holding = (hands != EMPTY).any(axis=2)
+        played = np.zeros(holding.shape, dtype=np.int8)
+        if trick_number == 0:
+            # the trick in progress
+            for owner, code in observation.trick:
+                played[:, owner] = observation.strength[code]
+                holding[:, owner] = False
+            if first_cards is not None:
+                played[:, observation.player_id] = first_cards
+                holding[:, observation.player_id] = False
+
+        # strongest card while more wins are needed, weakest otherwise
+        strongest = hands.argmax(axis=2)
+        weakest = np.where(hands == EMPTY, 127, hands).argmin(axis=2)
+        choice = np.where(guesses > wins, strongest, weakest)
+        chosen = np.take_along_axis(hands, choice[:, :, None], axis=2)[:, :, 0]
+        played = np.where(holding, chosen, played)
+        sample_ids, seats = np.nonzero(holding)
+        hands[sample_ids, seats, choice[sample_ids, seats]] = EMPTY
+
+        # the highest manilla wins, else the highest card played only once
+        has_manilla = played.max(axis=1) >= MANILLA
+        counts = (played[:, :, None] == played[:, None, :]).sum(axis=2)
+        single = np.where((counts == 1) & (played > 0), played, 0)
+        score = np.where(has_manilla[:, None], played, single)
+        winner = score.argmax(axis=1)
+        won = score.max(axis=1) > 0
+        wins[rows[won], winner[won]] += win_value[won]
+        # all cards canceled out: the next trick is worth one more
+        win_value = np.where(won, 1, win_value + 1)
+    return wins
+
+
+class MonteCarloBot:
+    """Guess and play by playing sampled deals out, see the module docstring
+
+    time_budget: seconds per decision, None for no limit
+    batch_size: samples played out together
+    max_samples: samples per decision at most, None for no limit
+    At least one batch is played, whatever the budget.
+    """
+
+    def __init__(self, time_budget=0.05, batch_size=64, max_samples=None):
+        if np is None:
+            raise RuntimeError('fodinha.bot needs numpy: pip install numpy')
+        if time_budget is None and max_samples is None:
+            raise ValueError('Give a time budget or a maximum number of samples')
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+
+    def run(self, rng, play_out, number_of_candidates):
+        """Return the total life loss of each candidate over the batches of play_out(generator)"""
+        generator = np.random.default_rng(rng.getrandbits(64))
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        losses = np.zeros(number_of_candidates)
+        samples = 0
+        while True:
+            losses += play_out(generator).reshape(-1, number_of_candidates).sum(axis=0)
+            samples += self.batch_size
+            if self.max_samples is not None and samples >= self.max_samples:
+                return losses
+            if deadline is not None and time.perf_counter() >= deadline:
+                return losses
+
+    def guess(self, lobby, player_id, rng):
+        """Return the guess of the player with the lowest expected life loss"""
+        observation = Observation(lobby, player_id)
+        candidates = np.array([guess for guess in range(observation.tricks_left + 1)
+                               if guess != observation.forbidden_guess])
+        if len(candidates) == 1:
+            return int(candidates[0])
+
+        def play_out(generator):
+            # every sample is played out once per candidate
+            hands = np.repeat(deal(observation, self.batch_size, generator), len(candidates), axis=0)
+            guesses = guesses_for(observation, hands)
+            guesses[:, player_id] = np.tile(candidates, self.batch_size)
+            wins = rollout(observation, hands, guesses)
+            return np.abs(guesses[:, player_id] - wins[:, player_id])
+
+        losses = self.run(rng, play_out, len(candidates))
+        return int(candidates[losses.argmin()])
+
+    def play(self, lobby, player_id, rng):
+        """Return the index of the card of the player with the lowest expected life loss"""
+        observation = Observation(lobby, player_id)
+        own = observation.strength[observation.hand]
+        # cards of the same strength (same value, not manillas) play the same
+        _, candidates = np.unique(own, return_index=True)
+        if len(candidates) == 1:
+            return int(candidates[0])
+
+        def play_out(generator):
+            hands = np.repeat(deal(observation, self.batch_size, generator), len(candidates), axis=0)
+            guesses = guesses_for(observation, hands)
+            slots = np.tile(candidates, self.batch_size)
+            hands[np.arange(len(hands)), player_id, slots] = EMPTY
+            wins = rollout(observation, hands, guesses, first_cards=own[slots])
+            return np.abs(guesses[:, player_id] - wins[:, player_id])
+
+        losses = self.run(rng, play_out, len(candidates))
+        return int(candidates[losses.argmin()])
+
+
+def guess_mcts(lobby, player_id, rng):
+    """Guess with a MonteCarloBot of SIM_SAMPLES samples (fodinha.sim policy)"""
+    return MonteCarloBot(time_budget=None, max_samples=SIM_SAMPLES).guess(lobby, player_id, rng)
+
+
+def play_mcts(lobby, player_id, rng):
+    """Play with a MonteCarloBot of SIM_SAMPLES samples (fodinha.sim policy)"""
+    return MonteCarloBot(time_budget=None, max_samples=SIM_SAMPLES).play(lobby, player_id, rng)
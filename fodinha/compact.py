@@ -0,0 +1,156 @@
+"""Compact game-state engine: cards are small integers instead of Card objects
+
+A card is coded on one byte as (value - 1) * 4 + (color - 1):
+0 is the as of diamonds, 51 the king of clubs. Everything a Card computes
+(value, color, real_value, string form) is precomputed once in the lookup
+tables below, indexed by the card code.
+
+* the deck and the hands are bytearrays, a new deck is a copy of FULL_DECK
+* a played card is stored as owner_id << 6 | code, so it remembers its owner
+
+CompactLobby has the same API as Lobby (register_player, start_game, guess,
+play, status...) and returns the same dicts, only the memory layout differs.
+"""
+from fodinha import DECK_COLORS, Card, Color, Lobby, Player
+
+NUMBER_OF_CARDS = 52
+
+# lookup tables, indexed by card code
+CARD_VALUE = bytes((code >> 2) + 1 for code in range(NUMBER_OF_CARDS))
+CARD_COLOR = bytes((code & 3) + 1 for code in range(NUMBER_OF_CARDS))
+REAL_VALUE = bytes(Card(CARD_VALUE[code], Color(CARD_COLOR[code])).real_value
+                   for code in range(NUMBER_OF_CARDS))
+CARD_STR = tuple(str(Card(CARD_VALUE[code], Color(CARD_COLOR[code])))
+                 for code in range(NUMBER_OF_CARDS))
+
+# a new deck is a copy of this one, in the order of Lobby.generate_new_deck:
+# the same seed shuffles it into the same cards
+FULL_DECK = bytes((value - 1) * 4 + color - 1 for value in range(1, 14) for color in DECK_COLORS)
+
+
+def card_code(card):
+    """Return the code of a Card object"""
+    return (card.value - 1) * 4 + card.color - 1
+
+
+def played_card_owner(played_card):
+    """Return the owner ID of a played card"""
+    return played_card >> 6
+
+
+def played_card_code(played_card):
+    """Return the card code of a played card"""
+    return played_card & 63
+
+
+class CompactPlayer(Player):
+    """Represent a player, his current cards are a bytearray of card codes"""
+
+    def __init__(self, player_id, name):
+        super().__init__(player_id, name)
+        self.cards = bytearray()
+
+    def draw_card(self, card):
+        """Adds a card code to the current hand"""
+        self.cards.append(card)
+
+    def play_card(self, card_index):
+        """Pops a chosen card from current hand, returns it with its owner"""
+        return self.player_id << 6 | self.cards.pop(card_index)
+
+    def throw_remaining_cards(self):
+        del self.cards[:]
+
+    def __str__(self):
+        """Return id, name, number of lives, current cards"""
+        return "; ".join([str(self.player_id), self.name, str(self.number_of_lives), str([CARD_STR[code] for code in self.cards])])
+
+
+class CompactLobby(Lobby):
+    """Represent a table and a running game, with cards coded as integers"""
+
+    player_class = CompactPlayer
+
+    def generate_new_deck(self):
+        """Generate a new full deck"""
+        return bytearray(FULL_DECK)
+
+    def find_turn_winner(self):
+        """Return the owner ID of the card winning the turn, None if all cards canceled out"""
+        # set the value of the current manilla
+        beforemanilla_value = REAL_VALUE[self.current_beforemanilla]
+        if beforemanilla_value == 13:
+            manilla_value = 1
+        else:
+            manilla_value = beforemanilla_value + 1
+
+        # same single pass as Lobby.find_turn_winner, on card codes
+        winner_owner = None
+        winner_color = 0
+        counts = [0] * 14
+        owners = [None] * 14
+        for played_card in self.current_played_cards:
+            code = played_card & 63
+            real_value = REAL_VALUE[code]
+            if real_value == manilla_value:
+                if CARD_COLOR[code] > winner_color:
+                    winner_color = CARD_COLOR[code]
+                    winner_owner = played_card >> 6
+            else:
+                counts[real_value] += 1
+                owners[real_value] = played_card >> 6
+
+        if winner_owner is not None:
+            return winner_owner
+
+        # no manilla: the highest value played only once wins
+        for real_value in range(13, 0, -1):
+            if counts[real_value] == 1:
+                return owners[real_value]
+        return None
+
+    def card_str(self, card):
+        """Return the string form of a card code, or of a played card"""
+        return CARD_STR[card & 63]
+
+    def get_cards(self, player_id):
+        """Return the cards of the specified player"""
+        return {'cards': [CARD_STR[code] for code in self.players[player_id].cards]}
+
+    def card_real_value_color(self, card):
+        """Return the (real_value, color) of a card code"""
+        return REAL_VALUE[card], CARD_COLOR[card]
+
+    def card_to_code(self, card):
+        return card
+
+    def codes_to_cards(self, codes, owner_id=None):
+        """Return a bytearray of card codes, see Lobby.codes_to_cards"""
+        return bytearray(codes)
+
+    def played_to_codes(self, played_card):
+        return played_card_owner(played_card), played_card_code(played_card)
+
+    def codes_to_played(self, owner_id, code):
+        return owner_id << 6 | code
+
+    def status(self):
+        """Return detailed status of game, see Lobby.status"""
+        if self.current_beforemanilla is None:
+            beforemanilla = None
+        else:
+            beforemanilla = CARD_STR[self.current_beforemanilla]
+
+        return {
+                'gameturn_number': self.gameturn_number,
+                'current_beforemanilla': beforemanilla,
+                'current_player_id': self.current_player_id,
+                'current_dealer_id': self.current_dealer_id,
+                'current_number_of_turns': self.current_number_of_turns,
+                'current_turn_number': self.current_turn_number,
+                'current_turn_type': self.current_turn_type and self.current_turn_type.value,
+                'current_guesses': list(self.current_guesses),
+                'current_wins': list(self.current_wins),
+                'current_played_cards': [CARD_STR[played_card & 63] for played_card in self.current_played_cards],
+                'version': self.version,
+                }
@@ -0,0 +1,314 @@
+"""Append-only binary journal of the games
+
+Every action on a lobby is one fixed-width record of RECORD_SIZE bytes:
+
+    lobby_id, version, op, player_id, arg, name, crc32
+
+* version is the lobby version once the action is done (see Lobby.version)
+* arg is the number of players (CREATE), the guess (GUESS), the card
+  index (PLAY) or the seed of the deck (SHUFFLE)
+* name is the name of the player (REGISTER), utf-8, at most NAME_SIZE bytes
+* crc32 covers the rest of the record, a torn write at the end of the
+  file is detected and ignored
+
+A SHUFFLE record comes right before the action that shuffled the deck
+(START, or the PLAY closing a gameturn): replaying the records in order
+on new Lobby instances rebuilds the games exactly, decks included.
+
+JournalWriter appends the records from any thread and group-commits them:
+one background thread writes and fsyncs everything appended since its
+last pass, the callers waiting in sync() are all released by that fsync.
+
+A snapshot is the lobbies (Lobby.snapshot) plus the journal size when it
+was started: recovery loads it and replays the journal from there, skipping
+the records of a lobby that are not newer than its version in the snapshot.
+A record the engine refuses is logged and skipped, the rest is replayed.
+
+read_records() goes through the file with mmap, so it is also the fast
+way to analyse a journal offline:
+
+    for offset, record in read_records('fodinha.journal'):
+        ...
+
+fodinha.replay builds statistics of the recorded games on top of it.
+"""
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+from fodinha import MAX_NAME_SIZE, SNAPSHOT_MAGIC, Lobby
+
+logger = logging.getLogger(__name__)
+
+NAME_SIZE = MAX_NAME_SIZE
+RECORD = struct.Struct('<IIBBxxI{}s'.format(NAME_SIZE))
+CRC = struct.Struct('<I')
+# the lobby_id at the start of a record
+LOBBY_ID = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+
+# record operations
+CREATE = 1
+REGISTER = 2
+START = 3
+GUESS = 4
+PLAY = 5
+SHUFFLE = 6
+DELETE = 7
+
+OP_NAMES = {CREATE: 'create', REGISTER: 'register', START: 'start', GUESS: 'guess',
+            PLAY: 'play', SHUFFLE: 'shuffle', DELETE: 'delete'}
+
+Record = namedtuple('Record', 'lobby_id version op player_id arg name')
+
+
+def encode(lobby_id, version, op, player_id=0, arg=0, name=''):
+    """Return the bytes of a record, ValueError if a field does not fit in it"""
+    encoded_name = name.encode('utf-8')
+    if len(encoded_name) > NAME_SIZE:
+        # cut, the lobby rebuilt from the journal would not have the same name
+        raise ValueError('Can\'t journal a name longer than {} bytes: {}'.format(NAME_SIZE, name))
+    try:
+        body = RECORD.pack(lobby_id, version, op, player_id, arg, encoded_name)
+    except struct.error as error:
+        raise ValueError('Can\'t journal the {} of lobby {}: {}'.format(
+            OP_NAMES.get(op, op), lobby_id, error)) from error
+    return body + CRC.pack(zlib.crc32(body))
+
+
+def intact(data):
+    """Return whether the RECORD_SIZE bytes of a record match their crc32"""
+    (crc,) = CRC.unpack_from(data, RECORD.size)
+    return zlib.crc32(data[:RECORD.size]) == crc
+
+
+def decode(data):
+    """Return the Record of RECORD_SIZE bytes, None if they are corrupted"""
+    if not intact(data):
+        return None
+    lobby_id, version, op, player_id, arg, name = RECORD.unpack_from(data)
+    return Record(lobby_id, version, op, player_id, arg,
+                  name.rstrip(b'\0').decode('utf-8', errors='ignore'))
+
+
+def read_records(path, offset=0, share=None):
+    """Yield (offset, Record) for the records of a journal file, from the given offset
+
+    Stops at the first corrupted or incomplete record. With share=(index,
+    count), only the records of the lobbies whose lobby_id % count is
+    index are yielded, the others are checked but not decoded: count
+    readers of the same file split its lobbies between them.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) <= offset:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = len(data) - RECORD_SIZE
+        while offset <= end:
+            chunk = data[offset:offset + RECORD_SIZE]
+            if share is not None and LOBBY_ID.unpack_from(chunk)[0] % share[1] != share[0]:
+                if not intact(chunk):
+                    return
+            else:
+                record = decode(chunk)
+                if record is None:
+                    return
+                yield offset, record
+            offset += RECORD_SIZE
+
+
+def records_for(lobby, events):
+    """Return the records of the given new events of a lobby
+
+    events are the ones logged by the actions of a single edit, so the
+    gameturn_dealt events come from the last action (or from start_game),
+    and lobby.shuffle_seed is the seed of the deck they dealt.
+    """
+    records = []
+    for event in events:
+        event_type = event['type']
+        if event_type == 'player_joined':
+            records.append(encode(lobby.lobby_id, lobby.version, REGISTER,
+                                  event['player_id'], name=event['name']))
+        elif event_type == 'guess':
+            records.append(encode(lobby.lobby_id, lobby.version, GUESS,
+                                  event['player_id'], event['guess']))
+        elif event_type == 'card_played':
+            records.append(encode(lobby.lobby_id, lobby.version, PLAY,
+                                  event['player_id'], event['index']))
+        elif event_type == 'gameturn_dealt':
+            shuffle = encode(lobby.lobby_id, lobby.version, SHUFFLE, arg=lobby.shuffle_seed)
+            if event['gameturn_number'] == 1:
+                records.append(shuffle)
+                records.append(encode(lobby.lobby_id, lobby.version, START))
+            else:
+                # before the play that closed the previous gameturn
+                records.insert(len(records) - 1, shuffle)
+    return records
+
+
+def apply(lobbies, record, lobby_class=Lobby):
+    """Replay a record on the {lobby_id: lobby} dict"""
+    if record.op == CREATE:
+        lobbies[record.lobby_id] = lobby_class(record.lobby_id, record.arg)
+        return
+    lobby = lobbies.get(record.lobby_id)
+    if lobby is None:
+        # deleted, or created before the snapshot and deleted since
+        return
+    if record.op == REGISTER:
+        lobby.register_player(record.name)
+    elif record.op == START:
+        lobby.start_game()
+    elif record.op == GUESS:
+        lobby.guess(record.player_id, record.arg)
+    elif record.op == PLAY:
+        lobby.play(record.player_id, record.arg)
+    elif record.op == SHUFFLE:
+        lobby.replay_seeds.append(record.arg)
+    elif record.op == DELETE:
+        del lobbies[record.lobby_id]
+    else:
+        raise ValueError('Unknown journal operation: {}'.format(record.op))
+
+
+def load_lobby(state, lobby_class=Lobby):
+    """Return the lobby of a Lobby.snapshot(), or of a lobby pickled before snapshots existed"""
+    if state[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+        return lobby_class.restore(state)
+    return pickle.loads(state)
+
+
+def write_snapshot(path, offset, last_id, lobbies):
+    """Save the lobby snapshots, the journal offset they include and the highest lobby ID, atomically"""
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((offset, last_id, lobbies), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Return (journal offset, highest lobby ID, {lobby_id: lobby snapshot}), (0, 0, {}) without snapshot"""
+    if not os.path.exists(path):
+        return 0, 0, {}
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def recover(journal_path, snapshot_path, lobby_class=Lobby):
+    """Return ({lobby_id: lobby}, highest lobby ID, journal size) from the snapshot and the journal"""
+    offset, last_id, snapshots = read_snapshot(snapshot_path)
+    lobbies = {lobby_id: load_lobby(state, lobby_class) for lobby_id, state in snapshots.items()}
+    snapshot_versions = {lobby_id: lobby.version for lobby_id, lobby in lobbies.items()}
+    end = offset
+    for record_offset, record in read_records(journal_path, offset):
+        end = record_offset + RECORD_SIZE
+        last_id = max(last_id, record.lobby_id)
+        if record.op != DELETE and record.version <= snapshot_versions.get(record.lobby_id, -1):
+            continue
+        try:
+            apply(lobbies, record, lobby_class)
+        except (RuntimeError, ValueError, IndexError) as error:
+            # the lobby goes on without this action, the other lobbies are not affected
+            logger.error('journal record skipped: %s', error,
+                         extra={'offset': record_offset, 'lobby_id': record.lobby_id, 'op': OP_NAMES.get(record.op)})
+    return lobbies, last_id, end
+
+
+class JournalWriter:
+    """Append records to a journal file, group-committed by a background thread"""
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.file = open(path, 'ab')
+        # a torn record at the end is cut, so that the next ones are readable
+        if size is not None and size != self.file.tell():
+            self.file.truncate(size)
+        self.file.seek(0, os.SEEK_END)
+        self._buffer = bytearray()
+        # appended: bytes in the file + in the buffer, synced: bytes on disk
+        self.appended = self.synced = self.file.tell()
+        self._changed = threading.Condition()
+        self._closed = False
+        # the error that stopped the commit thread, raised to every caller since
+        self.error = None
+        self._thread = None
+        self._pid = None
+
+    def append(self, records):
+        """Queue records for the next commit, return the offset to sync() to"""
+        with self._changed:
+            self._check()
+            if self._pid != os.getpid():
+                # started on first use, threads don't survive a fork
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='journal-commit', daemon=True)
+                self._thread.start()
+            for record in records:
+                self._buffer += record
+            self.appended += sum(len(record) for record in records)
+            self._changed.notify_all()
+            return self.appended
+
+    def sync(self, offset, timeout=None):
+        """Wait until the journal is on disk up to the given offset
+
+        OSError if the journal can't be written anymore.
+        """
+        with self._changed:
+            synced = self._changed.wait_for(lambda: self.synced >= offset or self._closed, timeout)
+            if self.synced < offset:
+                self._check()
+            return synced
+
+    def _check(self):
+        if self.error is not None:
+            raise OSError('journal {} not written: {}'.format(self.path, self.error)) from self.error
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._buffer or self._closed)
+                if not self._buffer and self._closed:
+                    return
+                data, self._buffer = self._buffer, bytearray()
+                offset = self.appended
+            # the writers keep appending meanwhile, they are in the next commit
+            try:
+                self.file.write(data)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception as error:
+                # disk full, I/O error: what follows can't be on disk in order
+                logger.exception('journal commit failed, no more records are written')
+                with self._changed:
+                    self.error = error
+                    self._closed = True
+                    self._changed.notify_all()
+                return
+            with self._changed:
+                self.synced = offset
+                self._changed.notify_all()
+
+    def close(self):
+        """Commit what is left and close the file"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join()
+        elif self._buffer:
+            self.file.write(self._buffer)
+        try:
+            self.file.close()
+        except OSError:
+            # the data the commit thread failed to write, already reported
+            if self.error is None:
+                raise
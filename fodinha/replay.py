@@ -0,0 +1,327 @@
+"""Statistics of the recorded games: python -m fodinha.replay fodinha.journal
+
+The games of a journal (see fodinha.journal) are played again on new
+lobbies, without the Flask app, and measured from their event logs:
+* games: one row per game, its length, guesses, guesses made in the 'pé'
+  position (the last guess of a gameturn) and how often the forbidden
+  guess was a real choice, tricks, cancel-outs and the highest win value
+  they built up (see Lobby.update_current_wins)
+* players: one row per player of a game, guesses, exact guesses and
+  lives lost, so the accuracy of a player is exact / guesses
+* win_values: how many tricks were won at each win value
+
+Everything is a generator: the records are read one by one, a game is
+measured when it ends (or is deleted, or the journal ends) and its lobby
+dropped, memory only holds the games in progress. The lobbies are split
+between the processes by lobby_id (see read_records), each process fills
+columns of its own and the columns are appended at the end:
+
+    python -m fodinha.replay fodinha.journal --processes 4 --output stats/
+
+writes stats/games.csv, stats/players.csv and stats/win_values.csv, or
+.npz files of NumPy arrays with --format npz (needs numpy).
+"""
+import argparse
+import csv
+import importlib.util
+import logging
+import multiprocessing
+import os
+import time
+from array import array
+from collections import Counter
+
+from fodinha import Lobby, TurnType, journal
+from fodinha.compact import CompactLobby
+
+logger = logging.getLogger(__name__)
+
+# name and array typecode of the columns, None for a list of strings
+GAME_COLUMNS = (
+        ('lobby_id', 'L'),
+        ('players', 'B'),
+        # 1 if the game is over, 0 if it was deleted or not finished yet
+        ('finished', 'B'),
+        ('gameturns', 'H'),
+        ('actions', 'L'),
+        ('guesses', 'L'),
+        ('exact_guesses', 'L'),
+        ('pe_guesses', 'L'),
+        # the forbidden guess was between 0 and the number of turns
+        ('pe_restricted', 'L'),
+        ('tricks', 'L'),
+        ('cancel_outs', 'L'),
+        ('max_win_value', 'B'),
+        # seat of the last player alive, -1 for a draw or an unfinished game
+        ('winner', 'b'),
+        )
+
+PLAYER_COLUMNS = (
+        ('lobby_id', 'L'),
+        ('seat', 'B'),
+        ('name', None),
+        ('guesses', 'L'),
+        ('exact_guesses', 'L'),
+        ('lives_lost', 'L'),
+        ('won', 'B'),
+        )
+
+
+class Columns:
+    """A table stored by column, one array per column"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.data = {name: [] if typecode is None else array(typecode) for name, typecode in columns}
+
+    def __len__(self):
+        return len(self.data[self.columns[0][0]])
+
+    def append(self, row):
+        """Add a row, a dict of all the columns"""
+        for name, _ in self.columns:
+            self.data[name].append(row[name])
+
+    def extend(self, other):
+        for name, _ in self.columns:
+            self.data[name].extend(other.data[name])
+
+    def sum(self, name):
+        return sum(self.data[name])
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(name for name, _ in self.columns)
+            writer.writerows(zip(*(self.data[name] for name, _ in self.columns)))
+
+    def write_npz(self, path):
+        import numpy as np
+        np.savez_compressed(path, **{name: np.array(self.data[name]) if typecode is None
+                                     else np.frombuffer(self.data[name], dtype=self.data[name].typecode)
+                                     for name, typecode in self.columns})
+
+
+def replay_games(path, share=None, lobby_class=Lobby, failed=None):
+    """Yield (lobby, finished) for the started games of a journal file
+
+    A game is yielded when it is over, when its lobby is deleted or at
+    the end of the journal (not finished). share splits the lobbies
+    between readers, see journal.read_records. lobby_class is the engine
+    the games are played again on, CompactLobby is faster.
+
+    A game whose record is refused by the engine is dropped, with the
+    rest of its records, and (lobby_id, error) appended to failed.
+    """
+    lobbies = {}
+    dropped = set()
+    for _, record in journal.read_records(path, share=share):
+        if record.lobby_id in dropped:
+            continue
+        if record.op == journal.DELETE:
+            lobby = lobbies.get(record.lobby_id)
+            if lobby is not None and lobby.gameturn_number:
+                yield lobby, False
+        try:
+            journal.apply(lobbies, record, lobby_class)
+        except Exception as error:
+            logger.warning('game %s dropped at version %s: %r', record.lobby_id, record.version, error)
+            lobbies.pop(record.lobby_id, None)
+            dropped.add(record.lobby_id)
+            if failed is not None:
+                failed.append((record.lobby_id, repr(error)))
+            continue
+        if record.op == journal.PLAY:
+            lobby = lobbies.get(record.lobby_id)
+            if lobby is not None and lobby.current_turn_type == TurnType.GAME_OVER:
+                del lobbies[record.lobby_id]
+                yield lobby, True
+    for lobby in lobbies.values():
+        if lobby.gameturn_number:
+            yield lobby, False
+
+
+def measure(lobby, finished):
+    """Return the game row, the player rows and the Counter of win values of a replayed game
+
+    The guesses of a gameturn cut by the end of the journal are not counted.
+    """
+    number_of_players = len(lobby.players)
+    game = {'lobby_id': lobby.lobby_id, 'players': number_of_players, 'finished': int(finished),
+            'gameturns': lobby.gameturn_number, 'actions': 0, 'guesses': 0, 'exact_guesses': 0,
+            'pe_guesses': 0, 'pe_restricted': 0, 'tricks': 0, 'cancel_outs': 0, 'max_win_value': 1,
+            'winner': -1}
+    players = [{'lobby_id': lobby.lobby_id, 'seat': seat, 'name': player.name, 'guesses': 0,
+                'exact_guesses': 0, 'lives_lost': 0, 'won': 0}
+               for seat, player in enumerate(lobby.players)]
+    win_values = Counter()
+
+    # the gameturn being read: (seat, guess), tricks closed, wins
+    number_of_turns = 0
+    guesses = []
+    tricks = 0
+    wins = [0] * number_of_players
+    guessing = False
+    for event in lobby.events:
+        event_type = event['type']
+        if event_type == 'gameturn_dealt':
+            number_of_turns = event['number_of_turns']
+            guesses = []
+            tricks = 0
+            wins = [0] * number_of_players
+            guessing = True
+        elif event_type == 'guess':
+            game['actions'] += 1
+            guesses.append((event['player_id'], event['guess']))
+        elif event_type == 'card_played':
+            game['actions'] += 1
+            if guessing:
+                # first card of the gameturn: the last guess was the 'pé'
+                guessing = False
+                game['pe_guesses'] += 1
+                forbidden = number_of_turns - sum(guess for _, guess in guesses[:-1])
+                if 0 <= forbidden <= number_of_turns:
+                    game['pe_restricted'] += 1
+        elif event_type == 'turn_closed':
+            tricks += 1
+            game['tricks'] += 1
+            if event['winner_id'] is None:
+                game['cancel_outs'] += 1
+            else:
+                wins[event['winner_id']] += event['win_value']
+                win_values[event['win_value']] += 1
+                game['max_win_value'] = max(game['max_win_value'], event['win_value'])
+            if tricks == number_of_turns:
+                for seat, guess in guesses:
+                    players[seat]['guesses'] += 1
+                    if guess == wins[seat]:
+                        players[seat]['exact_guesses'] += 1
+        elif event_type == 'lives_lost':
+            players[event['player_id']]['lives_lost'] += event['life_loss']
+
+    game['guesses'] = sum(player['guesses'] for player in players)
+    game['exact_guesses'] = sum(player['exact_guesses'] for player in players)
+    if finished:
+        alive = [player.player_id for player in lobby.players if player.is_alive()]
+        if len(alive) == 1:
+            game['winner'] = alive[0]
+            players[alive[0]]['won'] = 1
+    return game, players, win_values
+
+
+class Results:
+    """The games and players tables and the win values of a set of games, can be merged
+
+    failed: (lobby_id, error) of the games the engine could not replay
+    """
+
+    def __init__(self):
+        self.games = Columns(GAME_COLUMNS)
+        self.players = Columns(PLAYER_COLUMNS)
+        self.win_values = Counter()
+        self.failed = []
+
+    def add(self, lobby, finished):
+        game, players, win_values = measure(lobby, finished)
+        self.games.append(game)
+        for player in players:
+            self.players.append(player)
+        self.win_values.update(win_values)
+
+    def merge(self, other):
+        self.games.extend(other.games)
+        self.players.extend(other.players)
+        self.win_values.update(other.win_values)
+        self.failed.extend(other.failed)
+
+    def write(self, directory, output_format='csv'):
+        """Write games, players and win_values to the directory, as csv or npz files"""
+        os.makedirs(directory, exist_ok=True)
+        win_values = Columns((('win_value', 'B'), ('tricks', 'L')))
+        for win_value, tricks in sorted(self.win_values.items()):
+            win_values.append({'win_value': win_value, 'tricks': tricks})
+        for name, table in (('games', self.games), ('players', self.players), ('win_values', win_values)):
+            path = os.path.join(directory, '{}.{}'.format(name, output_format))
+            if output_format == 'npz':
+                table.write_npz(path)
+            else:
+                table.write_csv(path)
+
+
+def replay_share(task):
+    """Return the Results of the lobbies of a share of a journal (runs in the pool)"""
+    path, index, count, lobby_class = task
+    results = Results()
+    for lobby, finished in replay_games(path, share=(index, count), lobby_class=lobby_class,
+                                        failed=results.failed):
+        results.add(lobby, finished)
+    return results
+
+
+def replay(path, processes=None, lobby_class=Lobby):
+    """Replay a journal file over a pool of processes, return the merged Results"""
+    processes = processes or os.cpu_count() or 1
+    results = Results()
+    if processes == 1:
+        results.merge(replay_share((path, 0, 1, lobby_class)))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            # in order: the rows of a share are sorted by end of game
+            tasks = [(path, index, processes, lobby_class) for index in range(processes)]
+            for share_results in pool.map(replay_share, tasks):
+                results.merge(share_results)
+    return results
+
+
+def report(results, elapsed):
+    """Print the statistics of a replay"""
+    games = results.games
+    number_of_games = len(games)
+    print('{} games in {:.2f}s: {:.0f} games/s'.format(
+        number_of_games, elapsed, number_of_games / elapsed if elapsed else 0))
+    if results.failed:
+        print('{} games dropped, the engine refused one of their records:'.format(len(results.failed)))
+        for lobby_id, error in results.failed[:10]:
+            print('  lobby {}: {}'.format(lobby_id, error))
+    if not number_of_games:
+        return
+    finished = games.sum('finished')
+    print('finished: {} ({:.1%})'.format(finished, finished / number_of_games))
+    print('average game: {:.2f} gameturns, {:.1f} actions'.format(
+        games.sum('gameturns') / number_of_games, games.sum('actions') / number_of_games))
+    guesses = games.sum('guesses')
+    if guesses:
+        print('exact guesses: {:.1%}'.format(games.sum('exact_guesses') / guesses))
+    pe_guesses = games.sum('pe_guesses')
+    if pe_guesses:
+        print("'pé' guesses with a forbidden value: {:.1%}".format(games.sum('pe_restricted') / pe_guesses))
+    tricks = games.sum('tricks')
+    if tricks:
+        print('cancel-outs: {:.1%} of the tricks'.format(games.sum('cancel_outs') / tricks))
+    for win_value, count in sorted(results.win_values.items()):
+        print('tricks won at win value {}: {}'.format(win_value, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the games of a journal and measure them')
+    parser.add_argument('journal', help='journal file, see fodinha.journal')
+    parser.add_argument('--processes', type=int, default=None, help='pool size, defaults to the CPU count')
+    parser.add_argument('--output', default=None, help='directory to write the tables to')
+    parser.add_argument('--format', choices=('csv', 'npz'), default='csv', help='format of the tables')
+    parser.add_argument('--compact', action='store_true', help='replay on CompactLobby, faster')
+    args = parser.parse_args()
+    if not os.path.exists(args.journal):
+        parser.error('no such journal: {}'.format(args.journal))
+    if args.format == 'npz' and importlib.util.find_spec('numpy') is None:
+        parser.error('the npz format needs numpy: pip install numpy')
+
+    start = time.perf_counter()
+    results = replay(args.journal, args.processes, CompactLobby if args.compact else Lobby)
+    report(results, time.perf_counter() - start)
+    if args.output is not None:
+        results.write(args.output, args.format)
+        print('tables written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
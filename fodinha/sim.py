@@ -0,0 +1,275 @@
+"""Headless self-play: python -m fodinha.sim
+
+Plays complete games between bots, spread over a pool of processes, and
+reports the speed of the engine along with win and life loss statistics:
+
+    python -m fodinha.sim --games 100000 --players 4 --guess random,strength --play strongest
+
+A policy is a function policy(lobby, player_id, rng) returning a guess or
+the index of the card to play, see GUESS_POLICIES and PLAY_POLICIES.
+When several policies are given, seat i uses the (i % count)th one.
+The mcts policies are the Monte Carlo bot of fodinha.bot, they need numpy.
+The table guess policy needs the file of fodinha.tables.
+Game n is played with seed (--seed + n): a run is reproducible whatever
+the number of processes.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+
+from fodinha import Lobby, TurnType, bot, tables
+from fodinha.compact import CARD_COLOR, REAL_VALUE, CompactLobby
+
+ENGINES = {'objects': Lobby, 'compact': CompactLobby}
+
+# a game never needs that many guesses and plays, it must be stuck
+MAX_ACTIONS = 10000
+
+
+def card_strength(lobby, card):
+    """Return a number ordering the cards of the current gameturn, manillas first"""
+    if isinstance(lobby, CompactLobby):
+        real_value, color = REAL_VALUE[card], CARD_COLOR[card]
+        beforemanilla_value = REAL_VALUE[lobby.current_beforemanilla]
+    else:
+        real_value, color = card.real_value, card.color
+        beforemanilla_value = lobby.current_beforemanilla.real_value
+    manilla_value = 1 if beforemanilla_value == 13 else beforemanilla_value + 1
+    if real_value == manilla_value:
+        return 13 + color
+    return real_value
+
+
+def forbidden_guess(lobby):
+    """Return the guess forbidden to the current player ('pé' position), or None"""
+    if len(lobby.current_guesses) != lobby.count_alive_players() - 1:
+        return None
+    return lobby.current_number_of_turns - sum(lobby.current_guesses)
+
+
+def allowed_guess(lobby, guess):
+    """Return the given guess, or the closest allowed one"""
+    if guess != forbidden_guess(lobby):
+        return guess
+    if guess > 0:
+        return guess - 1
+    return guess + 1
+
+
+def guess_random(lobby, player_id, rng):
+    """Guess uniformly between 0 and the number of turns"""
+    return allowed_guess(lobby, rng.randint(0, lobby.current_number_of_turns))
+
+
+def guess_zero(lobby, player_id, rng):
+    """Always guess 0"""
+    return allowed_guess(lobby, 0)
+
+
+def guess_strength(lobby, player_id, rng):
+    """Guess one turn per manilla, 2 or as"""
+    cards = lobby.players[player_id].cards
+    strong = sum(1 for card in cards if card_strength(lobby, card) >= 12)
+    return allowed_guess(lobby, min(strong, lobby.current_number_of_turns))
+
+
+def guess_table(lobby, player_id, rng):
+    """Guess the expected tricks of the hand, a lookup in the tables of fodinha.tables"""
+    return lobby.suggest_guess(player_id)
+
+
+def play_random(lobby, player_id, rng):
+    """Play any card"""
+    return rng.randrange(len(lobby.players[player_id].cards))
+
+
+def play_first(lobby, player_id, rng):
+    """Play the first card of the hand"""
+    return 0
+
+
+def play_strongest(lobby, player_id, rng):
+    """Play the strongest card of the hand"""
+    cards = lobby.players[player_id].cards
+    return max(range(len(cards)), key=lambda i: card_strength(lobby, cards[i]))
+
+
+def play_weakest(lobby, player_id, rng):
+    """Play the weakest card of the hand"""
+    cards = lobby.players[player_id].cards
+    return min(range(len(cards)), key=lambda i: card_strength(lobby, cards[i]))
+
+
+GUESS_POLICIES = {
+        'random': guess_random,
+        'zero': guess_zero,
+        'strength': guess_strength,
+        'table': guess_table,
+        'mcts': bot.guess_mcts,
+        }
+
+PLAY_POLICIES = {
+        'random': play_random,
+        'first': play_first,
+        'strongest': play_strongest,
+        'weakest': play_weakest,
+        'mcts': bot.play_mcts,
+        }
+
+
+class Stats:
+    """Aggregated results of a batch of games, batches can be merged"""
+
+    def __init__(self, number_of_players):
+        self.games = 0
+        self.actions = 0
+        self.gameturns = 0
+        # games without winner: all remaining players died in the same gameturn
+        self.draws = 0
+        self.wins = [0] * number_of_players
+        self.lives_lost = [0] * number_of_players
+        self.errors = Counter()
+
+    def add_game(self, lobby, actions):
+        """Account for a game over"""
+        self.games += 1
+        self.actions += actions
+        self.gameturns += lobby.gameturn_number
+        alive = [p.player_id for p in lobby.players if p.is_alive()]
+        if len(alive) == 1:
+            self.wins[alive[0]] += 1
+        else:
+            self.draws += 1
+        for event in lobby.events:
+            if event['type'] == 'lives_lost':
+                self.lives_lost[event['player_id']] += event['life_loss']
+
+    def add_error(self, error):
+        """Account for a game the engine could not finish"""
+        self.games += 1
+        self.errors['{}: {}'.format(type(error).__name__, error)] += 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.actions += other.actions
+        self.gameturns += other.gameturns
+        self.draws += other.draws
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        self.lives_lost = [a + b for a, b in zip(self.lives_lost, other.lives_lost)]
+        self.errors.update(other.errors)
+
+
+def play_game(seed, number_of_players, guess_policies, play_policies, engine=CompactLobby):
+    """Play a full game between bots, return the lobby and the number of actions"""
+    rng = random.Random('policies-{}'.format(seed))
+
+    lobby = engine(seed, number_of_players, seed=seed)
+    for i in range(number_of_players):
+        lobby.register_player('bot{}'.format(i))
+    lobby.start_game()
+
+    actions = 0
+    while lobby.current_turn_type != TurnType.GAME_OVER:
+        if actions == MAX_ACTIONS:
+            raise RuntimeError('Game did not end after {} actions'.format(MAX_ACTIONS))
+        player_id = lobby.current_player_id
+        if lobby.current_turn_type == TurnType.GUESS or lobby.current_turn_type == TurnType.FINAL_GUESS:
+            policy = guess_policies[player_id % len(guess_policies)]
+            lobby.guess(player_id, policy(lobby, player_id, rng))
+        else:
+            policy = play_policies[player_id % len(play_policies)]
+            lobby.play(player_id, policy(lobby, player_id, rng))
+        actions += 1
+
+    return lobby, actions
+
+
+def run_batch(batch):
+    """Play a batch of games, return their Stats (runs in the pool)"""
+    first_seed, number_of_games, number_of_players, guess_names, play_names, engine_name = batch
+    guess_policies = [GUESS_POLICIES[name] for name in guess_names]
+    play_policies = [PLAY_POLICIES[name] for name in play_names]
+    engine = ENGINES[engine_name]
+
+    stats = Stats(number_of_players)
+    for seed in range(first_seed, first_seed + number_of_games):
+        try:
+            lobby, actions = play_game(seed, number_of_players, guess_policies, play_policies, engine)
+        except (RuntimeError, ValueError, IndexError) as error:
+            stats.add_error(error)
+        else:
+            stats.add_game(lobby, actions)
+    return stats
+
+
+def simulate(games, number_of_players, guess_names, play_names, engine_name='compact',
+             seed=0, processes=None, batch_size=1000):
+    """Play games over a pool of processes, return the merged Stats"""
+    batches = [(first_seed, min(batch_size, seed + games - first_seed), number_of_players,
+                guess_names, play_names, engine_name)
+               for first_seed in range(seed, seed + games, batch_size)]
+
+    stats = Stats(number_of_players)
+    if processes == 1:
+        for batch in batches:
+            stats.merge(run_batch(batch))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for batch_stats in pool.imap_unordered(run_batch, batches):
+                stats.merge(batch_stats)
+    return stats
+
+
+def report(stats, elapsed):
+    """Print the statistics of a run"""
+    finished = stats.games - sum(stats.errors.values())
+    print('{} games in {:.2f}s: {:.0f} games/s'.format(stats.games, elapsed, stats.games / elapsed))
+    if finished:
+        print('average game: {:.2f} gameturns, {:.1f} actions'.format(
+            stats.gameturns / finished, stats.actions / finished))
+        print('draws: {} ({:.1%})'.format(stats.draws, stats.draws / finished))
+        for player_id, (wins, lives_lost) in enumerate(zip(stats.wins, stats.lives_lost)):
+            print('seat {}: {:.1%} wins, {:.2f} lives lost per game'.format(
+                player_id, wins / finished, lives_lost / finished))
+    for error, occurrences in stats.errors.most_common():
+        print('engine error in {} games: {}'.format(occurrences, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play fodinha games between bots')
+    parser.add_argument('--games', type=int, default=10000, help='number of games to play')
+    parser.add_argument('--players', type=int, default=4, help='number of players per game')
+    parser.add_argument('--guess', default='random',
+                        help='comma separated guess policies, one per seat: {}'.format(', '.join(GUESS_POLICIES)))
+    parser.add_argument('--play', default='random',
+                        help='comma separated play policies, one per seat: {}'.format(', '.join(PLAY_POLICIES)))
+    parser.add_argument('--engine', choices=ENGINES, default='compact', help='game engine')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--processes', type=int, default=None, help='pool size, defaults to the CPU count')
+    parser.add_argument('--batch-size', type=int, default=1000, help='games per task sent to the pool')
+    args = parser.parse_args()
+
+    guess_names = args.guess.split(',')
+    play_names = args.play.split(',')
+    for name in guess_names:
+        if name not in GUESS_POLICIES:
+            parser.error('unknown guess policy: {}'.format(name))
+    for name in play_names:
+        if name not in PLAY_POLICIES:
+            parser.error('unknown play policy: {}'.format(name))
+    if 'mcts' in guess_names + play_names and bot.np is None:
+        parser.error('the mcts policies need numpy: pip install numpy')
+    if 'table' in guess_names and not os.path.exists(tables.DEFAULT_PATH):
+        parser.error('the table policy needs {}: python -m fodinha.tables'.format(tables.DEFAULT_PATH))
+
+    start = time.perf_counter()
+    stats = simulate(args.games, args.players, guess_names, play_names, args.engine,
+                     args.seed, args.processes, args.batch_size)
+    report(stats, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""Expected tricks of a hand, precomputed: python -m fodinha.tables
+
+Hands hold at most MAX_HAND_SIZE cards and what matters in a hand is only
+the strength of its cards in the gameturn, so every hand of every
+gameturn is one of a few thousand multisets of 16 symbols:
+* 0 to 11: the values that are not the manilla, weakest first
+* 12 to 15: the manillas, by color
+For each number of alive players, manilla value and hand, the generator
+plays sampled deals out (fodinha.bot.rollout: everyone holds as many
+cards, guesses its strong cards and plays by the bot policy) and stores
+the average tricks won.
+
+The table is a flat file of bytes, the expected tricks times SCALE, read
+with mmap: a lookup is the rank of the hand (combinatorial number system,
+see hand_rank) and one byte read, whatever the number of tables.
+
+    python -m fodinha.tables --samples 64 --output fodinha/expected_tricks.bin
+
+Lobby.suggest_guess uses the table of DEFAULT_PATH for the hints of the
+UI and the 'table' bot of fodinha.sim. Generating it needs numpy; it is
+not in git, the Dockerfile generates it when the image is built.
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from itertools import combinations_with_replacement
+from math import comb
+
+MIN_PLAYERS = 2
+MAX_PLAYERS = 10
+MAX_HAND_SIZE = 5
+NUMBER_OF_VALUES = 13
+# 12 values that are not the manilla, then the 4 manillas
+NUMBER_OF_SYMBOLS = 16
+MANILLA_SYMBOL = 12
+# stored value: expected tricks * SCALE, in one byte
+SCALE = 50
+
+HEADER = struct.Struct('<4sBBBB')
+MAGIC = b'FDXT'
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'expected_tricks.bin')
+
+# hands of each size: multisets of hand_size symbols
+HANDS = [comb(NUMBER_OF_SYMBOLS + hand_size - 1, hand_size) for hand_size in range(MAX_HAND_SIZE + 1)]
+# offset of the hands of each size in a table, the size 0 has none
+HAND_OFFSETS = [sum(HANDS[1:hand_size]) for hand_size in range(MAX_HAND_SIZE + 1)]
+TABLE_SIZE = sum(HANDS[1:])
+
+
+def manilla_value_of(beforemanilla_value):
+    """Return the real value of the manilla, from the real value of the beforemanilla"""
+    return 1 if beforemanilla_value == 13 else beforemanilla_value + 1
+
+
+def symbol(real_value, color, manilla_value):
+    """Return the symbol of a card, see the module docstring"""
+    if real_value == manilla_value:
+        return MANILLA_SYMBOL + color - 1
+    return real_value - 1 if real_value < manilla_value else real_value - 2
+
+
+def hand_rank(symbols):
+    """Return the rank of a sorted tuple of symbols among the hands of its size
+
+    A multiset a0 <= a1 <= ... is the combination a0 < a1 + 1 < a2 + 2 ...,
+    ranked in colexicographic order.
+    """
+    return sum(comb(s + i, i + 1) for i, s in enumerate(symbols))
+
+
+def table_offset(number_of_players, manilla_value, hand_size, rank):
+    """Return the position of an entry in the file, header excluded"""
+    table = (number_of_players - MIN_PLAYERS) * NUMBER_OF_VALUES + manilla_value - 1
+    return table * TABLE_SIZE + HAND_OFFSETS[hand_size] + rank
+
+
+class ExpectedTricks:
+    """Read-only view of a table file"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, min_players, max_players, max_hand_size, scale = HEADER.unpack_from(self.data)
+        if (magic, min_players, max_players, max_hand_size, scale) != \
+                (MAGIC, MIN_PLAYERS, MAX_PLAYERS, MAX_HAND_SIZE, SCALE):
+            raise ValueError('{} is not a table of this version of fodinha.tables'.format(path))
+
+    def get(self, cards, beforemanilla_value, number_of_players):
+        """Return the expected tricks of a hand of (real_value, color) pairs
+
+        number_of_players is the number of alive players, clamped to the
+        ones of the table.
+        """
+        if not cards:
+            return 0.0
+        if len(cards) > MAX_HAND_SIZE:
+            raise ValueError('Hands have at most {} cards, got {}'.format(MAX_HAND_SIZE, len(cards)))
+        number_of_players = min(max(number_of_players, MIN_PLAYERS), MAX_PLAYERS)
+        manilla_value = manilla_value_of(beforemanilla_value)
+        symbols = sorted(symbol(real_value, color, manilla_value) for real_value, color in cards)
+        offset = table_offset(number_of_players, manilla_value, len(cards), hand_rank(symbols))
+        return self.data[HEADER.size + offset] / SCALE
+
+
+_default = None
+
+
+def default_table():
+    """Return the ExpectedTricks of DEFAULT_PATH, opened on first use"""
+    global _default
+    if _default is None:
+        _default = ExpectedTricks(DEFAULT_PATH)
+    return _default
+
+
+def deck_counts(manilla_value):
+    """Return how many cards of each symbol are left once the beforemanilla is drawn"""
+    counts = [4] * MANILLA_SYMBOL + [1] * (NUMBER_OF_SYMBOLS - MANILLA_SYMBOL)
+    beforemanilla_value = 13 if manilla_value == 1 else manilla_value - 1
+    counts[symbol(beforemanilla_value, 1, manilla_value)] -= 1
+    return counts
+
+
+def symbol_strengths(manilla_value):
+    """Return the fodinha.bot strength of each symbol"""
+    values = [value for value in range(1, NUMBER_OF_VALUES + 1) if value != manilla_value]
+    return values + [NUMBER_OF_VALUES + color for color in range(1, 5)]
+
+
+class Deal:
+    """Start of a gameturn where everyone holds the same number of cards, for bot.rollout"""
+
+    def __init__(self, number_of_players, hand_size):
+        self.number_of_players = number_of_players
+        self.tricks_left = hand_size
+        self.wins = [0] * number_of_players
+        self.win_value = 1
+        self.trick = []
+
+
+def generate(task):
+    """Return the table of (number_of_players, manilla_value, samples, seed) as bytes (runs in the pool)"""
+    import numpy as np
+    from fodinha.bot import EMPTY, STRONG, rollout
+
+    number_of_players, manilla_value, samples, seed = task
+    generator = np.random.default_rng(seed)
+    counts = deck_counts(manilla_value)
+    strengths = np.array(symbol_strengths(manilla_value), dtype=np.int8)
+    table = bytearray(TABLE_SIZE)
+    for hand_size in range(1, MAX_HAND_SIZE + 1):
+        if number_of_players * hand_size > sum(counts):
+            # not enough cards to deal: never happens in a game
+            continue
+        hands = [hand for hand in combinations_with_replacement(range(NUMBER_OF_SYMBOLS), hand_size)
+                 if all(hand.count(s) <= counts[s] for s in set(hand))]
+        # a few thousand samples per rollout
+        chunk = max(1, 100000 // samples)
+        for start in range(0, len(hands), chunk):
+            chunk_hands = hands[start:start + chunk]
+            pools = []
+            for hand in chunk_hands:
+                left = list(counts)
+                for s in hand:
+                    left[s] -= 1
+                pools.append([s for s in range(NUMBER_OF_SYMBOLS) for _ in range(left[s])])
+            pools = strengths[np.repeat(np.array(pools), samples, axis=0)]
+            shuffled = np.take_along_axis(pools, np.argsort(generator.random(pools.shape), axis=1), axis=1)
+
+            batch = shuffled.shape[0]
+            dealt = np.full((batch, number_of_players, hand_size), EMPTY, dtype=np.int8)
+            dealt[:, 0] = strengths[np.repeat(np.array(chunk_hands), samples, axis=0)]
+            dealt[:, 1:] = shuffled[:, :(number_of_players - 1) * hand_size].reshape(
+                batch, number_of_players - 1, hand_size)
+            guesses = np.minimum((dealt >= STRONG).sum(axis=2), hand_size)
+            wins = rollout(Deal(number_of_players, hand_size), dealt, guesses)
+            expected = wins[:, 0].reshape(len(chunk_hands), samples).mean(axis=1)
+            for hand, tricks in zip(chunk_hands, expected):
+                offset = HAND_OFFSETS[hand_size] + hand_rank(hand)
+                table[offset] = min(255, int(round(tricks * SCALE)))
+    return number_of_players, manilla_value, bytes(table)
+
+
+def write(path, tables):
+    """Write the {(number_of_players, manilla_value): table bytes} to a file, atomically"""
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, MIN_PLAYERS, MAX_PLAYERS, MAX_HAND_SIZE, SCALE))
+        for number_of_players in range(MIN_PLAYERS, MAX_PLAYERS + 1):
+            for manilla_value in range(1, NUMBER_OF_VALUES + 1):
+                f.write(tables[number_of_players, manilla_value])
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the expected tricks tables')
+    parser.add_argument('--samples', type=int, default=64, help='deals played out per hand')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first table')
+    parser.add_argument('--processes', type=int, default=None, help='pool size, defaults to the CPU count')
+    parser.add_argument('--output', default=DEFAULT_PATH, help='file to write')
+    args = parser.parse_args()
+
+    tasks = [(number_of_players, manilla_value, args.samples, args.seed + i)
+             for i, (number_of_players, manilla_value) in enumerate(
+                 (n, m) for n in range(MIN_PLAYERS, MAX_PLAYERS + 1) for m in range(1, NUMBER_OF_VALUES + 1))]
+    start = time.perf_counter()
+    tables = {}
+    with multiprocessing.Pool(args.processes) as pool:
+        for number_of_players, manilla_value, table in pool.imap_unordered(generate, tasks):
+            tables[number_of_players, manilla_value] = table
+            print('{} players, manilla {}: done ({}/{}, {:.0f}s)'.format(
+                number_of_players, manilla_value, len(tables), len(tasks), time.perf_counter() - start))
+    write(args.output, tables)
+    print('{} written, {} bytes'.format(args.output, HEADER.size + len(tasks) * TABLE_SIZE))
+
+
+if __name__ == '__main__':
+    main()
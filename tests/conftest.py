@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+# read by config.py when a test imports the app
+os.environ.setdefault('LOBBY_STORE', 'memory')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# the database of PersistentLobbyStore, emptied by the tests using it
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'app.db'))
+
+from fodinha import TurnType
+
+
+def random_action(lobby, rng):
+    """Return a valid (action, player_id, argument) for the current turn of a started game"""
+    player_id = lobby.current_player_id
+    if lobby.current_turn_type in (TurnType.GUESS, TurnType.FINAL_GUESS):
+        # not the forbidden 'pé' guess
+        last = len(lobby.current_guesses) == lobby.count_alive_players() - 1
+        guesses = [guess for guess in range(lobby.current_number_of_turns + 1)
+                   if not last or sum(lobby.current_guesses) + guess != lobby.current_number_of_turns]
+        return 'guess', player_id, rng.choice(guesses)
+    return 'play', player_id, rng.randrange(len(lobby.players[player_id].cards))
@@ -0,0 +1,225 @@
+"""app.asgi: the WebSocket channel and the native routes, driven with scripted ASGI messages"""
+import asyncio
+import json
+
+import pytest
+
+from app import app, store
+from app.asgi import application, channels
+
+# all the tests share one loop: the store listener of app.asgi is bound to the first one
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    return loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+
+def session_cookie(lobby_id, player_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    value = serializer.dumps({'name': 'p{}'.format(player_id), 'lobby_id': lobby_id, 'player_id': player_id})
+    return (b'cookie', '{}={}'.format(app.session_cookie_name, value).encode())
+
+
+class Client:
+    """One ASGI connection: the messages the server receives, and the ones it sent"""
+
+    def __init__(self, scope_type, path, query_string=b'', headers=(), method=None):
+        self.scope = {'type': scope_type, 'path': path, 'query_string': query_string,
+                      'headers': list(headers)}
+        if method is not None:
+            self.scope['method'] = method
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.task = None
+
+    def start(self, *messages):
+        for message in messages:
+            self.incoming.put_nowait(message)
+        self.task = asyncio.ensure_future(application(self.scope, self.incoming.get, self.outgoing.put))
+        return self
+
+    async def next(self, timeout=5):
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+    def pending(self):
+        """Return the messages sent and not read yet"""
+        messages = []
+        while not self.outgoing.empty():
+            messages.append(self.outgoing.get_nowait())
+        return messages
+
+
+def new_game(number_of_players=2):
+    lobby_id = store.create(number_of_players)
+    for seat in range(number_of_players):
+        with store.edit(lobby_id) as lobby:
+            lobby.register_player('p{}'.format(seat))
+            if seat == number_of_players - 1:
+                lobby.start_game()
+    return lobby_id
+
+
+async def connect(lobby_id, seat):
+    """Open the WebSocket of a seat (None: a spectator), return it and its first state"""
+    if seat is None:
+        client = Client('websocket', '/api/lobby/socket', 'lobby_id={}'.format(lobby_id).encode())
+    else:
+        client = Client('websocket', '/api/lobby/socket', headers=[session_cookie(lobby_id, seat)])
+    client.start({'type': 'websocket.connect'})
+    assert await client.next() == {'type': 'websocket.accept'}
+    message = await client.next()
+    return client, json.loads(message['text'])
+
+
+async def settle():
+    # the broadcasts run on the next iterations of the loop
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+
+async def disconnect(*clients):
+    for client in clients:
+        client.incoming.put_nowait({'type': 'websocket.disconnect'})
+    await asyncio.gather(*(client.task for client in clients))
+
+
+def test_guess_reaches_both_seats_in_one_broadcast(monkeypatch):
+    lobby_id = new_game()
+    broadcasts = []
+    broadcast = channels.broadcast
+
+    def count_broadcast(lobby_id):
+        broadcasts.append(lobby_id)
+        return broadcast(lobby_id)
+    monkeypatch.setattr(channels, 'broadcast', count_broadcast)
+
+    async def scenario():
+        seats = [await connect(lobby_id, seat) for seat in range(2)]
+        (first, state), (second, _) = seats
+        version = state['public']['version']
+        player = state['public']['current_player_id']
+        seats[player][0].incoming.put_nowait({'type': 'websocket.receive',
+                                              'text': json.dumps({'action': 'guess', 'guess': 0})})
+        messages = [json.loads((await client.next())['text']) for client, _ in seats]
+        await settle()
+        assert not first.pending() and not second.pending()
+        await disconnect(first, second)
+        return version, messages
+
+    version, messages = run(scenario())
+    assert broadcasts == [lobby_id]
+    for seat, message in enumerate(messages):
+        assert message['type'] == 'state'
+        assert message['public']['version'] == version + 1
+        assert message['public']['current_guesses'] == [0]
+        assert message['cards'] == store.get(lobby_id).get_cards(seat)['cards']
+    store.delete(lobby_id)
+
+
+def test_spectators_can_not_act():
+    lobby_id = new_game()
+
+    async def scenario():
+        spectator, state = await connect(lobby_id, None)
+        spectator.incoming.put_nowait({'type': 'websocket.receive',
+                                       'text': json.dumps({'action': 'guess', 'guess': 0})})
+        error = json.loads((await spectator.next())['text'])
+        await disconnect(spectator)
+        return state, error
+
+    state, error = run(scenario())
+    assert 'cards' not in state
+    assert error == {'type': 'error', 'action': 'guess', 'status': 403}
+    assert store.get(lobby_id).current_guesses == []
+    store.delete(lobby_id)
+
+
+def test_delete_closes_every_socket():
+    lobby_id = new_game()
+
+    async def scenario():
+        clients = [(await connect(lobby_id, seat))[0] for seat in (0, 1, None)]
+        store.delete(lobby_id)
+        closed = [[await client.next(), await client.next()] for client in clients]
+        await disconnect(*clients)
+        refused = Client('websocket', '/api/lobby/socket', headers=[session_cookie(lobby_id, 0)])
+        refused.start({'type': 'websocket.connect'})
+        return closed, await refused.next()
+
+    closed, refused = run(scenario())
+    for messages in closed:
+        assert messages == [{'type': 'websocket.send', 'text': '{"type": "deleted"}'},
+                            {'type': 'websocket.close', 'code': 1000}]
+    assert refused == {'type': 'websocket.close', 'code': 4404}
+
+
+def read_event(message):
+    """Return {field: value} of a server-sent event chunk"""
+    assert message['type'] == 'http.response.body' and message['more_body']
+    return dict(line.split(': ', 1) for line in message['body'].decode().splitlines() if line)
+
+
+def test_events_resume_after_last_event_id(monkeypatch):
+    monkeypatch.setitem(app.config, 'LONGPOLL_TIMEOUT', 0.2)
+    lobby_id = new_game()
+    version = store.version(lobby_id)
+
+    def guess():
+        with store.edit(lobby_id) as lobby:
+            lobby.guess(lobby.current_player_id, 0)
+
+    async def scenario():
+        # the client got every event up to version: the next one is the first it gets
+        resumed = Client('http', '/api/lobby/events', method='GET',
+                         headers=[session_cookie(lobby_id, 0), (b'last-event-id', str(version).encode())])
+        resumed.start()
+        start = await resumed.next()
+        assert (await resumed.next())['body'] == b': keep-alive\n\n'
+        guess()
+        event = read_event(await resumed.next())
+        # an older client gets the current status at once
+        behind = Client('http', '/api/lobby/events', method='GET',
+                        headers=[session_cookie(lobby_id, 1), (b'last-event-id', str(version - 1).encode())])
+        behind.start()
+        await behind.next()
+        behind_event = read_event(await behind.next())
+        for client in (resumed, behind):
+            client.incoming.put_nowait({'type': 'http.disconnect'})
+        await asyncio.gather(resumed.task, behind.task)
+        return start, event, behind_event
+
+    start, event, behind_event = run(scenario())
+    assert start['status'] == 200
+    assert (b'content-type', b'text/event-stream') in start['headers']
+    assert event['id'] == str(version + 1) and event['event'] == 'status'
+    assert json.loads(event['data'])['version'] == version + 1
+    assert behind_event['id'] == str(version + 1)
+    store.delete(lobby_id)
+
+
+@pytest.mark.parametrize('changed', [False, True])
+def test_wait_answers_the_new_status(monkeypatch, changed):
+    monkeypatch.setitem(app.config, 'LONGPOLL_TIMEOUT', 0.2)
+    lobby_id = new_game()
+    version = store.version(lobby_id)
+
+    async def scenario():
+        client = Client('http', '/api/lobby/wait', 'version={}'.format(version).encode(), method='GET',
+                        headers=[session_cookie(lobby_id, 0)])
+        client.start({'type': 'http.request', 'body': b''})
+        if changed:
+            await asyncio.sleep(0.05)
+            with store.edit(lobby_id) as lobby:
+                lobby.guess(lobby.current_player_id, 0)
+        start, body = await client.next(), await client.next()
+        await client.task
+        return start, body
+
+    start, body = run(scenario())
+    if changed:
+        assert start['status'] == 200
+        assert json.loads(body['body'])['version'] == version + 1
+    else:
+        assert start['status'] == 304
+    store.delete(lobby_id)
@@ -0,0 +1,44 @@
+"""CompactLobby against Lobby: the same seed and actions give the same game"""
+import random
+
+import pytest
+from conftest import random_action
+
+from fodinha import Lobby, TurnType
+from fodinha.compact import CompactLobby
+
+
+def new_game(engine, seed, number_of_players):
+    lobby = engine(0, number_of_players, seed=seed)
+    for seat in range(number_of_players):
+        lobby.register_player('p{}'.format(seat))
+    lobby.start_game()
+    return lobby
+
+
+def hands(lobby):
+    return [lobby.get_cards(seat)['cards'] for seat in range(lobby.number_of_players)]
+
+
+@pytest.mark.parametrize('number_of_players', [2, 3, 4, 7, 10])
+@pytest.mark.parametrize('seed', [0, 1, 42, 2 ** 63 + 5])
+def test_same_seed_deals_same_hands(seed, number_of_players):
+    lobby = new_game(Lobby, seed, number_of_players)
+    compact = new_game(CompactLobby, seed, number_of_players)
+    assert hands(compact) == hands(lobby)
+    assert compact.status() == lobby.status()
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_actions_play_same_game(seed):
+    number_of_players = 2 + seed % 5
+    lobby = new_game(Lobby, seed, number_of_players)
+    compact = new_game(CompactLobby, seed, number_of_players)
+    rng = random.Random(seed)
+    while lobby.current_turn_type != TurnType.GAME_OVER:
+        action, player_id, argument = random_action(lobby, rng)
+        getattr(lobby, action)(player_id, argument)
+        getattr(compact, action)(player_id, argument)
+        assert compact.status() == lobby.status()
+        assert hands(compact) == hands(lobby)
+    assert compact.events == lobby.events
@@ -0,0 +1,108 @@
+"""find_turn_winner against the resolver it replaced (update_current_wins before [user-008])
+
+Every ordered trick of 2 and 3 cards is resolved for every beforemanilla
+value, by the old resolver, Lobby and CompactLobby. Bigger tricks are
+random. The cards are owned by seats 0, 1, 2... in the order they are
+played: the old resolver indexed the played cards by owner ID to break
+ties between manillas, which is only right in that case.
+"""
+import itertools
+import random
+
+import pytest
+
+from fodinha import Card, Color, Lobby
+from fodinha.compact import NUMBER_OF_CARDS, CompactLobby, card_code
+
+DECK = [Card(value, color) for value in range(1, 14) for color in Color]
+# one beforemanilla per real value, only its real value matters
+BEFOREMANILLAS = list({card.real_value: card for card in DECK}.values())
+
+
+def old_turn_winner(beforemanilla, played_cards):
+    """The resolver of update_current_wins before [user-008], None if all cards canceled out"""
+    if beforemanilla.real_value == 13:
+        manilla_value = 1
+    else:
+        manilla_value = beforemanilla.real_value + 1
+
+    played_cards_real_values = [c.real_value for c in played_cards]
+    winner_owner = None
+
+    if played_cards_real_values.count(manilla_value) > 1:
+        for i, c in enumerate(played_cards):
+            if c.real_value == manilla_value:
+                if winner_owner == None or c.color > played_cards[winner_owner].color:
+                    winner_owner = c.owner_id
+        assert winner_owner is not None
+    elif played_cards_real_values.count(manilla_value) == 1:
+        manilla_index = played_cards_real_values.index(manilla_value)
+        winner_owner = played_cards[manilla_index].owner_id
+    else:
+        winning_card = 0
+        card_rvalues_sorted = sorted(played_cards_real_values)[::-1]
+        for r in card_rvalues_sorted:
+            if card_rvalues_sorted.count(r) == 1:
+                winning_card = r
+                break
+        if winning_card != 0:
+            card_index = played_cards_real_values.index(winning_card)
+            winner_owner = played_cards[card_index].owner_id
+    return winner_owner
+
+
+def owned(cards):
+    """Return copies of the cards, owned by their position in the trick"""
+    played_cards = []
+    for owner_id, card in enumerate(cards):
+        card = Card(card.value, card.color)
+        card.owner_id = owner_id
+        played_cards.append(card)
+    return played_cards
+
+
+# OWNED[seat][i]: DECK[i] owned by seat, shared by the tricks of the exhaustive test
+OWNED = []
+for seat in range(3):
+    OWNED.append([Card(card.value, card.color) for card in DECK])
+    for card in OWNED[seat]:
+        card.owner_id = seat
+
+
+def resolvers(beforemanilla):
+    """Return a lobby of each engine, ready to resolve tricks with this beforemanilla"""
+    lobby = Lobby(0, 10)
+    lobby.current_beforemanilla = beforemanilla
+    compact = CompactLobby(0, 10)
+    compact.current_beforemanilla = card_code(beforemanilla)
+    return lobby, compact
+
+
+def check(lobby, compact, beforemanilla, played_cards):
+    expected = old_turn_winner(beforemanilla, played_cards)
+    lobby.current_played_cards = played_cards
+    compact.current_played_cards = [card.owner_id << 6 | card_code(card) for card in played_cards]
+    assert lobby.find_turn_winner() == expected, [str(card) for card in played_cards]
+    assert compact.find_turn_winner() == expected, [str(card) for card in played_cards]
+
+
+@pytest.mark.parametrize('size', [2, 3])
+@pytest.mark.parametrize('beforemanilla', BEFOREMANILLAS, ids=str)
+def test_every_small_trick(beforemanilla, size):
+    lobby, compact = resolvers(beforemanilla)
+    for indexes in itertools.permutations(range(len(DECK)), size):
+        check(lobby, compact, beforemanilla, [OWNED[seat][i] for seat, i in enumerate(indexes)])
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_tricks(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        beforemanilla = rng.choice(DECK)
+        lobby, compact = resolvers(beforemanilla)
+        cards = rng.sample(DECK, rng.randint(4, 10))
+        check(lobby, compact, beforemanilla, owned(cards))
+
+
+def test_codes_match_cards():
+    assert sorted(card_code(card) for card in DECK) == list(range(NUMBER_OF_CARDS))
@@ -0,0 +1,153 @@
+"""JournalLobbyStore: what is logged, and the lobbies rebuilt from it at restart"""
+import random
+import threading
+import time
+
+import pytest
+from conftest import random_action
+
+from app.store import JournalLobbyStore
+from fodinha import TurnType, journal
+
+
+def open_store(tmp_path):
+    return JournalLobbyStore(str(tmp_path / 'fodinha.journal'), snapshot_interval=3600)
+
+
+def play_games(store, number_of_games, seed, actions=None):
+    """Create and play games through the store, up to actions actions each (None: to the end)"""
+    rng = random.Random(seed)
+    lobby_ids = []
+    for _ in range(number_of_games):
+        number_of_players = rng.randint(2, 6)
+        lobby_id = store.create(number_of_players)
+        for seat in range(number_of_players):
+            with store.edit(lobby_id) as lobby:
+                lobby.register_player('p{}'.format(seat))
+                if seat == number_of_players - 1:
+                    lobby.start_game()
+        played = 0
+        while store.get(lobby_id).current_turn_type != TurnType.GAME_OVER and played != actions:
+            with store.edit(lobby_id) as lobby:
+                action, player_id, argument = random_action(lobby, rng)
+                getattr(lobby, action)(player_id, argument)
+            played += 1
+        lobby_ids.append(lobby_id)
+    return lobby_ids
+
+
+def state(lobby):
+    return lobby.status(), [lobby.get_cards(seat) for seat in range(len(lobby.players))], list(lobby.events)
+
+
+@pytest.mark.parametrize('actions', [None, 7])
+def test_recover_rebuilds_the_games(tmp_path, actions):
+    store = open_store(tmp_path)
+    lobby_ids = play_games(store, 20, seed=1, actions=actions)
+    expected = {lobby_id: state(store.get(lobby_id)) for lobby_id in lobby_ids}
+    store.journal.close()
+
+    recovered = open_store(tmp_path)
+    assert {lobby_id: state(recovered.get(lobby_id)) for lobby_id in lobby_ids} == expected
+    recovered.journal.close()
+
+
+def test_clients_never_see_the_seed(tmp_path):
+    store = open_store(tmp_path)
+    (lobby_id,) = play_games(store, 1, seed=2, actions=3)
+    with store.read(lobby_id) as lobby:
+        events = lobby.events_since(0)['events']
+        # a log saved by an older version
+        lobby.events[0] = dict(lobby.events[0], seed=1234)
+        old_events = lobby.events_since(0)['events']
+    assert any(event['type'] == 'gameturn_dealt' for event in events)
+    assert not any('seed' in event for event in events + old_events)
+    store.journal.close()
+
+
+def test_registration_not_journaled_is_undone(tmp_path, monkeypatch):
+    store = open_store(tmp_path)
+    lobby_id = store.create(3)
+    with store.edit(lobby_id) as lobby:
+        lobby.register_player('p0')
+    before = state(store.get(lobby_id))
+
+    def refuse(lobby, events):
+        raise ValueError('does not fit')
+    monkeypatch.setattr(journal, 'records_for', refuse)
+    with pytest.raises(ValueError):
+        with store.edit(lobby_id) as lobby:
+            lobby.register_player('p1')
+    assert state(store.get(lobby_id)) == before
+    store.journal.close()
+
+
+def test_recover_skips_refused_records(tmp_path):
+    store = open_store(tmp_path)
+    lobby_ids = play_games(store, 3, seed=4, actions=5)
+    lobby = store.get(lobby_ids[1])
+    # not the turn of this player: recovery logs it and goes on
+    wrong_seat = (lobby.current_player_id + 1) % lobby.number_of_players
+    store.journal.append([journal.encode(lobby.lobby_id, lobby.version + 1, journal.GUESS, wrong_seat, 0)])
+    with store.edit(lobby_ids[2]) as lobby:
+        action, player_id, argument = random_action(lobby, random.Random(4))
+        getattr(lobby, action)(player_id, argument)
+    expected = {lobby_id: state(store.get(lobby_id)) for lobby_id in lobby_ids}
+    store.journal.close()
+
+    recovered = open_store(tmp_path)
+    assert {lobby_id: state(recovered.get(lobby_id)) for lobby_id in lobby_ids} == expected
+    recovered.journal.close()
+
+
+def test_names_are_not_cut():
+    with pytest.raises(ValueError):
+        journal.encode(0, 1, journal.REGISTER, name='x' * (journal.NAME_SIZE + 1))
+    name = 'ç' * (journal.NAME_SIZE // 2)
+    assert journal.decode(journal.encode(0, 1, journal.REGISTER, name=name)).name == name
+
+
+def test_edit_fails_when_the_journal_can_not_be_written(tmp_path, monkeypatch):
+    store = open_store(tmp_path)
+    (lobby_id,) = play_games(store, 1, seed=5, actions=0)
+
+    def fsync(fd):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(journal.os, 'fsync', fsync)
+    errors = []
+
+    def edit():
+        try:
+            with store.edit(lobby_id) as lobby:
+                action, player_id, argument = random_action(lobby, random.Random(5))
+                getattr(lobby, action)(player_id, argument)
+        except OSError as error:
+            errors.append(error)
+    thread = threading.Thread(target=edit, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    # the next ones fail at once
+    with pytest.raises(OSError):
+        store.create(2)
+    store.journal.close()
+
+
+def test_snapshots_go_on_after_a_failure(tmp_path, monkeypatch):
+    store = JournalLobbyStore(str(tmp_path / 'fodinha.journal'), snapshot_interval=0.05)
+    write_snapshot = journal.write_snapshot
+    written = []
+
+    def fail_once(*args):
+        written.append(args)
+        if len(written) == 1:
+            raise OSError(28, 'No space left on device')
+        write_snapshot(*args)
+    monkeypatch.setattr(journal, 'write_snapshot', fail_once)
+    play_games(store, 1, seed=6, actions=3)
+    deadline = time.monotonic() + 10
+    while len(written) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(written) >= 3
+    store.journal.close()
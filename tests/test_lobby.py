@@ -0,0 +1,67 @@
+"""Lobby: the actions the engine refuses"""
+import pytest
+
+from fodinha import MAX_NAME_SIZE, MAX_PLAYERS, MIN_PLAYERS, Lobby, TurnType
+from fodinha.compact import CompactLobby
+
+
+def new_game(engine, number_of_players=3):
+    lobby = engine(0, number_of_players, seed=0)
+    for seat in range(number_of_players):
+        lobby.register_player('p{}'.format(seat))
+    lobby.start_game()
+    return lobby
+
+
+@pytest.mark.parametrize('engine', [Lobby, CompactLobby])
+def test_guess_out_of_range(engine):
+    lobby = new_game(engine)
+    for given_guess in (-1, lobby.current_number_of_turns + 1):
+        with pytest.raises(ValueError):
+            lobby.guess(lobby.current_player_id, given_guess)
+    assert lobby.current_guesses == []
+    lobby.guess(lobby.current_player_id, lobby.current_number_of_turns)
+
+
+@pytest.mark.parametrize('engine', [Lobby, CompactLobby])
+def test_negative_card_index(engine):
+    lobby = new_game(engine)
+    while lobby.current_turn_type == TurnType.GUESS:
+        lobby.guess(lobby.current_player_id, 0 if len(lobby.current_guesses) < 2 else 1)
+    hand = lobby.get_cards(lobby.current_player_id)
+    with pytest.raises(ValueError):
+        lobby.play(lobby.current_player_id, -1)
+    assert lobby.get_cards(lobby.current_player_id) == hand
+
+
+@pytest.mark.parametrize('engine', [Lobby, CompactLobby])
+def test_name_too_long(engine):
+    lobby = engine(0, 2)
+    lobby.register_player('é' * (MAX_NAME_SIZE // 2))
+    with pytest.raises(ValueError):
+        lobby.register_player('é' * (MAX_NAME_SIZE // 2 + 1))
+    assert len(lobby.players) == 1
+
+
+@pytest.mark.parametrize('engine', [Lobby, CompactLobby])
+def test_number_of_players(engine):
+    for number_of_players in (MIN_PLAYERS - 1, MAX_PLAYERS + 1, 300):
+        with pytest.raises(ValueError):
+            engine(0, number_of_players)
+    for number_of_players in (MIN_PLAYERS, MAX_PLAYERS):
+        assert engine.restore(new_game(engine, number_of_players).snapshot()).number_of_players == number_of_players
+
+
+@pytest.mark.parametrize('engine', [Lobby, CompactLobby])
+def test_snapshot_limits(engine):
+    # fields the actions can't set out of bounds, but a lobby of an older version could have
+    for field, value in (('lobby_id', 2 ** 32), ('lobby_id', -1), ('version', 2 ** 32),
+                         ('current_guesses', [256]), ('current_guesses', [-1])):
+        lobby = new_game(engine)
+        setattr(lobby, field, value)
+        with pytest.raises(ValueError):
+            lobby.snapshot()
+    lobby = new_game(engine)
+    lobby.players[0].name = 'x' * 65536
+    with pytest.raises(ValueError):
+        lobby.snapshot()
@@ -0,0 +1,45 @@
+"""fodinha.replay on the journal written by the server"""
+import pytest
+from test_journal import open_store, play_games
+
+from fodinha import Lobby, TurnType, journal
+from fodinha.compact import CompactLobby
+from fodinha.replay import Results, measure, replay
+
+
+def journaled_games(tmp_path):
+    """Return the journal path and the Results of its games measured on the store"""
+    store = open_store(tmp_path)
+    lobby_ids = play_games(store, 12, seed=5) + play_games(store, 4, seed=6, actions=9)
+    expected = Results()
+    for lobby_id in lobby_ids:
+        lobby = store.get(lobby_id)
+        expected.add(lobby, lobby.current_turn_type == TurnType.GAME_OVER)
+    store.journal.close()
+    return store.journal.path, expected
+
+
+def rows(results):
+    return sorted(zip(*results.games.data.values())), sorted(zip(*results.players.data.values()))
+
+
+@pytest.mark.parametrize('lobby_class', [Lobby, CompactLobby])
+def test_replay_measures_the_server_games(tmp_path, lobby_class):
+    path, expected = journaled_games(tmp_path)
+    results = replay(path, processes=1, lobby_class=lobby_class)
+    assert not results.failed
+    assert rows(results) == rows(expected)
+    assert results.win_values == expected.win_values
+
+
+def test_replay_drops_a_refused_game(tmp_path):
+    path, expected = journaled_games(tmp_path)
+    store = open_store(tmp_path)
+    lobby = store.get(15)
+    wrong_seat = (lobby.current_player_id + 1) % lobby.number_of_players
+    store.journal.append([journal.encode(15, lobby.version + 1, journal.GUESS, wrong_seat, 0)])
+    store.journal.close()
+
+    results = replay(path, processes=2)
+    assert [lobby_id for lobby_id, _ in results.failed] == [15]
+    assert rows(results) == tuple(sorted(row for row in table if row[0] != 15) for table in rows(expected))
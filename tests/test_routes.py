@@ -0,0 +1,133 @@
+"""The Flask API through app.test_client(), on the memory store of conftest"""
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import app, store
+
+
+def new_game(number_of_players=2):
+    """Create a lobby through the API and register its players, return it and their clients"""
+    lobby_id = store.create(number_of_players)
+    clients = []
+    for seat in range(number_of_players):
+        client = app.test_client()
+        assert client.post('/api/lobby/{}/register'.format(lobby_id), data={'name': 'p{}'.format(seat)}).status_code == 200
+        clients.append(client)
+    return lobby_id, clients
+
+
+def guess(lobby_id, clients):
+    """Make the guess of the current player, through its client"""
+    player_id = store.get(lobby_id).current_player_id
+    assert clients[player_id].post('/api/lobby/guess', data={'guess': 0}).status_code == 200
+
+
+def test_status_is_answered_once_per_version():
+    lobby_id, clients = new_game()
+    first = clients[0].get('/api/lobby/status')
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert json.loads(first.data)['version'] == store.version(lobby_id)
+
+    again = clients[0].get('/api/lobby/status', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert not again.data
+
+    guess(lobby_id, clients)
+    changed = clients[0].get('/api/lobby/status', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert json.loads(changed.data)['current_guesses'] == [0]
+    store.delete(lobby_id)
+
+
+def test_events_since():
+    lobby_id, clients = new_game()
+    first = clients[1].get('/api/lobby/status?since=0')
+    events = json.loads(first.data)
+    assert first.status_code == 200
+    assert clients[1].get('/api/lobby/status?since=0',
+                          headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    guess(lobby_id, clients)
+    since = clients[1].get('/api/lobby/status?since={}'.format(events['seq']))
+    assert since.headers['ETag'] != first.headers['ETag']
+    assert [event['type'] for event in json.loads(since.data)['events']] == ['guess']
+    store.delete(lobby_id)
+
+
+@pytest.mark.parametrize('path', ['/api/lobby/status', '/api/players/list', '/api/players/cards'])
+def test_msgpack_is_the_same_view(path):
+    msgpack = pytest.importorskip('msgpack')
+    lobby_id, clients = new_game()
+    as_json = clients[0].get(path)
+    as_msgpack = clients[0].get(path, headers={'Accept': 'application/msgpack'})
+    assert as_msgpack.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(as_msgpack.data, raw=False) == json.loads(as_json.data)
+    # each representation has its own ETag
+    assert as_msgpack.headers['ETag'] != as_json.headers['ETag']
+    store.delete(lobby_id)
+
+
+def test_gzip_above_compress_min_size(monkeypatch):
+    lobby_id, clients = new_game()
+    plain = clients[0].get('/api/lobby/status')
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', len(plain.data) + 1)
+    small = clients[0].get('/api/lobby/status', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.data == plain.data
+
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', len(plain.data))
+    compressed = clients[0].get('/api/lobby/status', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    # weak: the same ETag as the plain answer, it still matches
+    assert compressed.headers['ETag'] == 'W/' + plain.headers['ETag']
+    assert clients[0].get('/api/lobby/status', headers={'Accept-Encoding': 'gzip',
+                                                        'If-None-Match': compressed.headers['ETag']}).status_code == 304
+    store.delete(lobby_id)
+
+
+def test_lobby_list_pages_and_etags():
+    lobby_id = store.create(3)
+    client = app.test_client()
+    first = client.get('/api/lobby/list?phase=open&limit=500')
+    lobbies = json.loads(first.data)
+    assert lobby_id in [lobby['lobby_id'] for lobby in lobbies['lobbies']]
+    assert lobbies['limit'] == 200
+    assert client.get('/api/lobby/list?phase=open&limit=500',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    # another page or filter is another answer
+    assert client.get('/api/lobby/list?phase=running').headers['ETag'] != first.headers['ETag']
+    assert client.get('/api/lobby/list?phase=bogus').status_code == 400
+
+    app.test_client().post('/api/lobby/{}/register'.format(lobby_id), data={'name': 'Zé'})
+    changed = client.get('/api/lobby/list?phase=open&limit=500', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    by_prefix = json.loads(client.get('/api/lobby/list?prefix=z%C3%A9').data)['lobbies']
+    assert [lobby['names'] for lobby in by_prefix if lobby['lobby_id'] == lobby_id] == [['Zé']]
+    store.delete(lobby_id)
+
+
+def test_metrics_only_with_metrics_1():
+    assert not app.config['METRICS']
+    assert app.test_client().get('/metrics').status_code == 404
+    # read when the app is imported: another process
+    script = ("from app import app\n"
+              "client = app.test_client()\n"
+              "client.get('/api/lobby/list')\n"
+              "response = client.get('/metrics')\n"
+              "print(response.status_code)\n"
+              "print(response.data.decode())\n")
+    output = subprocess.run([sys.executable, '-c', script], env=dict(os.environ, METRICS='1'),
+                            cwd=os.path.dirname(os.path.dirname(__file__)),
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    status, text = output.split('\n', 1)
+    assert status == '200'
+    assert 'fodinha_requests_total{method="GET",route="/api/lobby/list",status="200"} 1' in text
@@ -0,0 +1,32 @@
+"""The card images given to the clients: a place in the atlas, or a PNG"""
+import json
+import os
+
+from app import sprites
+from app.views import LobbyViews
+from fodinha import Lobby
+
+
+def test_cards_are_places_in_the_atlas():
+    for code, image in sprites.card_images.items():
+        assert image['url'] == sprites.SPRITES_URL + sprites.sprite_map['image']
+        assert [image['x'], image['y'], image['w'], image['h']] == sprites.sprite_map['cards'][code]
+        assert image['x'] + image['w'] <= sprites.sprite_map['width']
+        assert image['y'] + image['h'] <= sprites.sprite_map['height']
+    assert os.path.exists(os.path.join(sprites.SPRITES_DIR, sprites.sprite_map['image']))
+
+
+def test_cards_without_atlas_are_pngs(monkeypatch):
+    monkeypatch.setattr(sprites, 'sprite_map', None)
+    image = sprites.card_image_url('12;3')
+    assert image == {'url': '/static/cards/queen_of_hearts.png'}
+    assert os.path.exists(os.path.join(sprites.CARDS_DIR, os.path.basename(image['url'])))
+
+
+def test_hands_come_with_their_images():
+    lobby = Lobby(0, 2, seed=1)
+    for seat in range(2):
+        lobby.register_player('p{}'.format(seat))
+    lobby.start_game()
+    cards = json.loads(LobbyViews(lobby).cards[0])
+    assert cards['images'] == [sprites.card_images[code] for code in cards['cards']]
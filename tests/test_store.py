@@ -0,0 +1,210 @@
+"""The lobby stores: pages of the lobby browser, locks shared by threads"""
+import random
+import threading
+import time
+
+import pytest
+
+from app.store import (PHASES, JournalLobbyStore, MemoryLobbyStore, RWLock, SQLiteLobbyStore, lobby_phase,
+                       lobby_summary)
+from fodinha import TurnType
+
+NAMES = ['Ana', 'bruno', 'Carla', 'dog', 'formigas', 'pitoco', 'Zé']
+
+
+@pytest.fixture
+def persistent_store():
+    """Return a factory of PersistentLobbyStore on an empty database"""
+    from app import app, db
+    from app.persistence import PersistentLobbyStore
+    stores = []
+
+    def new_store():
+        stores.append(PersistentLobbyStore(app, interval=3600))
+        return stores[-1]
+
+    with app.app_context():
+        db.drop_all()
+    yield new_store
+    # nothing left for the flush at exit
+    for store in stores:
+        store.flush()
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'journal', 'sqlalchemy'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryLobbyStore()
+    elif request.param == 'sqlite':
+        yield SQLiteLobbyStore(str(tmp_path / 'lobbies.db'))
+    elif request.param == 'journal':
+        store = JournalLobbyStore(str(tmp_path / 'fodinha.journal'), snapshot_interval=3600)
+        yield store
+        store.journal.close()
+    else:
+        yield request.getfixturevalue('persistent_store')()
+
+
+def fill(store, number_of_lobbies, seed=0):
+    """Create lobbies in every phase, return their IDs"""
+    rng = random.Random(seed)
+    lobby_ids = [store.create(rng.randint(2, 5)) for _ in range(number_of_lobbies)]
+    # joined in any order, not lobby after lobby
+    joins = [lobby_id for lobby_id in lobby_ids for _ in range(rng.randint(0, store.get(lobby_id).number_of_players))]
+    rng.shuffle(joins)
+    for lobby_id in joins:
+        with store.edit(lobby_id) as lobby:
+            lobby.register_player(rng.choice(NAMES) + str(len(lobby.players)))
+            if len(lobby.players) == lobby.number_of_players:
+                lobby.start_game()
+                if rng.random() < 0.3:
+                    lobby.current_turn_type = TurnType.GAME_OVER
+    return lobby_ids
+
+
+def expected_page(store, phase, offset, limit, number_of_players, prefix):
+    matching = [lobby_summary(lobby) for lobby in sorted(store.list(), key=lambda lobby: lobby.lobby_id)
+                if (phase is None or lobby_phase(lobby) == phase)
+                and (number_of_players is None or lobby.number_of_players == number_of_players)
+                and (not prefix or any(player.name.lower().startswith(prefix) for player in lobby.players))]
+    return matching[offset:None if limit is None else offset + limit], len(matching)
+
+
+def test_page_matches_the_lobbies(store):
+    fill(store, 60)
+    for phase in (None,) + PHASES:
+        for number_of_players in (None, 3):
+            for prefix in ('', 'c', 'zé', 'nobody'):
+                for offset, limit in ((0, None), (0, 7), (5, 7), (100, 7)):
+                    page = store.page(phase, offset, limit, number_of_players, prefix)
+                    assert page == expected_page(store, phase, offset, limit, number_of_players, prefix)
+
+
+def test_page_follows_the_edits(store):
+    lobby_id = store.create(2)
+    generation = store.generation()
+    assert store.page(phase='open') == ([{'lobby_id': lobby_id, 'number_of_players': 2, 'names': [],
+                                          'phase': 'open'}], 1)
+    for seat in range(2):
+        with store.edit(lobby_id) as lobby:
+            lobby.register_player('p{}'.format(seat))
+            if seat == 1:
+                lobby.start_game()
+    assert store.generation() != generation
+    assert store.page(phase='open') == ([], 0)
+    assert store.page(phase='running')[0][0]['names'] == ['p0', 'p1']
+    store.delete(lobby_id)
+    assert store.page() == ([], 0)
+
+
+def test_page_does_not_load_the_lobbies(tmp_path, persistent_store):
+    store = persistent_store()
+    fill(store, 40)
+    store.flush()
+    expected = [store.page(phase, 3, 10, None, prefix) for phase in (None,) + PHASES for prefix in ('', 'p')]
+    # after a restart, the lobbies are only read back when a player asks for them
+    restarted = persistent_store()
+    assert [restarted.page(phase, 3, 10, None, prefix)
+            for phase in (None,) + PHASES for prefix in ('', 'p')] == expected
+    assert not restarted._lobbies
+
+    store = SQLiteLobbyStore(str(tmp_path / 'lobbies.db'))
+    fill(store, 40)
+    expected = [store.page(phase, 3, 10, None, prefix) for phase in (None,) + PHASES for prefix in ('', 'p')]
+    store.loads = None
+    assert [store.page(phase, 3, 10, None, prefix)
+            for phase in (None,) + PHASES for prefix in ('', 'p')] == expected
+
+
+def test_rwlock_keeps_writers_alone():
+    lock = RWLock()
+    inside = {'readers': 0, 'writers': 0}
+    guard = threading.Lock()
+    errors = []
+
+    def enter(kind):
+        with guard:
+            inside[kind] += 1
+            if inside['writers'] > 1 or (inside['writers'] and inside['readers']):
+                errors.append(dict(inside))
+
+    def leave(kind):
+        with guard:
+            inside[kind] -= 1
+
+    def reader():
+        for _ in range(300):
+            with lock.read():
+                enter('readers')
+                time.sleep(0)
+                leave('readers')
+
+    def writer():
+        for _ in range(100):
+            with lock:
+                enter('writers')
+                time.sleep(0)
+                leave('writers')
+
+    threads = [threading.Thread(target=reader) for _ in range(8)] + [threading.Thread(target=writer) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads)
+    assert not errors
+    assert inside == {'readers': 0, 'writers': 0}
+
+
+def test_read_never_sees_an_edit_in_progress(store):
+    lobby_ids = [store.create(2) for _ in range(3)]
+    errors = []
+    stop = threading.Event()
+
+    def writer(seed):
+        rng = random.Random(seed)
+        for _ in range(60):
+            with store.edit(rng.choice(lobby_ids)) as lobby:
+                # odd only in the middle of an edit
+                lobby.version += 1
+                time.sleep(0)
+                lobby.version += 1
+
+    def reader(seed):
+        rng = random.Random(seed)
+        seen = dict.fromkeys(lobby_ids, 0)
+        while not stop.is_set():
+            lobby_id = rng.choice(lobby_ids)
+            with store.read(lobby_id) as lobby:
+                version = lobby.version
+                time.sleep(0)
+                if version % 2 or version < seen[lobby_id] or lobby.version != version:
+                    errors.append((lobby_id, seen[lobby_id], version, lobby.version))
+            seen[lobby_id] = version
+
+    writers = [threading.Thread(target=writer, args=(seed,)) for seed in range(4)]
+    readers = [threading.Thread(target=reader, args=(seed,)) for seed in range(6)]
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join(60)
+    stop.set()
+    for thread in readers:
+        thread.join(60)
+    assert not any(thread.is_alive() for thread in writers + readers)
+    assert not errors
+    assert sum(store.version(lobby_id) for lobby_id in lobby_ids) == 4 * 60 * 2
+
+
+def test_wait_ends_when_the_lobby_is_deleted():
+    store = MemoryLobbyStore()
+    lobby_id = store.create(2)
+    threading.Timer(0.1, store.delete, (lobby_id,)).start()
+    started = time.monotonic()
+    with pytest.raises(KeyError):
+        store.wait(lobby_id, 0, timeout=10)
+    assert time.monotonic() - started < 5
+    with pytest.raises(KeyError):
+        store.wait(lobby_id, 0, timeout=0.1)